@@ -98,12 +98,17 @@ def CommonChecks(input_api, output_api, *, is_upload):
         J('gyp', 'java_cpp_features_tests.py'),
         J('gyp', 'java_cpp_strings_tests.py'),
         J('gyp', 'java_google_api_keys_tests.py'),
+        J('gyp', 'util', 'dep_utils_test.py'),
         J('gyp', 'util', 'java_cpp_utils_test.py'),
         J('gyp', 'util', 'manifest_utils_test.py'),
         J('gyp', 'util', 'md5_check_test.py'),
+        J('gyp', 'util', 'parallel_test.py'),
+        J('gyp', 'util', 'params_json_util_test.py'),
+        J('gyp', 'util', 'resource_caches_test.py'),
         J('gyp', 'util', 'resource_utils_test.py'),
         J('pylib', 'base', 'output_manager_test_case.py'),
         J('pylib', 'constants', 'host_paths_unittest.py'),
+        J('pylib', 'dex', 'dex_parser_test.py'),
         J('pylib', 'gtest', 'gtest_test_instance_test.py'),
         J('pylib', 'instrumentation', 'instrumentation_parser_test.py'),
         J('pylib', 'instrumentation', 'instrumentation_test_instance_test.py'),
@@ -128,11 +133,14 @@ def CommonChecks(input_api, output_api, *, is_upload):
             'json_results_generator_unittest.py',
         ),
         J('pylib', 'results', 'json_results_test.py'),
+        J('pylib', 'symbols', 'expensive_line_transformer_test.py'),
+        J('pylib', 'symbols', 'retrace_test.py'),
         J('pylib', 'utils', 'code_coverage_utils_test.py'),
         J('pylib', 'utils', 'device_dependencies_test.py'),
         J('pylib', 'utils', 'dexdump_test.py'),
         J('pylib', 'utils', 'gold_utils_test.py'),
         J('pylib', 'utils', 'test_filter_test.py'),
+        J('pylib', 'utils', 'test_timings_test.py'),
     ]
     if is_upload:
         pytests += [J('.', 'fast_local_dev_server_test.py')]
@@ -11,6 +11,11 @@ import collections
 import contextlib
 import dataclasses
 import datetime
+import functools
+import hashlib
+import heapq
+import itertools
+import json
 import os
 import pathlib
 import re
@@ -30,6 +35,41 @@ from util import server_utils
 
 _SOCKET_TIMEOUT = 60  # seconds
 
+_WRITE_BUILD_CONFIG_SCRIPT = (
+    pathlib.Path(__file__).parent / 'gyp' / 'write_build_config.py'
+)
+
+# Tasks of the kinds listed first are started first. The slowest kinds come
+# first so that they do not end up as the long tail of a build's backlog.
+_TASK_KIND_ORDER = (
+    'lint',
+    'errorprone',
+    'tracereferences',
+    'check_for_missing_direct_deps',
+)
+
+# Percentage of time (over the last 10 seconds) that some tasks were stalled on
+# memory, above which tasks are started one at a time.
+_MEMORY_PRESSURE_MODERATE = 2.0
+# Above this, new tasks are only started when none are running.
+_MEMORY_PRESSURE_HIGH = 10.0
+
+# Environment variables that can change the result of a task.
+_RESULT_CACHE_ENV_VARS = (
+    'JAVA_HOME',
+    'KYTHE_CORPUS',
+    'KYTHE_ROOT_DIRECTORY',
+    'LANG',
+    'LC_ALL',
+    'LINT_DEBUG',
+    'PATH',
+    'PRINT_FULL_COMMAND',
+    'PYTHONPATH',
+)
+_RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Bump when the cache key or entry format changes.
+_RESULT_CACHE_VERSION = 1
+
 _LOGFILE_NAME = 'buildserver.log'
 _MAX_LOGFILES = 6
 
@@ -97,11 +137,13 @@ def _exception_hook(exctype: type, exc: Exception, tb):
 class OptionsManager:
     _quiet = None
     _should_remote_print = None
+    _use_result_cache = True
 
     @classmethod
-    def set_options(cls, *, quiet, should_remote_print):
+    def set_options(cls, *, quiet, should_remote_print, use_result_cache=True):
         cls._quiet = quiet
         cls._should_remote_print = should_remote_print
+        cls._use_result_cache = use_result_cache
 
     @classmethod
     def is_quiet(cls):
@@ -113,6 +155,10 @@ class OptionsManager:
         assert cls._should_remote_print is not None
         return cls._should_remote_print
 
+    @classmethod
+    def use_result_cache(cls):
+        return cls._use_result_cache
+
 
 class LogfileManager:
     _logfiles: dict[str, IO[str]] = {}
@@ -227,6 +273,8 @@ class TaskStats:
         return {
             'pid': os.getpid(),
             'builds': build_infos,
+            'scheduler': TaskManager.get_scheduler_status(),
+            'result_cache': ResultCache.get_stats(),
         }
 
     @classmethod
@@ -257,6 +305,58 @@ def check_pid_alive(pid: int):
     return True
 
 
+def _parse_memory_pressure(text: str) -> Optional[float]:
+    """Returns the "some avg10" value of a PSI memory.pressure file."""
+    for line in text.splitlines():
+        if line.startswith('some '):
+            for field in line.split()[1:]:
+                key, _, value = field.partition('=')
+                if key == 'avg10':
+                    return float(value)
+    return None
+
+
+@functools.cache
+def _memory_pressure_paths() -> List[pathlib.Path]:
+    """Returns the PSI files of the system and of the server's cgroup."""
+    paths = [pathlib.Path('/proc/pressure/memory')]
+    try:
+        cgroup_lines = pathlib.Path('/proc/self/cgroup').read_text()
+    except OSError:
+        cgroup_lines = ''
+    for line in cgroup_lines.splitlines():
+        # The cgroup v2 entry is of the form "0::/path/to/cgroup".
+        if line.startswith('0::'):
+            cgroup_dir = pathlib.Path('/sys/fs/cgroup') / line[3:].lstrip('/')
+            paths.append(cgroup_dir / 'memory.pressure')
+    return [p for p in paths if p.exists()]
+
+
+def get_memory_pressure() -> Optional[float]:
+    """Returns the highest memory pressure, or None if PSI is unavailable.
+
+    A limited cgroup can be under pressure while the system as a whole is not,
+    so the cgroup's pressure is taken into account as well.
+    """
+    values = []
+    for path in _memory_pressure_paths():
+        try:
+            value = _parse_memory_pressure(path.read_text())
+        except OSError:
+            continue
+        if value is not None:
+            values.append(value)
+    return max(values, default=None)
+
+
+@functools.cache
+def _ionice_prefix() -> List[str]:
+    """Returns the command prefix that puts a process in the idle I/O class."""
+    if shutil.which('ionice'):
+        return ['ionice', '-c', '3']
+    return []
+
+
 @dataclasses.dataclass
 class Build:
     id: str
@@ -269,6 +369,10 @@ class Build:
     _tasks: List[Task] = dataclasses.field(default_factory=list)
     _completed_task_count = 0
     _active_process_count = 0
+    # Used to start the tasks of the most recently registered build first.
+    registered_time: float = dataclasses.field(
+        default_factory=time.monotonic, init=False
+    )
     _lock: threading.RLock = dataclasses.field(
         default_factory=threading.RLock, repr=False, init=False
     )
@@ -489,18 +593,35 @@ class BuildManager:
 
 
 class TaskManager:
-    """Class to encapsulate a threadsafe queue and handle deactivating it."""
+    """Encapsulates a threadsafe priority queue and handles deactivating it.
+
+    Tasks of the most recently registered build are started first, then by
+    kind (see _TASK_KIND_ORDER), then in the order they were added.
+    """
 
-    _queue: collections.deque[Task] = collections.deque()
+    # Entries are (priority, sequence number, task).
+    _queue: list[tuple[tuple[float, int], int, Task]] = []
+    _sequence = itertools.count()
     _current_tasks: set[Task] = set()
     _deactivated = False
+    _scheduler_status: dict = {}
     _lock = threading.RLock()
 
+    @staticmethod
+    def _priority(task: Task) -> tuple[float, int]:
+        try:
+            kind_index = _TASK_KIND_ORDER.index(task.kind)
+        except ValueError:
+            kind_index = len(_TASK_KIND_ORDER)
+        return (-task.build.registered_time, kind_index)
+
     @classmethod
     def add_task(cls, task: Task):
         assert not cls._deactivated
         with cls._lock:
-            cls._queue.appendleft(task)
+            heapq.heappush(
+                cls._queue, (cls._priority(task), next(cls._sequence), task)
+            )
         cls._maybe_start_tasks()
 
     @classmethod
@@ -518,9 +639,8 @@ class TaskManager:
         cls._deactivated = True
         tasks_to_terminate: list[Task] = []
         with cls._lock:
-            while cls._queue:
-                task = cls._queue.pop()
-                tasks_to_terminate.append(task)
+            tasks_to_terminate.extend(task for _, _, task in cls._queue)
+            cls._queue.clear()
             # Cancel possibly running tasks.
             tasks_to_terminate.extend(cls._current_tasks)
         # Terminate outside lock since task threads need the lock to finish
@@ -534,11 +654,14 @@ class TaskManager:
         terminated_current_tasks: list[Task] = []
         with cls._lock:
             # Cancel pending tasks.
-            for task in cls._queue:
-                if task.build.id == build_id:
-                    terminated_pending_tasks.append(task)
-            for task in terminated_pending_tasks:
-                cls._queue.remove(task)
+            remaining = []
+            for entry in cls._queue:
+                if entry[2].build.id == build_id:
+                    terminated_pending_tasks.append(entry[2])
+                else:
+                    remaining.append(entry)
+            heapq.heapify(remaining)
+            cls._queue[:] = remaining
             # Cancel running tasks.
             for task in cls._current_tasks:
                 if task.build.id == build_id:
@@ -560,33 +683,374 @@ class TaskManager:
         assert False, 'Could not read /proc/stat'
 
     @classmethod
-    def _maybe_start_tasks(cls):
-        if cls._deactivated:
-            return
+    def get_scheduler_status(cls):
+        """Returns the inputs and outcome of the latest scheduling decision."""
+        with cls._lock:
+            queued_by_kind = collections.Counter(
+                task.kind for _, _, task in cls._queue
+            )
+            return {
+                **cls._scheduler_status,
+                'queued_tasks': len(cls._queue),
+                'queued_by_kind': dict(queued_by_kind),
+                'running_tasks': len(cls._current_tasks),
+            }
+
+    @classmethod
+    def _compute_start_limits(cls):
+        """Returns how many tasks to start at most, ignoring running ones."""
+        cpu_count = os.cpu_count()
         # Include load avg so that a small dip in the number of currently running
         # processes will not cause new tasks to be started while the overall load is
         # heavy.
         cur_load = max(cls._num_running_processes(), os.getloadavg()[0])
+        # Limit the number of new tasks to prevent ramping up too fast, since the
+        # load avg takes a while to catch up. Large machines can ramp up faster.
+        max_new_tasks = max(2, cpu_count // 16)
+        # Tasks are started while this is positive.
+        cpu_headroom = cpu_count - cur_load
+        memory_pressure = get_memory_pressure()
+        throttled_by = None
+        if cpu_headroom <= 0:
+            throttled_by = 'cpu'
+        if memory_pressure is not None:
+            if memory_pressure >= _MEMORY_PRESSURE_HIGH:
+                cpu_headroom = 0
+                throttled_by = 'memory'
+            elif memory_pressure >= _MEMORY_PRESSURE_MODERATE:
+                max_new_tasks = 1
+        with cls._lock:
+            cls._scheduler_status = {
+                'load': cur_load,
+                'cpu_count': cpu_count,
+                'memory_pressure': memory_pressure,
+                'max_new_tasks': max_new_tasks,
+                'throttled_by': throttled_by,
+            }
+        return max_new_tasks, cpu_headroom
+
+    @classmethod
+    def _maybe_start_tasks(cls):
+        if cls._deactivated:
+            return
+        max_new_tasks, cpu_headroom = cls._compute_start_limits()
         num_started = 0
         # Always start a task if we don't have any running, so that all tasks are
-        # eventually finished. Try starting up tasks when the overall load is light.
-        # Limit to at most 2 new tasks to prevent ramping up too fast. There is a
-        # chance where multiple threads call _maybe_start_tasks and each gets to
-        # spawn up to 2 new tasks, but since the only downside is some build tasks
-        # get worked on earlier rather than later, it is not worth mitigating.
-        while num_started < 2 and (
-            TaskStats.no_running_processes()
-            or num_started + cur_load < os.cpu_count()
+        # eventually finished. There is a chance where multiple threads call
+        # _maybe_start_tasks and each gets to spawn up to |max_new_tasks|, but
+        # since the only downside is some build tasks get worked on earlier rather
+        # than later, it is not worth mitigating.
+        while num_started < max_new_tasks and (
+            TaskStats.no_running_processes() or num_started < cpu_headroom
         ):
             with cls._lock:
                 try:
-                    next_task = cls._queue.pop()
+                    next_task = heapq.heappop(cls._queue)[2]
                     cls._current_tasks.add(next_task)
                 except IndexError:
                     return
             num_started += next_task.start(cls._maybe_start_tasks)
 
 
+class BuildConfigWriter:
+    """Manages a long-lived write_build_config.py process.
+
+    The process keeps .params.json files parsed in memory so that each request
+    does not need to start up python and re-parse the dependency graph.
+    """
+
+    _proc: Optional[subprocess.Popen] = None
+    _address = f'\0chromium_build_server_write_build_config_{os.getpid()}'
+    _lock = threading.Lock()
+
+    @classmethod
+    def _ensure_started(cls):
+        with cls._lock:
+            if cls._proc and cls._proc.poll() is None:
+                return
+            # Bind in this process so that requests can be sent immediately.
+            with contextlib.closing(socket.socket(socket.AF_UNIX)) as listener:
+                listener.bind(cls._address)
+                listener.listen()
+                env = os.environ.copy()
+                # Prevent write_build_config.py from sending requests to us.
+                env[server_utils.BUILD_SERVER_ENV_VARIABLE] = '1'
+                cls._proc = subprocess.Popen(
+                    [
+                        sys.executable,
+                        str(_WRITE_BUILD_CONFIG_SCRIPT),
+                        '--serve-fd',
+                        str(listener.fileno()),
+                    ],
+                    env=env,
+                    pass_fds=(listener.fileno(),),
+                )
+
+    @classmethod
+    def write_build_config(cls, data) -> dict:
+        """Returns the returncode and output of running write_build_config.py."""
+        cls._ensure_started()
+        with contextlib.closing(socket.socket(socket.AF_UNIX)) as sock:
+            # So that a wedged process does not block the handler forever. The
+            # client then runs write_build_config.py itself.
+            sock.settimeout(_SOCKET_TIMEOUT)
+            sock.connect(cls._address)
+            server_utils.SendMessage(sock, data)
+            response = server_utils.ReceiveMessage(sock)
+        if response is None:
+            raise RuntimeError('write_build_config.py did not respond')
+        return response
+
+    @classmethod
+    def stop(cls):
+        with cls._lock:
+            if cls._proc:
+                cls._proc.terminate()
+                cls._proc.wait()
+                cls._proc = None
+
+
+def _parse_depfile(text: str) -> List[str]:
+    """Returns the inputs listed in a depfile written by action_helpers."""
+    _, _, inputs = text.replace('\\\n', ' ').partition(': ')
+    # Spaces within paths are escaped.
+    return [p.replace('\\ ', ' ') for p in re.split(r'(?<!\\)\s+', inputs) if p]
+
+
+def _get_flag_value(cmd: List[str], flag: str) -> Optional[str]:
+    for i, arg in enumerate(cmd):
+        if arg == flag and i + 1 < len(cmd):
+            return cmd[i + 1]
+        if arg.startswith(flag + '='):
+            return arg[len(flag) + 1 :]
+    return None
+
+
+def _expand_file_args(cwd: pathlib.Path, cmd: List[str]) -> List[str]:
+    """Returns the values that the @FileArg()s of a command expand to.
+
+    Like build_utils.ExpandFileArgs(), but returns the items of lists rather than
+    GN-formatted strings. Raises if a JSON file or key does not exist.
+    """
+    ret = []
+    file_jsons = {}
+    for arg in cmd:
+        for match in re.finditer(r'@FileArg\((.*?)\)', arg):
+            file_path, *keys = match.group(1).split(':')
+            file_path = file_path.removesuffix('[]')
+            if file_path not in file_jsons:
+                file_jsons[file_path] = json.loads(
+                    (cwd / file_path).read_text()
+                )
+            value = file_jsons[file_path]
+            for key in keys:
+                if key.endswith('[]'):
+                    (value,) = value[key[:-2]]
+                else:
+                    value = value[key]
+            if isinstance(value, list):
+                ret.extend(str(v) for v in value)
+            else:
+                ret.append(str(value))
+    return ret
+
+
+def _expand_response_files(cwd: pathlib.Path, cmd: List[str]) -> List[str]:
+    """Returns the items listed in the @response_files of a command.
+
+    E.g. errorprone reads its sources from an @.sources file, and lists only
+    its classpath in its depfile. Items are one per line, as written by GN.
+    Raises if a response file does not exist.
+    """
+    ret = []
+    for arg in cmd[1:]:
+        for value in (arg, arg.partition('=')[2]):
+            if value.startswith('@') and not value.startswith('@FileArg('):
+                lines = (cwd / value[1:]).read_text().splitlines()
+                ret.extend(l.strip() for l in lines if l.strip())
+    return ret
+
+
+def _iter_command_paths(cmd: List[str]):
+    """Yields the arguments of a command that may be paths to input files."""
+    for arg in cmd[1:]:
+        for value in (arg, arg.partition('=')[2]):
+            # @FileArg(path:key) and @response_file arguments.
+            if value.startswith('@FileArg('):
+                yield value[len('@FileArg(') :].partition(':')[0]
+            elif value.startswith('@'):
+                yield value[1:]
+            elif value:
+                yield value
+
+
+class ResultCache:
+    """A local content-addressed cache of the results of tasks.
+
+    Tasks are keyed by their command, cwd, the relevant environment variables
+    and the digests of their inputs: the files listed in their depfile, the
+    files named on their command line (including those that @FileArg()s expand
+    to and those listed in @response_files) and the python files listed in
+    their script's .pydeps. Tasks without a
+    depfile are not cached, since what they read is not known.
+
+    Each entry holds the return code and output of a task. Entries are evicted
+    least recently used first once they exceed _RESULT_CACHE_MAX_BYTES.
+    """
+
+    _dir = (
+        pathlib.Path(
+            os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home() / '.cache'
+        )
+        / 'chromium_build_server'
+        / 'results'
+    )
+    # Maps keys to entry sizes, least recently used first. Loaded on first use.
+    _entries: Optional[collections.OrderedDict[str, int]] = None
+    _total_bytes = 0
+    _hits = 0
+    _misses = 0
+    # Maps paths to (stat key, digest), so that unchanged files are not re-read.
+    _digests: dict[str, tuple[tuple[int, int, int], str]] = {}
+    _lock = threading.RLock()
+
+    @classmethod
+    def _digest(cls, path: pathlib.Path) -> Optional[str]:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        stat_key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        cached = cls._digests.get(str(path))
+        if cached and cached[0] == stat_key:
+            return cached[1]
+        hasher = hashlib.sha256()
+        try:
+            with path.open('rb') as f:
+                while chunk := f.read(1024 * 1024):
+                    hasher.update(chunk)
+        except OSError:
+            return None
+        digest = hasher.hexdigest()
+        cls._digests[str(path)] = (stat_key, digest)
+        return digest
+
+    @classmethod
+    def compute_key(cls, task: Task) -> Optional[str]:
+        """Returns the cache key of a task, or None if it cannot be cached."""
+        cwd = pathlib.Path(task.build.cwd)
+        depfile = _get_flag_value(task.cmd, '--depfile')
+        if not depfile:
+            return None
+        try:
+            inputs = set(_parse_depfile((cwd / depfile).read_text()))
+        except OSError:
+            return None
+        excluded = {depfile, task.stamp_file}
+        try:
+            # E.g. lint's --classpath=@FileArg(...) lists jars that are in
+            # neither its depfile nor its command line.
+            file_arg_values = _expand_file_args(cwd, task.cmd)
+            response_file_values = _expand_response_files(cwd, task.cmd)
+        except (OSError, ValueError, LookupError, TypeError):
+            return None
+        inputs.update(
+            p
+            for p in itertools.chain(
+                _iter_command_paths(task.cmd),
+                file_arg_values,
+                response_file_values,
+            )
+            if p not in excluded and (cwd / p).is_file()
+        )
+        script = next((a for a in task.cmd if a.endswith('.py')), None)
+        if script:
+            pydeps = (cwd / script).with_suffix('.pydeps')
+            try:
+                lines = pydeps.read_text().splitlines()
+            except OSError:
+                lines = []
+            inputs.update(
+                os.path.join(pydeps.parent, l)
+                for l in lines
+                if l and not l.startswith('#')
+            )
+        digests = sorted((p, cls._digest(cwd / p)) for p in inputs)
+        env = {k: task.build.env.get(k) for k in _RESULT_CACHE_ENV_VARS}
+        data = [_RESULT_CACHE_VERSION, task.cmd, str(cwd), env, digests]
+        return hashlib.sha256(json.dumps(data).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _ensure_loaded(cls):
+        if cls._entries is not None:
+            return
+        entries = []
+        if cls._dir.exists():
+            for path in cls._dir.iterdir():
+                if path.suffix == '.tmp':
+                    path.unlink(missing_ok=True)
+                    continue
+                st = path.stat()
+                entries.append((st.st_mtime, path.name, st.st_size))
+        entries.sort()
+        cls._entries = collections.OrderedDict(
+            (name, size) for _, name, size in entries
+        )
+        cls._total_bytes = sum(cls._entries.values())
+
+    @classmethod
+    def _remove(cls, key: str):
+        cls._total_bytes -= cls._entries.pop(key)
+        (cls._dir / key).unlink(missing_ok=True)
+
+    @classmethod
+    def lookup(cls, key: str) -> Optional[dict]:
+        """Returns the recorded result of a task, or None."""
+        with cls._lock:
+            cls._ensure_loaded()
+            if key not in cls._entries:
+                cls._misses += 1
+                return None
+            path = cls._dir / key
+            try:
+                result = json.loads(path.read_text())
+                # The mtime orders entries for eviction after a restart.
+                os.utime(path)
+            except (OSError, ValueError):
+                cls._remove(key)
+                cls._misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls._hits += 1
+            return result
+
+    @classmethod
+    def store(cls, key: str, returncode: int, stdout: str):
+        data = json.dumps({'returncode': returncode, 'stdout': stdout}).encode()
+        with cls._lock:
+            cls._ensure_loaded()
+            cls._dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cls._dir / f'{key}.tmp'
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, cls._dir / key)
+            if key in cls._entries:
+                cls._total_bytes -= cls._entries.pop(key)
+            cls._entries[key] = len(data)
+            cls._total_bytes += len(data)
+            while cls._entries and cls._total_bytes > _RESULT_CACHE_MAX_BYTES:
+                cls._remove(next(iter(cls._entries)))
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            return {
+                'hits': cls._hits,
+                'misses': cls._misses,
+                'entries': len(cls._entries or ()),
+                'bytes': cls._total_bytes,
+            }
+
+
 # TODO(wnwen): Break this into Request (encapsulating what ninja sends) and Task
 #              when a Request starts to be run. This would eliminate ambiguity
 #              about when and whether _proc/_thread are initialized.
@@ -607,11 +1071,22 @@ class Task:
         self._thread: Optional[threading.Thread] = None
         self._delete_stamp_thread: Optional[threading.Thread] = None
         self._return_code: Optional[int] = None
+        self._cache_key: Optional[str] = None
+        # Whether _thread is hashing the task's inputs.
+        self._hashing = False
 
     @property
     def key(self):
         return (self.build.cwd, self.name)
 
+    @property
+    def kind(self):
+        """The name of the script that the task runs, e.g. "lint"."""
+        for arg in self.cmd:
+            if arg.endswith('.py'):
+                return pathlib.PurePath(arg).stem
+        return pathlib.PurePath(self.cmd[0]).name if self.cmd else ''
+
     def __hash__(self):
         return hash((self.key, self.build.id))
 
@@ -621,20 +1096,62 @@ class Task:
     def start(self, on_complete_callback: Callable[[], None]) -> int:
         """Starts the task if it has not already been terminated.
 
-        Returns the number of processes that have been started. This is called at
-        most once when the task is popped off the task queue."""
+        Returns the number of processes that have been started (a task replayed
+        from the result cache counts as one). This is called at most once when
+        the task is popped off the task queue."""
         with self._lock:
             if self._terminated:
                 return 0
+            self._thread = threading.Thread(
+                target=self._run, args=(on_complete_callback,)
+            )
+            self._thread.start()
+            return 1
 
-            # Use os.nice(19) to ensure the lowest priority (idle) for these analysis
-            # tasks since we want to avoid slowing down the actual build.
-            # TODO(wnwen): Use ionice to reduce resource consumption.
+    def _run(self, on_complete_callback: Callable[[], None]):
+        # The cache key is computed here rather than in start() since hashing
+        # the inputs would otherwise hold up the server's request loop.
+        if OptionsManager.use_result_cache():
+            self._cache_key = self._compute_cache_key()
+        result = None
+        if self._cache_key and not self._terminated:
+            result = ResultCache.lookup(self._cache_key)
+        if result:
+            self._return_code = result['returncode']
+            self._complete(result['stdout'], cached=True)
+        else:
+            self._start_process()
+            if self._proc:
+                self._complete_when_process_finishes()
+            else:
+                # Terminated before the process was started.
+                self._complete()
+        on_complete_callback()
+
+    def _compute_cache_key(self) -> Optional[str]:
+        """Returns ResultCache.compute_key(), or None once terminated."""
+        with self._lock:
+            if self._terminated:
+                return None
+            self._hashing = True
+        try:
+            return ResultCache.compute_key(self)
+        finally:
+            with self._lock:
+                self._hashing = False
+
+    def _start_process(self):
+        with self._lock:
+            if self._terminated:
+                return
+            # Use os.nice(19) and the idle I/O class to ensure the lowest priority
+            # for these analysis tasks since we want to avoid slowing down the
+            # actual build.
             self.build.add_process(self)
             # This use of preexec_fn is sufficiently simple, just one os.nice call.
             # pylint: disable=subprocess-popen-preexec-fn
             self._proc = subprocess.Popen(
-                self.cmd,
+                _ionice_prefix() + self.cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 cwd=self.build.cwd,
@@ -642,12 +1159,6 @@ class Task:
                 text=True,
                 preexec_fn=lambda: os.nice(19),
             )
-            self._thread = threading.Thread(
-                target=self._complete_when_process_finishes,
-                args=(on_complete_callback,),
-            )
-            self._thread.start()
-            return 1
 
     def terminate(self, replaced=False):
         """Can be called multiple times to cancel and ignore the task's output."""
@@ -656,9 +1167,11 @@ class Task:
                 return
             self._terminated = True
             self._replaced = replaced
+            hashing = self._hashing
 
         # It is safe to access _proc and _thread outside of _lock since they are
-        # only changed by self.start holding _lock when self._terminate is false.
+        # only changed by self.start and self._start_process holding _lock when
+        # self._terminate is false.
         # Since we have just set self._terminate to true inside of _lock, we know
         # that neither _proc nor _thread will be changed from this point onwards.
         if self._proc:
@@ -666,30 +1179,39 @@ class Task:
             self._proc.wait()
         # Ensure that self._complete is called either by the thread or by us.
         if self._thread:
-            self._thread.join()
+            # The thread completes the task once it is done hashing. Waiting for
+            # that would block the request loop, which replaces tasks.
+            if not hashing:
+                self._thread.join()
         else:
             self._complete()
 
-    def _complete_when_process_finishes(
-        self, on_complete_callback: Callable[[], None]
-    ):
+    def _complete_when_process_finishes(self):
         assert self._proc
         # We know Popen.communicate will return a str and not a byte since it is
         # constructed with text=True.
         stdout: str = self._proc.communicate()[0]
         self._return_code = self._proc.returncode
         self.build.process_complete()
+        # Skip results of killed processes, and of tasks whose inputs changed
+        # while they ran.
+        if (
+            self._cache_key
+            and not self._terminated
+            and self._return_code >= 0
+            and self._compute_cache_key() == self._cache_key
+        ):
+            ResultCache.store(self._cache_key, self._return_code, stdout)
         self._complete(stdout)
-        on_complete_callback()
 
-    def _complete(self, stdout: str = ''):
+    def _complete(self, stdout: str = '', cached: bool = False):
         """Update the user and ninja after the task has run or been terminated.
 
         This method should only be run once per task. Avoid modifying the task so
         that this method does not need locking."""
 
         delete_stamp = False
-        status_string = 'FINISHED'
+        status_string = 'CACHED' if cached else 'FINISHED'
         if self._terminated:
             status_string = 'TERMINATED'
             # When tasks are replaced, avoid deleting the stamp file, context:
@@ -705,6 +1227,8 @@ class Task:
                 'CMD: ' + shlex.join(self.cmd),
                 'STDOUT:',
             ]
+            if cached:
+                preamble.insert(2, 'Replayed from the result cache.')
 
             message = '\n'.join(preamble + [stdout])
             self.build.log(message)
@@ -757,6 +1281,21 @@ def _handle_query_build(data, connection: socket.socket):
         pass
 
 
+def _handle_write_build_config(data, connection: socket.socket):
+    """Handle messages of type WRITE_BUILD_CONFIG."""
+    try:
+        response = BuildConfigWriter.write_build_config(data)
+    except Exception as e:  # pylint: disable=broad-except
+        # The client falls back to running write_build_config.py itself.
+        response = {'error': str(e)}
+    try:
+        with connection:
+            server_utils.SendMessage(connection, response)
+    except BrokenPipeError:
+        # We should not die because the client died.
+        pass
+
+
 def _handle_heartbeat(connection: socket.socket):
     """Handle messages of type POLL_HEARTBEAT."""
     try:
@@ -793,6 +1332,7 @@ def _handle_stop_server():
     """Handle messages of type STOP_SERVER."""
     server_log('STOPPING SERVER...')
     TaskManager.deactivate()
+    BuildConfigWriter.stop()
     server_log('STOPPED')
     sys.exit(0)
 
@@ -814,6 +1354,7 @@ def _register_cleanup_signal_handlers():
         server_log('STOPPING SERVER...')
         # Gracefully shut down the task manager, terminating all queued tasks.
         TaskManager.deactivate()
+        BuildConfigWriter.stop()
         server_log('STOPPED')
         if signum == signal.SIGINT:
             if callable(original_sigint_handler):
@@ -850,6 +1391,13 @@ def _process_requests(sock: socket.socket, exit_on_idle: bool):
                     _handle_add_task(data, tasks)
                 elif message_type == server_utils.QUERY_BUILD:
                     _handle_query_build(data, connection)
+                elif message_type == server_utils.WRITE_BUILD_CONFIG:
+                    # Handled on a thread since the response takes a while.
+                    threading.Thread(
+                        target=_handle_write_build_config,
+                        args=(data, connection),
+                        daemon=True,
+                    ).start()
                 elif message_type == server_utils.REGISTER_BUILDER:
                     connection.close()
                     _handle_register_builder(data)
@@ -872,6 +1420,7 @@ def _process_requests(sock: socket.socket, exit_on_idle: bool):
                 break
         except KeyboardInterrupt:
             break
+    BuildConfigWriter.stop()
     BuildManager.update_remote_titles('')
 
 
@@ -1031,6 +1580,20 @@ def poll_server(retries=3):
     return response['pid']
 
 
+def _print_scheduler_status(scheduler):
+    status = (
+        f'Scheduler: {scheduler["running_tasks"]} running, '
+        f'{scheduler["queued_tasks"]} queued'
+    )
+    if scheduler.get('load') is not None:
+        status += f', load {scheduler["load"]:.1f}/{scheduler["cpu_count"]}'
+    if scheduler.get('memory_pressure') is not None:
+        status += f', memory pressure {scheduler["memory_pressure"]:.1f}%'
+    if throttled_by := scheduler.get('throttled_by'):
+        status += f' (throttled by {throttled_by})'
+    print(status)
+
+
 def _print_build_status_all():
     try:
         query_data = query_build_info(None)
@@ -1041,6 +1604,9 @@ def _print_build_status_all():
     pid = query_data['pid']
     all_active_tasks = []
     print(f'Build server (PID={pid}) has {len(builds)} registered builds')
+    # Older servers do not report their scheduler status.
+    if scheduler := query_data.get('scheduler'):
+        _print_scheduler_status(scheduler)
     for build_info in builds:
         build_id = build_info['build_id']
         pending_tasks = build_info['pending_tasks']
@@ -1174,6 +1740,11 @@ def _main_old():
         action='store_true',
         help='Do not output errors to remote terminals.',
     )
+    parser.add_argument(
+        '--no-result-cache',
+        action='store_true',
+        help='Always run tasks rather than replay their cached results.',
+    )
     parser.add_argument(
         '--wait-for-build',
         metavar='BUILD_ID',
@@ -1215,7 +1786,9 @@ def _main_old():
     args = parser.parse_args()
 
     OptionsManager.set_options(
-        quiet=args.quiet, should_remote_print=not args.no_remote_print
+        quiet=args.quiet,
+        should_remote_print=not args.no_remote_print,
+        use_result_cache=not args.no_result_cache,
     )
 
     if args.wait_for_build:
@@ -1246,6 +1819,11 @@ def _main_new():
         action='store_true',
         help='Do not output errors to remote terminals.',
     )
+    sub_parser.add_argument(
+        '--no-result-cache',
+        action='store_true',
+        help='Always run tasks rather than replay their cached results.',
+    )
     sub_parser.add_argument(
         '--exit-on-idle',
         action='store_true',
@@ -1304,7 +1882,9 @@ def _main_new():
     ret = 0
     if args.command == 'start':
         OptionsManager.set_options(
-            quiet=args.quiet, should_remote_print=not args.no_remote_print
+            quiet=args.quiet,
+            should_remote_print=not args.no_remote_print,
+            use_result_cache=not args.no_result_cache,
         )
         ret = _start_server(args.exit_on_idle)
     elif args.command == 'stop':
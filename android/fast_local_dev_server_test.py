@@ -5,6 +5,7 @@
 
 import contextlib
 import datetime
+import json
 import pathlib
 import unittest
 import os
@@ -13,7 +14,9 @@ import socket
 import subprocess
 import sys
 import tempfile
+import threading
 import time
+from unittest import mock
 
 import fast_local_dev_server as server
 
@@ -29,6 +32,234 @@ class RegexTest(unittest.TestCase):
         )
 
 
+class SchedulerTest(unittest.TestCase):
+    def testParseMemoryPressure(self):
+        self.assertEqual(
+            server._parse_memory_pressure(
+                'some avg10=12.50 avg60=3.00 avg300=1.00 total=1234\n'
+                'full avg10=1.00 avg60=0.50 avg300=0.10 total=123\n'
+            ),
+            12.5,
+        )
+        self.assertIsNone(server._parse_memory_pressure(''))
+
+    def testTaskKind(self):
+        build = server.Build(id='b', pid=0, env={}, stdout=None)
+        lint = server.Task(
+            'lint', build, [sys.executable, '../../gyp/lint.py', '--foo'], None
+        )
+        self.assertEqual(lint.kind, 'lint')
+        self.assertEqual(server.Task('cat', build, ['cat'], None).kind, 'cat')
+
+    def testPriority(self):
+        old_build = server.Build(id='old', pid=0, env={}, stdout=None)
+        new_build = server.Build(id='new', pid=0, env={}, stdout=None)
+        new_build.registered_time = old_build.registered_time + 1
+
+        def task(build, script):
+            return server.Task(
+                f'{build.id} {script}', build, ['python3', script], None
+            )
+
+        tasks = [
+            task(old_build, 'lint.py'),
+            task(new_build, 'other.py'),
+            task(new_build, 'errorprone.py'),
+            task(new_build, 'lint.py'),
+        ]
+        ordered = sorted(
+            range(len(tasks)),
+            key=lambda i: (server.TaskManager._priority(tasks[i]), i),
+        )
+        self.assertEqual(ordered, [3, 2, 1, 0])
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self._tmp_dir = pathlib.Path(tmp_dir.name)
+        for name, value in (
+            ('_dir', self._tmp_dir / 'cache'),
+            ('_entries', None),
+            ('_total_bytes', 0),
+            ('_digests', {}),
+        ):
+            patcher = mock.patch.object(server.ResultCache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def testParseDepfile(self):
+        self.assertEqual(
+            server._parse_depfile('out.stamp: \\\n a.jar \\\n b\\ c.java\n'),
+            ['a.jar', 'b c.java'],
+        )
+        self.assertEqual(server._parse_depfile('out.stamp\n'), [])
+
+    def testComputeKey(self):
+        (self._tmp_dir / 'foo.d').write_text('foo.stamp: \\\n a.txt\n')
+        (self._tmp_dir / 'a.txt').write_text('a')
+        (self._tmp_dir / 'b.txt').write_text('b')
+        build = server.Build(
+            id='b', pid=0, env={}, stdout=None, cwd=str(self._tmp_dir)
+        )
+        cmd = ['true', '--depfile', 'foo.d', '--input=b.txt']
+        task = server.Task('foo', build, cmd, 'foo.stamp')
+        key = server.ResultCache.compute_key(task)
+        self.assertEqual(key, server.ResultCache.compute_key(task))
+        for name in ('a.txt', 'b.txt'):
+            (self._tmp_dir / name).write_text('changed')
+            new_key = server.ResultCache.compute_key(task)
+            self.assertNotEqual(key, new_key)
+            key = new_key
+        build.env['PATH'] = '/changed'
+        self.assertNotEqual(key, server.ResultCache.compute_key(task))
+        # The inputs of tasks without a depfile are unknown.
+        task = server.Task('foo', build, ['true', 'a.txt'], 'foo.stamp')
+        self.assertIsNone(server.ResultCache.compute_key(task))
+
+    def testComputeKeyExpandsFileArgs(self):
+        (self._tmp_dir / 'foo.d').write_text('foo.stamp: \\\n a.txt\n')
+        (self._tmp_dir / 'a.txt').write_text('a')
+        (self._tmp_dir / 'c.jar').write_text('c')
+        (self._tmp_dir / 'lint.json').write_text(
+            json.dumps({'classpath': ['c.jar'], 'deps_info': {'jar': 'a.txt'}})
+        )
+        build = server.Build(
+            id='b', pid=0, env={}, stdout=None, cwd=str(self._tmp_dir)
+        )
+        cmd = [
+            'true',
+            '--depfile',
+            'foo.d',
+            '--classpath=@FileArg(lint.json:classpath)',
+        ]
+        task = server.Task('foo', build, cmd, 'foo.stamp')
+        key = server.ResultCache.compute_key(task)
+        # c.jar is listed only in lint.json.
+        (self._tmp_dir / 'c.jar').write_text('changed')
+        self.assertNotEqual(key, server.ResultCache.compute_key(task))
+        self.assertEqual(
+            server._expand_file_args(
+                self._tmp_dir, ['--jar=@FileArg(lint.json:deps_info:jar)']
+            ),
+            ['a.txt'],
+        )
+        # Tasks whose @FileArg()s cannot be expanded are not cached.
+        task.cmd = cmd + ['--x=@FileArg(lint.json:missing)']
+        self.assertIsNone(server.ResultCache.compute_key(task))
+
+    def testComputeKeyExpandsResponseFiles(self):
+        # Like errorprone, whose depfile lists only its classpath.
+        (self._tmp_dir / 'foo.d').write_text('foo.stamp: \\\n c.jar\n')
+        (self._tmp_dir / 'c.jar').write_text('c')
+        (self._tmp_dir / 'A.java').write_text('class A {}')
+        (self._tmp_dir / 'foo.sources').write_text('A.java\n')
+        build = server.Build(
+            id='b', pid=0, env={}, stdout=None, cwd=str(self._tmp_dir)
+        )
+        cmd = ['true', '--depfile', 'foo.d', '@foo.sources']
+        task = server.Task('foo', build, cmd, 'foo.stamp')
+        key = server.ResultCache.compute_key(task)
+        server.ResultCache.store(key, 0, 'output')
+        self.assertIsNotNone(server.ResultCache.lookup(key))
+        (self._tmp_dir / 'A.java').write_text('class A { int x; }')
+        new_key = server.ResultCache.compute_key(task)
+        self.assertNotEqual(key, new_key)
+        self.assertIsNone(server.ResultCache.lookup(new_key))
+        # Tasks whose response files cannot be read are not cached.
+        task.cmd = cmd + ['@missing.sources']
+        self.assertIsNone(server.ResultCache.compute_key(task))
+
+    def testTerminateDoesNotWaitForHashing(self):
+        hashing = threading.Event()
+        unblock = threading.Event()
+
+        def compute_key(_):
+            hashing.set()
+            unblock.wait()
+            return 'key'
+
+        build = server.Build(
+            id='b', pid=0, env={}, stdout=None, cwd=str(self._tmp_dir)
+        )
+        task = server.Task('foo', build, ['true'], 'foo.stamp')
+        completed = threading.Event()
+        with (
+            mock.patch.object(
+                server.OptionsManager, 'use_result_cache', return_value=True
+            ),
+            mock.patch.object(server.ResultCache, 'compute_key', compute_key),
+            mock.patch.object(server.ResultCache, 'lookup') as lookup,
+            mock.patch.object(server.Task, '_complete'),
+        ):
+            task.start(completed.set)
+            self.assertTrue(hashing.wait(5))
+            # Returns without waiting for compute_key().
+            task.terminate(replaced=True)
+            unblock.set()
+            self.assertTrue(completed.wait(5))
+            lookup.assert_not_called()
+            task._complete.assert_called_once_with()
+
+    def testLookupAndEviction(self):
+        self.assertIsNone(server.ResultCache.lookup('a'))
+        server.ResultCache.store('a', 0, '')
+        server.ResultCache.store('b', 1, 'error')
+        self.assertEqual(
+            server.ResultCache.lookup('b'), {'returncode': 1, 'stdout': 'error'}
+        )
+        max_bytes = server.ResultCache.get_stats()['bytes']
+        with mock.patch.object(server, '_RESULT_CACHE_MAX_BYTES', max_bytes):
+            # Evicts 'a', which is the least recently used.
+            server.ResultCache.store('c', 0, '')
+        self.assertIsNone(server.ResultCache.lookup('a'))
+        self.assertEqual(server.ResultCache.get_stats()['entries'], 2)
+        # Entries are loaded from disk when the server restarts.
+        server.ResultCache._entries = None
+        self.assertEqual(
+            server.ResultCache.lookup('c'), {'returncode': 0, 'stdout': ''}
+        )
+        self.assertIsNotNone(server.ResultCache.lookup('b'))
+
+
+class WriteBuildConfigTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        # A socket that accepts connections but never responds.
+        self._address = f'\0fast_local_dev_server_test_{os.getpid()}'
+        self._listener = socket.socket(socket.AF_UNIX)
+        self.addCleanup(self._listener.close)
+        self._listener.bind(self._address)
+        self._listener.listen()
+
+    def testServerTimesOut(self):
+        client, connection = socket.socketpair(socket.AF_UNIX)
+        self.addCleanup(client.close)
+        with (
+            mock.patch.object(server, '_SOCKET_TIMEOUT', 0.1),
+            mock.patch.object(
+                server.BuildConfigWriter, '_address', self._address
+            ),
+            mock.patch.object(server.BuildConfigWriter, '_ensure_started'),
+        ):
+            server._handle_write_build_config({}, connection)
+        # The client falls back to running write_build_config.py itself.
+        self.assertIn('error', server_utils.ReceiveMessage(client))
+
+    def testClientTimesOut(self):
+        with (
+            mock.patch.object(server_utils, 'REQUEST_TIMEOUT', 0.1),
+            mock.patch.object(server_utils, 'SOCKET_ADDRESS', self._address),
+            mock.patch.dict(os.environ),
+        ):
+            os.environ.pop(server_utils.BUILD_SERVER_ENV_VARIABLE, None)
+            self.assertIsNone(
+                server_utils.MaybeSendRequest(
+                    server_utils.WRITE_BUILD_CONFIG, {}
+                )
+            )
+
+
 def sendMessage(message):
     with contextlib.closing(socket.socket(socket.AF_UNIX)) as sock:
         sock.settimeout(1)
@@ -290,6 +521,68 @@ class ServerStartedTest(unittest.TestCase):
                 self.waitForTasksDone()
         self.assertFalse(output_stamp.exists())
 
+    def _writeBuildConfig(self, out_dir, use_server):
+        args = ['--output', 'foo.build_config.json', '--depfile', 'foo.d']
+        if use_server:
+            response = server_utils.MaybeSendRequest(
+                server_utils.WRITE_BUILD_CONFIG,
+                {'args': args, 'cwd': str(out_dir)},
+            )
+            self.assertIsNotNone(response)
+            returncode, output = response['returncode'], response['output']
+        else:
+            proc = subprocess.run(
+                [sys.executable, str(server._WRITE_BUILD_CONFIG_SCRIPT)] + args,
+                cwd=out_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                check=False,
+            )
+            returncode, output = proc.returncode, proc.stdout
+        outputs = [
+            (out_dir / name).read_bytes()
+            for name in ('foo.build_config.json', 'foo.d')
+            if (out_dir / name).exists()
+        ]
+        for path in out_dir.glob('foo.*'):
+            if path.name != 'foo.params.json':
+                path.unlink()
+        return returncode, output, outputs
+
+    def testWriteBuildConfig(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_dir = pathlib.Path(tmp_dir)
+            (out_dir / 'foo.params.json').write_text(
+                '{"type": "dist_jar", "gn_target": "//:foo", '
+                '"deps_configs": ["bar.params.json"]}'
+            )
+            bar_params = out_dir / 'bar.params.json'
+            for jar_name in ('bar.jar', 'bar2.jar'):
+                bar_params.write_text(
+                    '{"type": "java_library", "gn_target": "//:bar", '
+                    f'"is_prebuilt": true, "processed_jar_path": "{jar_name}"'
+                    '}'
+                )
+                expected = self._writeBuildConfig(out_dir, use_server=False)
+                self.assertEqual(expected[0], 0)
+                self.assertIn(jar_name.encode(), expected[2][0])
+                # Twice so that the second request uses cached params.
+                for _ in range(2):
+                    self.assertEqual(
+                        self._writeBuildConfig(out_dir, use_server=True),
+                        expected,
+                    )
+
+            (out_dir / 'foo.params.json').write_text(
+                '{"type": "dist_jar", "fail": ["Bad target"]}'
+            )
+            returncode, output, _ = self._writeBuildConfig(
+                out_dir, use_server=True
+            )
+            self.assertEqual(returncode, 2)
+            self.assertIn('Bad target', output)
+
     def testKeyboardInterrupt(self):
         os.kill(self._process.pid, signal.SIGINT)
         self._process.wait(timeout=1)
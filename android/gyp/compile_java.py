@@ -6,7 +6,9 @@
 
 import collections
 import functools
+import hashlib
 import itertools
+import json
 import logging
 import argparse
 import os
@@ -22,6 +24,7 @@ import javac_output_processor
 from util import build_utils
 from util import md5_check
 from util import jar_info_utils
+from util import parallel
 from util import server_utils
 import action_helpers  # build_utils adds //build to sys.path.
 import zip_helpers
@@ -36,6 +39,14 @@ _JAVAC_EXTRACTOR = os.path.join(
     'javac_extractor.jar',
 )
 
+# Sources are parsed in forked processes in chunks of this many files when
+# there are at least this many sources that are not in the parse cache.
+_PARSE_CHUNK_SIZE = 500
+
+# Parse results are cached alongside .jar.info files, keyed by content hash.
+# The cache is an output of the action, so it is written even when unchanged.
+_PARSE_CACHE_SUFFIX = '.parse_cache.json'
+
 # These warnings cannot be suppressed even for third party code. Deprecation
 # warnings especially do not help since we must support older android version.
 _OUTPUT_FILTER_RE = re.compile(
@@ -189,6 +200,33 @@ def ParseJavaSource(data, services_map, path=None):
     return package_name, class_names
 
 
+@functools.cache
+def _ParseCacheVersion():
+    # Parse results depend on the parsing logic, which lives in this file.
+    return hashlib.md5(pathlib.Path(__file__).read_bytes()).hexdigest()
+
+
+def _ParseSourceChunk(chunk):
+    """Returns {content_hash: (package, class_names, services)} for |chunk|.
+
+    Args:
+      chunk: List of (path, content_hash, data) tuples.
+    """
+    ret = {}
+    for path, content_hash, data in chunk:
+        services_map = collections.defaultdict(list)
+        package_name, class_names = ParseJavaSource(
+            data, services_map, path=path
+        )
+        services = [
+            (service_class, impl_class)
+            for service_class, impl_classes in services_map.items()
+            for impl_class in impl_classes
+        ]
+        ret[content_hash] = (package_name, class_names, services)
+    return ret
+
+
 def _CreateGlobFilter(exclude_globs, include_globs):
 
     def func(zip_path):
@@ -254,6 +292,57 @@ class _MetadataParser:
         name_as_class_glob = fully_qualified_name.replace('.', '/') + '.class'
         return self._filter_func(name_as_class_glob)
 
+    def _ParseSources(self, paths, cache_path):
+        """Returns a list of (package, class_names, services) for |paths|.
+
+        Results are cached in |cache_path| by content hash so that only new or
+        changed files are parsed. Those are parsed in parallel when there are
+        many of them.
+        """
+        cache = {}
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                cache_json = json.load(f)
+            if cache_json['version'] == _ParseCacheVersion():
+                cache = cache_json['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        content_hashes = []
+        misses = {}
+        for path in paths:
+            data = pathlib.Path(path).read_text(encoding='utf-8')
+            content_hash = hashlib.blake2b(
+                data.encode('utf-8'), digest_size=16
+            ).hexdigest()
+            content_hashes.append(content_hash)
+            if content_hash not in cache:
+                misses[content_hash] = (path, content_hash, data)
+
+        logging.info(
+            'Parsing %d of %d sources (others are cached)',
+            len(misses),
+            len(paths),
+        )
+        misses = list(misses.values())
+        if len(misses) < _PARSE_CHUNK_SIZE:
+            cache.update(_ParseSourceChunk(misses))
+        else:
+            chunks = [
+                (misses[i : i + _PARSE_CHUNK_SIZE],)
+                for i in range(0, len(misses), _PARSE_CHUNK_SIZE)
+            ]
+            for result in parallel.BulkForkAndCall(_ParseSourceChunk, chunks):
+                cache.update(result)
+
+        ret = [cache[h] for h in content_hashes]
+        # Always written since it is an output of the action. Keep only entries
+        # for the current sources.
+        entries = dict(zip(content_hashes, ret))
+        with action_helpers.atomic_output(cache_path, encoding='utf-8') as f:
+            json.dump({'version': _ParseCacheVersion(), 'entries': entries}, f)
+        return ret
+
     def ParseAndWriteInfoFile(self, output_path, java_files, kt_files=None):
         """Writes a .jar.info file.
 
@@ -262,11 +351,11 @@ class _MetadataParser:
         """
         logging.info('Collecting info file entries')
         entries = {}
-        for path in itertools.chain(java_files, kt_files or []):
-            data = pathlib.Path(path).read_text(encoding='utf-8')
-            package_name, class_names = ParseJavaSource(
-                data, self.services_map, path=path
-            )
+        paths = list(itertools.chain(java_files, kt_files or []))
+        results = self._ParseSources(paths, output_path + _PARSE_CACHE_SUFFIX)
+        for path, (package_name, class_names, services) in zip(paths, results):
+            for service_class, impl_class in services:
+                self.services_map[service_class].append(impl_class)
             source = self._srcjar_files.get(path, path)
             for fully_qualified_name in self._ProcessInfo(
                 path, package_name, class_names, source
@@ -425,7 +514,15 @@ def _RunCompiler(
                     all_changed_paths_are_java
                     and not changes.HasStringChanges()
                     and os.path.exists(jar_path)
-                    and (jar_info_path is None or os.path.exists(jar_info_path))
+                    and (
+                        jar_info_path is None
+                        or (
+                            os.path.exists(jar_info_path)
+                            and os.path.exists(
+                                jar_info_path + _PARSE_CACHE_SUFFIX
+                            )
+                        )
+                    )
                 ):
                     # Log message is used by tests to determine whether partial javac
                     # optimization was used.
@@ -653,6 +750,7 @@ def _ParseOptions(argv):
         ".class files from this target's .kt files.",
     )
     parser.add_argument('sources', nargs='*')
+    parallel.AddCommandLineFlags(parser)
 
     options = parser.parse_args(argv)
 
@@ -697,6 +795,7 @@ def main(
     build_utils.InitLogging('JAVAC_DEBUG')
     argv = build_utils.ExpandFileArgs(argv)
     options, java_files, kt_files = _ParseOptions(argv)
+    parallel.SetMaxWorkers(options.max_workers)
 
     javac_cmd = [build_utils.JAVAC_PATH]
 
@@ -778,6 +877,7 @@ def main(
     if not use_errorprone:
         jar_info_path = options.jar_path + '.info'
         output_paths.append(jar_info_path)
+        output_paths.append(jar_info_path + _PARSE_CACHE_SUFFIX)
     if options.filtered_jar:
         output_paths.append(options.filtered_jar)
 
@@ -5,7 +5,10 @@
 """Tests for compile_java.py"""
 
 import collections
+import os
+import tempfile
 import unittest
+from unittest import mock
 
 import compile_java
 
@@ -97,6 +100,46 @@ class CompileJavaTests(unittest.TestCase):
 
         self.assertRaises(Exception, inner)
 
+    def testParseAndWriteInfoFile_UsesCache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            java_files = []
+            for name, annotation in (
+                ('Foo', '@ServiceImpl(Local.class)'),
+                ('Bar', ''),
+            ):
+                path = os.path.join(tmp_dir, f'{name}.java')
+                with open(path, 'w') as f:
+                    f.write(
+                        f'package pkg;\n{annotation}\n'
+                        f'public class {name} {{}}\n'
+                    )
+                java_files.append(path)
+            info_path = os.path.join(tmp_dir, 'out.jar.info')
+
+            def run():
+                parser = compile_java._MetadataParser(False, lambda _: True)
+                with mock.patch.object(
+                    compile_java,
+                    'ParseJavaSource',
+                    wraps=compile_java.ParseJavaSource,
+                ) as parse_mock:
+                    parser.ParseAndWriteInfoFile(info_path, java_files)
+                with open(info_path) as f:
+                    return (
+                        parse_mock.call_count,
+                        dict(parser.services_map),
+                        f.read(),
+                    )
+
+            num_parsed, services_map, info = run()
+            self.assertEqual(2, num_parsed)
+            self.assertEqual({'pkg.Local': ['pkg.Foo']}, services_map)
+
+            # Unchanged files are not parsed again.
+            with open(java_files[1], 'a') as f:
+                f.write('\n')
+            self.assertEqual((1, services_map, info), run())
+
 
 if __name__ == '__main__':
     unittest.main()
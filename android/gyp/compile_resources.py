@@ -13,8 +13,8 @@ This will crunch images with aapt2.
 
 import argparse
 import collections
+import concurrent.futures
 import filecmp
-import hashlib
 import logging
 import os
 import pathlib
@@ -30,6 +30,7 @@ from util import diff_utils
 from util import manifest_utils
 from util import parallel
 from util import protoresources
+from util import resource_caches
 from util import resource_utils
 import action_helpers  # build_utils adds //build to sys.path.
 
@@ -45,6 +46,10 @@ _PNG_WEBP_EXCLUSION_PATTERN = re.compile(
     )
 )
 
+# Bump when changes to how resource zips are processed change their partials,
+# so that stale entries of the aapt2 compile cache are not used.
+_COMPILE_CACHE_VERSION = 1
+
 
 def _ParseArgs(args):
     """Parses command line options.
@@ -187,6 +192,18 @@ def _ParseArgs(args):
     input_opts.add_argument(
         '--webp-cache-dir', help='The directory to store webp image cache.'
     )
+    input_opts.add_argument(
+        '--webp-cache-max-mb',
+        type=int,
+        default=1024,
+        help='Least recently used images are evicted from the webp image '
+        'cache beyond this size.',
+    )
+    input_opts.add_argument(
+        '--aapt2-compile-cache-dir',
+        help='The directory to store compiled resource partials in, so that '
+        'targets that depend on the same resources can share them.',
+    )
     input_opts.add_argument(
         '--is-bundle-module',
         action='store_true',
@@ -228,6 +245,7 @@ def _ParseArgs(args):
     )
 
     diff_utils.AddCommandLineFlags(parser)
+    parallel.AddCommandLineFlags(parser)
     options = parser.parse_args(args)
 
     options.include_resources = action_helpers.parse_gn_list(
@@ -521,31 +539,22 @@ def _CreateKeepPredicate(
     )
 
 
-def _ComputeSha1(path):
-    with open(path, 'rb') as f:
-        data = f.read()
-    return hashlib.sha1(data).hexdigest()
-
-
-def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, webp_cache_dir):
-    sha1_hash = _ComputeSha1(png_path)
+def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, webp_cache):
+    sha1_hash = resource_caches.ComputeSha1(png_path)
 
     # The set of arguments that will appear in the cache key.
     quality_args = ['-m', '6', '-q', '100', '-lossless']
 
-    webp_cache_path = os.path.join(
-        webp_cache_dir,
-        '{}-{}-{}'.format(sha1_hash, cwebp_version, ''.join(quality_args)),
+    webp_cache_name = '{}-{}-{}'.format(
+        sha1_hash, cwebp_version, ''.join(quality_args)
     )
     # No need to add .webp. Android can load images fine without them.
     webp_path = os.path.splitext(png_path)[0]
 
-    cache_hit = os.path.exists(webp_cache_path)
-    if cache_hit:
-        os.link(webp_cache_path, webp_path)
-    else:
+    cache_hit = webp_cache.Get(webp_cache_name, webp_path)
+    if not cache_hit:
         # We place the generated webp image to webp_path, instead of in the
-        # webp_cache_dir to avoid concurrency issues.
+        # webp cache to avoid concurrency issues.
         args = [
             cwebp_binary,
             png_path,
@@ -554,13 +563,7 @@ def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, webp_cache_dir):
             '-quiet',
         ] + quality_args
         subprocess.check_call(args)
-
-        try:
-            os.link(webp_path, webp_cache_path)
-        except OSError:
-            # Because of concurrent run, a webp image may already exists in
-            # webp_cache_path.
-            pass
+        webp_cache.Put(webp_cache_name, webp_path)
 
     os.remove(png_path)
     original_dir = os.path.dirname(os.path.dirname(png_path))
@@ -571,26 +574,44 @@ def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, webp_cache_dir):
     return rename_tuple, cache_hit
 
 
-def _ConvertToWebP(cwebp_binary, png_paths, path_info, webp_cache_dir):
+def _ConvertToWebP(
+    cwebp_binary, png_path_infos, webp_cache_dir, webp_cache_max_bytes
+):
+    """Converts pngs to webp.
+
+    Args:
+      cwebp_binary: Path to the cwebp binary.
+      png_path_infos: A dict of png paths to the path_info to register their
+        renames with.
+      webp_cache_dir: The directory to store the webp image cache.
+      webp_cache_max_bytes: The size to evict the webp image cache down to.
+    """
     cwebp_version = subprocess.check_output([cwebp_binary, '-version']).rstrip()
-    shard_args = [
-        (f,) for f in png_paths if not _PNG_WEBP_EXCLUSION_PATTERN.match(f)
+    png_paths = [
+        f for f in png_path_infos if not _PNG_WEBP_EXCLUSION_PATTERN.match(f)
     ]
 
-    build_utils.MakeDirectory(webp_cache_dir)
-    results = parallel.BulkForkAndCall(
-        _ConvertToWebPSingle,
-        shard_args,
-        cwebp_binary=cwebp_binary,
-        cwebp_version=cwebp_version,
-        webp_cache_dir=webp_cache_dir,
+    webp_cache = resource_caches.WebPCache(webp_cache_dir, webp_cache_max_bytes)
+    # Work is mostly hashing and waiting for cwebp, neither of which holds the
+    # GIL, so threads are enough.
+    with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+        results = executor.map(
+            lambda png_path: _ConvertToWebPSingle(
+                png_path, cwebp_binary, cwebp_version, webp_cache
+            ),
+            png_paths,
+        )
+        for png_path, (rename_tuple, _) in zip(png_paths, results):
+            png_path_infos[png_path].RegisterRename(*rename_tuple)
+    webp_cache.Flush()
+
+    logging.info(
+        'png->webp cache: %d hits, %d misses, %d evicted, %.1f MiB in use',
+        webp_cache.num_hits,
+        webp_cache.num_misses,
+        webp_cache.num_evicted,
+        webp_cache.total_bytes / (1024 * 1024),
     )
-    total_cache_hits = 0
-    for rename_tuple, cache_hit in results:
-        path_info.RegisterRename(*rename_tuple)
-        total_cache_hits += int(cache_hit)
-
-    logging.debug('png->webp cache: %d/%d', total_cache_hits, len(shard_args))
 
 
 def _RemoveImageExtensions(directory, path_info):
@@ -648,6 +669,19 @@ def _CompileSingleDep(
     return partial_path
 
 
+class _ValuesKeepPredicate:
+    """Keeps values that match none of the patterns.
+
+    A class rather than a lambda so that it can be passed to worker processes.
+    """
+
+    def __init__(self, patterns):
+        self._regexes = [re.compile(p) for p in patterns]
+
+    def __call__(self, value):
+        return not any(r.search(value) for r in self._regexes)
+
+
 def _CreateValuesKeepPredicate(exclusion_rules, dep_subdir):
     patterns = [
         x[1]
@@ -657,16 +691,16 @@ def _CreateValuesKeepPredicate(exclusion_rules, dep_subdir):
     if not patterns:
         return None
 
-    regexes = [re.compile(p) for p in patterns]
-    return lambda x: not any(r.search(x) for r in regexes)
+    return _ValuesKeepPredicate(patterns)
 
 
-def _CompileDeps(
-    aapt2_path, dep_subdirs, dep_subdir_overlay_set, temp_dir, exclusion_rules
-):
-    partials_dir = os.path.join(temp_dir, 'partials')
-    build_utils.MakeDirectory(partials_dir)
+def _CompileDeps(aapt2_path, dep_subdirs, partials_dir, exclusion_rules):
+    """Compiles |dep_subdirs| into partials.
 
+    Returns:
+      A list of (partial_path, is_filtered) tuples, in |dep_subdirs| order.
+      |is_filtered| tells whether values were filtered out of the partial.
+    """
     job_params = [
         (i, dep_subdir, _CreateValuesKeepPredicate(exclusion_rules, dep_subdir))
         for i, dep_subdir in enumerate(dep_subdirs)
@@ -674,22 +708,17 @@ def _CompileDeps(
 
     # Filtering is slow, so ensure jobs with keep_predicate are started first.
     job_params.sort(key=lambda x: not x[2])
-    partials = list(
-        parallel.BulkForkAndCall(
-            _CompileSingleDep,
-            job_params,
-            aapt2_path=aapt2_path,
-            partials_dir=partials_dir,
-        )
+    partials = parallel.BulkForkAndCall(
+        _CompileSingleDep,
+        job_params,
+        aapt2_path=aapt2_path,
+        partials_dir=partials_dir,
     )
 
-    partials_cmd = []
-    for i, partial in enumerate(partials):
-        dep_subdir = job_params[i][1]
-        if dep_subdir in dep_subdir_overlay_set:
-            partials_cmd += ['-R']
-        partials_cmd += [partial]
-    return partials_cmd
+    ret = [None] * len(dep_subdirs)
+    for (i, _, keep_predicate), partial in zip(job_params, partials):
+        ret[i] = (partial, keep_predicate is not None)
+    return ret
 
 
 def _CreateResourceInfoFile(path_info, info_path, all_res_zips):
@@ -747,72 +776,157 @@ def _FilterResourceFiles(dep_subdirs, keep_predicate):
     return png_paths
 
 
-def _FilterAapt2Warnings(output):
-    # Filter warnings about attributes already defined in the base package.
-    # These happen in instrumentation tests where the test APK has additional
-    # dependencies (e.g. material design) that define attributes already present
-    # in the base APK (e.g. via appcompat).
-    pattern = r'.*warn: attribute \'.*\' already defined in base package .*'
-    return build_utils.FilterLines(output, pattern)
+def _CreateCompileCacheSalt(options):
+    """Returns what, besides a resource zip, determines its partials."""
+    parts = [
+        str(_COMPILE_CACHE_VERSION),
+        resource_caches.ComputeSha1(options.aapt2_path),
+        options.resource_exclusion_regex,
+        repr(options.resource_exclusion_exceptions),
+        repr(options.locale_allowlist),
+        repr(options.values_filter_rules),
+        repr(options.png_to_webp),
+    ]
+    if options.png_to_webp:
+        parts.append(resource_caches.ComputeSha1(options.webp_binary))
+    return '\n'.join(parts)
 
 
-def _PackageApk(options, build):
-    """Compile and link resources with aapt2.
+def _CompileResZips(options, res_zips, build, compile_cache):
+    """Extracts, transforms and compiles resource zips.
+
+    Zips that are in |compile_cache| are neither extracted nor compiled, and
+    are stored in it otherwise.
 
     Args:
       options: The command-line options.
+      res_zips: List of resource_caches.ResZip, whose partials and renames
+        are set.
       build: BuildContext object.
-    Returns:
-      The manifest package name for the APK.
+      compile_cache: A resource_caches.CompileCache, or None.
     """
+    partials_dir = os.path.join(build.temp_dir, 'partials')
+    build_utils.MakeDirectory(partials_dir)
+
     logging.debug('Extracting resource .zips')
-    all_res_zips = (
-        options.dependencies_res_zips + options.dependencies_res_zip_overlays
-    )
-    overlay_zips = set(options.dependencies_res_zip_overlays)
-    dep_subdirs = []
-    dep_subdir_overlay_set = set()
-    for dependency_res_zip in all_res_zips:
-        extracted_dep_subdirs = resource_utils.ExtractDeps(
-            [dependency_res_zip], build.deps_dir
+    missed_zips = []
+    for i, res_zip in enumerate(res_zips):
+        extract_dir = build.deps_dir
+        if compile_cache:
+            key = compile_cache.ComputeKey(res_zip.path)
+            entry = compile_cache.Lookup(key, partials_dir, f'cached_{i}')
+            if entry:
+                res_zip.partials, res_zip.renames = entry
+                continue
+            work_dir = compile_cache.TryLock(key)
+            if work_dir:
+                res_zip.cache_key = key
+                extract_dir = work_dir
+        res_zip.subdirs = resource_utils.ExtractDeps(
+            [res_zip.path], extract_dir
+        )
+        missed_zips.append(res_zip)
+    if compile_cache:
+        logging.debug(
+            'aapt2 compile cache: %d/%d',
+            len(res_zips) - len(missed_zips),
+            len(res_zips),
         )
-        dep_subdirs += extracted_dep_subdirs
-        if dependency_res_zip in overlay_zips:
-            dep_subdir_overlay_set.update(extracted_dep_subdirs)
+    if not missed_zips:
+        return
+    dep_subdirs = [d for z in missed_zips for d in z.subdirs]
 
     logging.debug('Applying locale transformations')
-    path_info = resource_utils.ResourceInfoFile()
-    _RenameLocaleResourceDirs(dep_subdirs, path_info)
+    for res_zip in missed_zips:
+        _RenameLocaleResourceDirs(
+            res_zip.subdirs,
+            resource_caches.RenameRecorder(res_zip.renames['locale']),
+        )
 
     logging.debug('Applying file-based exclusions')
     keep_predicate = _CreateKeepPredicate(
         options.resource_exclusion_regex, options.resource_exclusion_exceptions
     )
-    png_paths = _FilterResourceFiles(dep_subdirs, keep_predicate)
+    png_path_infos = {}
+    for res_zip in missed_zips:
+        recorder = resource_caches.RenameRecorder(res_zip.renames['webp'])
+        for png_path in _FilterResourceFiles(res_zip.subdirs, keep_predicate):
+            png_path_infos[png_path] = recorder
 
     if options.locale_allowlist:
         logging.debug('Applying locale-based string exclusions')
         _RemoveUnwantedLocalizedStrings(dep_subdirs, options)
 
-    if png_paths and options.png_to_webp:
+    if png_path_infos and options.png_to_webp:
         logging.debug('Converting png->webp')
         _ConvertToWebP(
-            options.webp_binary, png_paths, path_info, options.webp_cache_dir
+            options.webp_binary,
+            png_path_infos,
+            options.webp_cache_dir,
+            options.webp_cache_max_mb * 1024 * 1024,
         )
     logging.debug('Applying drawable transformations')
-    for directory in dep_subdirs:
-        _MoveImagesToNonMdpiFolders(directory, path_info)
-        _RemoveImageExtensions(directory, path_info)
+    for res_zip in missed_zips:
+        recorder = resource_caches.RenameRecorder(res_zip.renames['drawable'])
+        for directory in res_zip.subdirs:
+            _MoveImagesToNonMdpiFolders(directory, recorder)
+            _RemoveImageExtensions(directory, recorder)
 
     logging.debug('Running aapt2 compile')
     exclusion_rules = [x.split(':', 1) for x in options.values_filter_rules]
-    partials = _CompileDeps(
-        options.aapt2_path,
-        dep_subdirs,
-        dep_subdir_overlay_set,
-        build.temp_dir,
-        exclusion_rules,
+    partials = iter(
+        _CompileDeps(
+            options.aapt2_path, dep_subdirs, partials_dir, exclusion_rules
+        )
+    )
+    for res_zip in missed_zips:
+        res_zip.partials = [next(partials) for _ in res_zip.subdirs]
+        if res_zip.cache_key:
+            compile_cache.Store(
+                res_zip.cache_key, res_zip.partials, res_zip.renames
+            )
+
+
+def _FilterAapt2Warnings(output):
+    # Filter warnings about attributes already defined in the base package.
+    # These happen in instrumentation tests where the test APK has additional
+    # dependencies (e.g. material design) that define attributes already present
+    # in the base APK (e.g. via appcompat).
+    pattern = r'.*warn: attribute \'.*\' already defined in base package .*'
+    return build_utils.FilterLines(output, pattern)
+
+
+def _PackageApk(options, build):
+    """Compile and link resources with aapt2.
+
+    Args:
+      options: The command-line options.
+      build: BuildContext object.
+    Returns:
+      The manifest package name for the APK.
+    """
+    all_res_zips = (
+        options.dependencies_res_zips + options.dependencies_res_zip_overlays
     )
+    overlay_zips = set(options.dependencies_res_zip_overlays)
+    res_zips = [
+        resource_caches.ResZip(p, p in overlay_zips) for p in all_res_zips
+    ]
+    compile_cache = None
+    if options.aapt2_compile_cache_dir:
+        compile_cache = resource_caches.CompileCache(
+            options.aapt2_compile_cache_dir, _CreateCompileCacheSalt(options)
+        )
+    try:
+        _CompileResZips(options, res_zips, build, compile_cache)
+    finally:
+        if compile_cache:
+            compile_cache.Release()
+    if compile_cache:
+        compile_cache.Evict()
+
+    path_info = resource_utils.ResourceInfoFile()
+    resource_caches.RegisterRenames(res_zips, path_info)
 
     link_command = [
         options.aapt2_path,
@@ -867,7 +981,7 @@ def _PackageApk(options, build):
     )
     link_command += ['--stable-ids', build.stable_ids_path]
 
-    link_command += partials
+    link_command += resource_caches.PartialsLinkArgs(res_zips)
 
     # We always create a binary arsc file first, then convert to proto, so flags
     # such as --shared-lib can be supported.
@@ -988,6 +1102,7 @@ def main(args):
     build_utils.InitLogging('RESOURCE_DEBUG')
     args = build_utils.ExpandFileArgs(args)
     options = _ParseArgs(args)
+    parallel.SetMaxWorkers(options.max_workers)
 
     if options.expected_file:
         actual_data = _CreateNormalizedManifestForVerification(options)
@@ -253,6 +253,11 @@ def main():
 
     compile_java_argv += ['--jar-path', options.stamp]
 
+    if options.use_build_server:
+        # Write the depfile before the task is sent, since the build server's
+        # result cache keys tasks by the files that it lists.
+        compile_java.main(compile_java_argv, write_depfile_only=True)
+
     # Use the build server for errorprone runs.
     if server_utils.MaybeRunCommand(
         name=options.stamp,
@@ -260,7 +265,6 @@ def main():
         stamp_file=options.stamp,
         use_build_server=options.use_build_server,
     ):
-        compile_java.main(compile_java_argv, write_depfile_only=True)
         return
 
     # All errorprone args are passed space-separated in a single arg.
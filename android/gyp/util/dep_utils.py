@@ -11,7 +11,8 @@ import os
 import pathlib
 import subprocess
 import sys
-from typing import Dict, Iterator, List, Set
+import tempfile
+from typing import Dict, Iterator, List, Optional, Set
 
 from util import jar_utils
 
@@ -21,6 +22,23 @@ sys.path.append(str(_SRC_PATH / 'build/android'))
 # Import list_java_targets so that the dependency is found by print_python_deps.
 import list_java_targets  # pylint: disable=unused-import
 
+# Stored in the output directory and updated incrementally by each
+# ClassLookupIndex so that only changed .params.json / .jar files are re-read.
+_INDEX_FILENAME = '.class_lookup_index.json'
+_INDEX_VERSION = 1
+
+
+def _stat_stamp(path) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _trigrams(s: str) -> Set[str]:
+    return {s[i : i + 3] for i in range(len(s) - 2)}
+
 
 @dataclasses.dataclass(frozen=True)
 class ClassEntry:
@@ -83,6 +101,11 @@ class ClassLookupIndex:
         self._abs_build_output_dir = build_output_dir.resolve().absolute()
         self._should_build = should_build
         self._class_index = self._index_root()
+        self._class_names = list(self._class_index)
+        self._lower_class_names = [n.lower() for n in self._class_names]
+        # Created on first use.
+        self._simple_name_index = None
+        self._trigram_index = None
 
     def match(self, search_string: str) -> List[ClassEntry]:
         """Get class/target entries where the class matches search_string"""
@@ -94,21 +117,16 @@ class ClassLookupIndex:
         matches = []
         lower_search_string = search_string.lower()
         if '.' not in lower_search_string:
-            for full_class_name in self._class_index:
-                package_and_class = full_class_name.rsplit('.', 1)
-                if len(package_and_class) < 2:
-                    continue
-                class_name = package_and_class[1]
-                class_lower = class_name.lower()
-                if class_lower == lower_search_string:
-                    matches.extend(self._entries_for(full_class_name))
+            for full_class_name in self._get_simple_name_index().get(
+                lower_search_string, []
+            ):
+                matches.extend(self._entries_for(full_class_name))
             if matches:
                 return matches
 
         # Priority 3: Match anything
-        for full_class_name in self._class_index:
-            if lower_search_string in full_class_name.lower():
-                matches.extend(self._entries_for(full_class_name))
+        for full_class_name in self._substring_matches(lower_search_string):
+            matches.extend(self._entries_for(full_class_name))
 
         # Priority 4: Match parent class when no matches and it's an inner class.
         if not matches:
@@ -123,8 +141,67 @@ class ClassLookupIndex:
     def _entries_for(self, class_name) -> List[ClassEntry]:
         return sorted(self._class_index[class_name])
 
-    def _index_root(self) -> Dict[str, Set[ClassEntry]]:
-        """Create the class to target index."""
+    def _get_simple_name_index(self) -> Dict[str, List[str]]:
+        """Returns a map of lowercase class name -> full class names."""
+        if self._simple_name_index is None:
+            self._simple_name_index = collections.defaultdict(list)
+            for full_class_name in self._class_names:
+                package_and_class = full_class_name.rsplit('.', 1)
+                if len(package_and_class) < 2:
+                    continue
+                self._simple_name_index[package_and_class[1].lower()].append(
+                    full_class_name
+                )
+        return self._simple_name_index
+
+    def _get_trigram_index(self) -> Dict[str, Set[int]]:
+        """Returns a map of trigram -> indices of lowercase class names."""
+        if self._trigram_index is None:
+            self._trigram_index = collections.defaultdict(set)
+            for i, lower_class_name in enumerate(self._lower_class_names):
+                for trigram in _trigrams(lower_class_name):
+                    self._trigram_index[trigram].add(i)
+        return self._trigram_index
+
+    def _substring_matches(self, lower_search_string: str) -> List[str]:
+        """Returns full class names containing lower_search_string (any case).
+
+        Results are in index order, as if all class names had been scanned.
+        """
+        if len(lower_search_string) < 3:
+            candidates = range(len(self._class_names))
+        else:
+            # Only names containing every trigram of the search string can
+            # match. Intersect starting from the rarest trigram.
+            trigram_index = self._get_trigram_index()
+            postings = sorted(
+                (
+                    trigram_index.get(t, set())
+                    for t in _trigrams(lower_search_string)
+                ),
+                key=len,
+            )
+            candidates = sorted(postings[0].intersection(*postings[1:]))
+        return [
+            self._class_names[i]
+            for i in candidates
+            if lower_search_string in self._lower_class_names[i]
+        ]
+
+    def _list_params_paths(self, index_json: Dict) -> List[str]:
+        """Returns .params.json paths (relative to src) of all java targets."""
+        # .params.json files are written by "gn gen", so the list of them
+        # changes only when build.ninja does.
+        build_ninja_stamp = _stat_stamp(
+            self._abs_build_output_dir / 'build.ninja'
+        )
+        if (
+            not self._should_build
+            and build_ninja_stamp is not None
+            and index_json.get('build_ninja_stamp') == build_ninja_stamp
+        ):
+            return index_json['params_paths']
+
         logging.debug('Running list_java_targets.py...')
         list_java_targets_command = [
             'build/android/list_java_targets.py',
@@ -148,42 +225,98 @@ class ClassLookupIndex:
             raise
         logging.debug('... done.')
 
-        # Parse output of list_java_targets.py into BuildConfig objects.
+        params_paths = list_java_targets_run.stdout.splitlines()
+        index_json['build_ninja_stamp'] = _stat_stamp(
+            self._abs_build_output_dir / 'build.ninja'
+        )
+        index_json['params_paths'] = params_paths
+        return params_paths
+
+    def _load_index(self) -> Dict:
+        try:
+            with open(
+                self._abs_build_output_dir / _INDEX_FILENAME, encoding='utf-8'
+            ) as f:
+                index_json = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index_json.get('version') != _INDEX_VERSION:
+            return {}
+        return index_json
+
+    def _save_index(self, index_json: Dict):
+        index_json['version'] = _INDEX_VERSION
+        # Concurrent build steps can update the index, so write atomically.
+        try:
+            with tempfile.NamedTemporaryFile(
+                'w',
+                dir=self._abs_build_output_dir,
+                prefix=_INDEX_FILENAME,
+                suffix='.tmp',
+                delete=False,
+                encoding='utf-8',
+            ) as f:
+                json.dump(index_json, f)
+            os.replace(f.name, self._abs_build_output_dir / _INDEX_FILENAME)
+        except OSError:
+            logging.warning('Failed to write %s', _INDEX_FILENAME)
+
+    @staticmethod
+    def _is_up_to_date(config_json: Dict) -> bool:
+        return all(
+            _stat_stamp(path) == stamp for path, stamp in config_json['stamps']
+        )
+
+    def _index_root(self) -> Dict[str, Set[ClassEntry]]:
+        """Create the class to target index."""
+        index_json = self._load_index()
+        old_params_paths = index_json.get('params_paths')
+        params_paths = self._list_params_paths(index_json)
+        old_configs = index_json.get('configs', {})
+        configs = {}
+        num_reused = 0
+
+        # Parse each .params.json into BuildConfig objects, reusing those whose
+        # inputs are unchanged since the index was written.
         path_to_build_config: Dict[str, BuildConfig] = {}
-        for params_path in list_java_targets_run.stdout.splitlines():
+        for params_path in params_paths:
             params_path = os.path.join(_SRC_PATH, params_path)
             # .params.json can not exist when running remote builds.
             if not os.path.exists(params_path):
                 assert not self._should_build
                 continue
 
-            with open(params_path, encoding='utf-8') as data:
-                params_json: Dict = json.load(data)
+            relpath = os.path.relpath(params_path, self._abs_build_output_dir)
+            config_json = old_configs.get(relpath)
+            if config_json and self._is_up_to_date(config_json):
+                num_reused += 1
+            else:
+                config_json = self._create_config_json(params_path)
+            configs[relpath] = config_json
 
             # Checking the library type here instead of in list_java_targets.py avoids
             # reading each .build_config file twice.
-            if params_json['type'] not in ('java_library', 'group'):
+            if config_json['type'] not in ('java_library', 'group'):
                 continue
 
-            relpath = os.path.relpath(params_path, self._abs_build_output_dir)
-            preferred_dep = bool(params_json.get('preferred_dep'))
-            is_group = bool(params_json['type'] == 'group')
-            dependent_config_paths = params_json.get(
-                'deps_configs', []
-            ) + params_json.get('public_deps_configs', [])
-            full_class_names = self._compute_full_class_names_for_build_config(
-                params_json
-            )
             build_config = BuildConfig(
                 relpath=relpath,
-                target_name=params_json['gn_target'],
-                is_group=is_group,
-                preferred_dep=preferred_dep,
-                dependent_config_paths=dependent_config_paths,
-                full_class_names=full_class_names,
+                target_name=config_json['target_name'],
+                is_group=config_json['type'] == 'group',
+                preferred_dep=config_json['preferred_dep'],
+                dependent_config_paths=config_json['dependent_config_paths'],
+                full_class_names=set(config_json['full_class_names']),
             )
             path_to_build_config[relpath] = build_config
 
+        logging.debug('Reused %d of %d targets.', num_reused, len(configs))
+        if (
+            params_paths is not old_params_paths
+            or index_json.get('configs') != configs
+        ):
+            index_json['configs'] = configs
+            self._save_index(index_json)
+
         # From GN's perspective, depending on a java group is the same as depending
         # on all of its deps directly, since groups are collapsed in
         # write_build_config.py. Thus, collect all the java files in a java group's
@@ -211,6 +344,30 @@ class ClassLookupIndex:
 
         return class_index
 
+    def _create_config_json(self, params_path: str) -> Dict:
+        """Returns the index entry for a .params.json file."""
+        stamp = _stat_stamp(params_path)
+        with open(params_path, encoding='utf-8') as data:
+            params_json: Dict = json.load(data)
+
+        # Stamps of the files the entry is computed from. Taken before reading
+        # them so that concurrent modifications invalidate the entry.
+        ret = {'type': params_json['type'], 'stamps': [[params_path, stamp]]}
+        if ret['type'] in ('java_library', 'group'):
+            for key in ('target_sources_file', 'unprocessed_jar_path'):
+                if path := params_json.get(key):
+                    path = str(self._abs_build_output_dir / path)
+                    ret['stamps'].append([path, _stat_stamp(path)])
+            ret['target_name'] = params_json['gn_target']
+            ret['preferred_dep'] = bool(params_json.get('preferred_dep'))
+            ret['dependent_config_paths'] = params_json.get(
+                'deps_configs', []
+            ) + params_json.get('public_deps_configs', [])
+            ret['full_class_names'] = sorted(
+                self._compute_full_class_names_for_build_config(params_json)
+            )
+        return ret
+
     def _compute_full_class_names_for_build_config(
         self, params_json: Dict
     ) -> Set[str]:
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+)
+from util import dep_utils
+
+
+class TestClassLookupIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._out_dir = pathlib.Path(self._tmp_dir.name)
+        (self._out_dir / 'build.ninja').write_text('')
+        self._params_paths = []
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _AddTarget(self, name, sources, target_type='java_library', **kwargs):
+        sources_path = self._out_dir / f'{name}.sources'
+        sources_path.write_text(''.join(f'{s}\n' for s in sources))
+        params = {
+            'type': target_type,
+            'gn_target': f'//foo:{name}',
+            'target_sources_file': sources_path.name,
+            **kwargs,
+        }
+        params_path = self._out_dir / f'{name}.params.json'
+        params_path.write_text(json.dumps(params))
+        self._params_paths.append(str(params_path))
+        return sources_path
+
+    def _CreateIndex(self):
+        with mock.patch.object(dep_utils.subprocess, 'run') as run_mock:
+            run_mock.return_value.stdout = '\n'.join(self._params_paths)
+            index = dep_utils.ClassLookupIndex(self._out_dir, False)
+        return index, run_mock.call_count
+
+    def _Targets(self, index, search_string):
+        return [e.target for e in index.match(search_string)]
+
+    def testMatch(self):
+        self._AddTarget(
+            'a',
+            [
+                'java/org/chromium/foo/FooBar.java',
+                'java/org/chromium/foo/Baz.java',
+            ],
+        )
+        self._AddTarget(
+            'b', ['java/org/chromium/bar/BarFoo.java'], preferred_dep=True
+        )
+        self._AddTarget(
+            'g', [], target_type='group', deps_configs=['a.params.json']
+        )
+        index, _ = self._CreateIndex()
+        self.assertEqual(
+            self._Targets(index, 'org.chromium.bar.BarFoo'), ['//foo:b']
+        )
+        # Groups contain their deps' classes.
+        self.assertEqual(self._Targets(index, 'baz'), ['//foo:a', '//foo:g'])
+        self.assertEqual(
+            sorted(self._Targets(index, 'oBa')), ['//foo:a', '//foo:g']
+        )
+        self.assertEqual(
+            sorted(self._Targets(index, 'fo')),
+            ['//foo:a', '//foo:a', '//foo:b', '//foo:g', '//foo:g'],
+        )
+        self.assertEqual(self._Targets(index, 'quux'), [])
+        # Inner classes fall back to their outer class.
+        self.assertEqual(
+            self._Targets(index, 'org.chromium.bar.BarFoo.Inner'), ['//foo:b']
+        )
+
+    def testIncrementalUpdate(self):
+        sources_path = self._AddTarget(
+            'a', ['java/org/chromium/foo/Alpha.java']
+        )
+        self._AddTarget('b', ['java/org/chromium/foo/Beta.java'])
+        index, num_runs = self._CreateIndex()
+        self.assertEqual(num_runs, 1)
+        self.assertEqual(self._Targets(index, 'Alpha'), ['//foo:a'])
+
+        sources_path.write_text('java/org/chromium/foo/Gamma.java\n')
+        os.utime(sources_path, ns=(0, 0))
+        with mock.patch.object(
+            dep_utils.ClassLookupIndex,
+            '_compute_full_class_names_for_build_config',
+            autospec=True,
+            side_effect=(
+                dep_utils.ClassLookupIndex._compute_full_class_names_for_build_config
+            ),
+        ) as compute_mock:
+            index, num_runs = self._CreateIndex()
+        # Neither list_java_targets.py nor unchanged targets are re-run.
+        self.assertEqual(num_runs, 0)
+        self.assertEqual(compute_mock.call_count, 1)
+        self.assertEqual(self._Targets(index, 'Alpha'), [])
+        self.assertEqual(self._Targets(index, 'Gamma'), ['//foo:a'])
+        self.assertEqual(self._Targets(index, 'Beta'), ['//foo:b'])
+
+        # Regenerating build.ninja re-lists targets.
+        os.utime(self._out_dir / 'build.ninja', ns=(0, 0))
+        _, num_runs = self._CreateIndex()
+        self.assertEqual(num_runs, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,11 +3,18 @@
 # found in the LICENSE file.
 
 
+import bisect
+import concurrent.futures
 import difflib
 import hashlib
 import itertools
 import json
+import logging
+import mmap
 import os
+import sqlite3
+import struct
+import time
 import zipfile
 
 from util import build_utils  # pylint: disable=unused-import
@@ -20,6 +27,38 @@ PRINT_EXPLANATIONS = int(os.environ.get('PRINT_BUILD_EXPLANATIONS', 0))
 # An escape hatch that causes all targets to be rebuilt.
 _FORCE_REBUILD = int(os.environ.get('FORCE_REBUILD', 0))
 
+# Set to 0 to disable the tag cache, or to a path to use a specific cache file.
+_TAG_CACHE_ENV = os.environ.get('MD5_CHECK_TAG_CACHE', '')
+_TAG_CACHE_FILENAME = '.md5_check_tag_cache.sqlite'
+# Files modified this recently are not cached since they could be modified
+# again without their mtime changing.
+_TAG_CACHE_RACY_WINDOW_NS = 2 * 10**9
+# How often to drop entries for files that no longer exist.
+_TAG_CACHE_EVICT_INTERVAL_SECS = 24 * 60 * 60
+# Hit / miss counters are appended to this file rather than written to the
+# database, so that actions with only hits do not take its write lock.
+_TAG_CACHE_STATS_SUFFIX = '.stats'
+# (hits, misses) record of the stats file.
+_TAG_CACHE_STATS_RECORD = struct.Struct('<QQ')
+_HASH_CHUNK_SIZE = 1024 * 1024
+# Upper bound on threads used to hash inputs and read zip entries.
+_MAX_HASH_THREADS = min(16, os.cpu_count() or 1)
+
+# Binary .md5.stamp format (all integers are little-endian):
+#   Header: magic, version, files md5, strings md5, # strings, # files,
+#       offset of the file index.
+#   Strings: (u32 length, utf-8 bytes) per input string.
+#   File records, sorted by path:
+#       u16 path length, path, u16 tag length, tag, u32 # entries,
+#       then per entry: u16 subpath length, subpath, u64 tag.
+#   File index: u64 offset of each file record, in the same order.
+_STAMP_MAGIC = b'MD5STAMP'
+_STAMP_VERSION = 1
+_STAMP_HEADER = struct.Struct('<8sI16s16sIIQ')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+
 
 def CallAndWriteDepfileIfStale(
     on_stale_md5,
@@ -120,16 +159,33 @@ def CallAndRecordIfStale(
     new_metadata.AddStrings(input_strings)
 
     zip_allowlist = set(track_subpaths_allowlist or [])
-    for path in input_paths:
-        if os.path.isabs(path):
-            path = os.path.relpath(path)
+    input_paths = [
+        os.path.relpath(p) if os.path.isabs(p) else p for p in input_paths
+    ]
+    zip_paths = [p for p in input_paths if p in zip_allowlist]
+    file_paths = [p for p in input_paths if p not in zip_allowlist]
+
+    # Hashing releases the GIL, so threads are enough to parallelize this.
+    with concurrent.futures.ThreadPoolExecutor(_MAX_HASH_THREADS) as executor:
+        # Results are in input order, so stamps do not depend on scheduling.
+        entries_by_path = dict(
+            zip(zip_paths, executor.map(_ExtractZipEntries, zip_paths))
+        )
         # It's faster to md5 an entire zip file than it is to just locate & hash
         # its central directory (which is what this used to do).
+        tag_cache = _TagCache.Open()
+        if tag_cache:
+            file_tags = tag_cache.GetTags(file_paths, executor.map)
+            tag_cache.Close()
+        else:
+            file_tags = executor.map(_ComputeTagForPath, file_paths)
+        tag_by_path = dict(zip(file_paths, file_tags))
+
+    for path in input_paths:
         if path in zip_allowlist:
-            entries = _ExtractZipEntries(path)
-            new_metadata.AddZipFile(path, entries)
+            new_metadata.AddZipFile(path, entries_by_path[path])
         else:
-            new_metadata.AddFile(path, _ComputeTagForPath(path))
+            new_metadata.AddFile(path, tag_by_path[path])
 
     force = force or _FORCE_REBUILD
     missing_outputs = [
@@ -138,9 +194,9 @@ def CallAndRecordIfStale(
     old_metadata = None
 
     if not missing_outputs and os.path.exists(record_path):
-        with open(record_path, 'r', encoding='utf-8') as jsonfile:
+        with open(record_path, 'rb') as stamp_file:
             try:
-                old_metadata = _Metadata.FromFile(jsonfile)
+                old_metadata = _Metadata.FromFile(stamp_file)
             except:  # pylint: disable=bare-except
                 pass  # Not yet using new file format.
 
@@ -157,7 +213,9 @@ def CallAndRecordIfStale(
     args = (changes,) if pass_changes else ()
     function(*args)
 
-    with open(record_path, 'w', encoding='utf-8') as f:
+    # Replace rather than overwrite the stamp, since |old_metadata| may still
+    # have it memory-mapped.
+    with action_helpers.atomic_output(record_path, only_if_changed=False) as f:
         new_metadata.ToFile(f)
 
 
@@ -310,6 +368,120 @@ class Changes:
         return 'I have no idea what changed (there is a bug).'
 
 
+class _StampReader:
+    """Lazily decodes a binary .md5.stamp file.
+
+    Only the header is decoded up front. File records are located by binary
+    search over the (sorted) file index, and a file's entries are decoded only
+    when they are asked for.
+
+    Args:
+      buf: A bytes-like object (e.g. an mmap) holding the file contents.
+    """
+
+    def __init__(self, buf):
+        (
+            magic,
+            version,
+            files_md5,
+            strings_md5,
+            self._num_strings,
+            self._num_files,
+            self._index_offset,
+        ) = _STAMP_HEADER.unpack_from(buf, 0)
+        if magic != _STAMP_MAGIC or version != _STAMP_VERSION:
+            raise ValueError('Unsupported .md5.stamp format')
+        self._buf = buf
+        self.files_md5 = files_md5.hex()
+        self.strings_md5 = strings_md5.hex()
+        # Map of path -> (tag, offset of entries, # entries).
+        self._records = {}
+        # Map of path -> {subpath: tag}.
+        self._entries = {}
+
+    def _ReadStr(self, offset, length_struct=_U16):
+        (length,) = length_struct.unpack_from(self._buf, offset)
+        offset += length_struct.size
+        value = bytes(self._buf[offset : offset + length]).decode('utf-8')
+        return value, offset + length
+
+    def _RecordOffset(self, i):
+        offset = self._index_offset + i * _U64.size
+        return _U64.unpack_from(self._buf, offset)[0]
+
+    def _ReadRecord(self, offset):
+        path, offset = self._ReadStr(offset)
+        tag, offset = self._ReadStr(offset)
+        (num_entries,) = _U32.unpack_from(self._buf, offset)
+        return path, (tag, offset + _U32.size, num_entries)
+
+    def GetStrings(self):
+        ret = []
+        offset = _STAMP_HEADER.size
+        for _ in range(self._num_strings):
+            value, offset = self._ReadStr(offset, _U32)
+            ret.append(value)
+        return ret
+
+    def IterPaths(self):
+        for i in range(self._num_files):
+            path, record = self._ReadRecord(self._RecordOffset(i))
+            self._records[path] = record
+            yield path
+
+    def _FindRecord(self, path):
+        record = self._records.get(path)
+        if record is None:
+            paths = _LazySequence(
+                self._num_files,
+                lambda i: self._ReadStr(self._RecordOffset(i))[0],
+            )
+            i = bisect.bisect_left(paths, path)
+            if i == self._num_files:
+                return None
+            found_path, record = self._ReadRecord(self._RecordOffset(i))
+            if found_path != path:
+                return None
+            self._records[path] = record
+        return record
+
+    def GetEntries(self, path):
+        """Returns a dict of subpath -> tag for the given path, or None."""
+        entries = self._entries.get(path)
+        if entries is None:
+            record = self._FindRecord(path)
+            if record is None:
+                return None
+            _, offset, num_entries = record
+            entries = {}
+            for _ in range(num_entries):
+                subpath, offset = self._ReadStr(offset)
+                (entries[subpath],) = _U64.unpack_from(self._buf, offset)
+                offset += _U64.size
+            self._entries[path] = entries
+        return entries
+
+    def GetTag(self, path, subpath=None):
+        if subpath is not None:
+            return (self.GetEntries(path) or {}).get(subpath)
+        record = self._FindRecord(path)
+        return record and record[0]
+
+
+class _LazySequence:
+    """A sequence whose items are computed on access (for use with bisect)."""
+
+    def __init__(self, length, func):
+        self._length = length
+        self._func = func
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        return self._func(i)
+
+
 class _Metadata:
     """Data model for tracking change metadata.
 
@@ -318,7 +490,8 @@ class _Metadata:
           Changes functionality.
     """
 
-    # Schema:
+    # Metadata is written in the binary format described by _STAMP_HEADER.
+    # Older stamps use this JSON schema, and are still read:
     # {
     #   "files-md5": "VALUE",
     #   "strings-md5": "VALUE",
@@ -344,12 +517,23 @@ class _Metadata:
         self._strings = []
         # Map of (path, subpath) -> entry. Created upon first call to _GetEntry().
         self._file_map = None
+        # Set when loaded from a binary stamp file.
+        self._reader = None
 
     @classmethod
     def FromFile(cls, fileobj):
-        """Returns a _Metadata initialized from a file object."""
+        """Returns a _Metadata initialized from a binary file object."""
         ret = cls()
-        obj = json.load(fileobj)
+        buf = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[: len(_STAMP_MAGIC)] == _STAMP_MAGIC:
+            # The reader decodes entries lazily, so it owns the mmap from here
+            # on, and it is unmapped once the reader is garbage collected.
+            ret._reader = _StampReader(buf)
+            ret._files_md5 = ret._reader.files_md5
+            ret._strings_md5 = ret._reader.strings_md5
+            return ret
+        with buf:
+            obj = json.loads(buf[:])
         ret._files_md5 = obj['files-md5']
         ret._strings_md5 = obj['strings-md5']
         ret._files = obj.get('input-files', [])
@@ -357,16 +541,47 @@ class _Metadata:
         return ret
 
     def ToFile(self, fileobj):
-        """Serializes metadata to the given file object."""
-        obj = {
-            'files-md5': self.FilesMd5(),
-            'strings-md5': self.StringsMd5(),
-        }
+        """Serializes metadata to the given binary file object."""
+        files = []
+        strings = []
         if self._track_entries:
-            obj['input-files'] = sorted(self._files, key=lambda e: e['path'])
-            obj['input-strings'] = self._strings
-
-        json.dump(obj, fileobj, indent=2)
+            files = sorted(self._files, key=lambda e: e['path'])
+            strings = self._strings
+
+        def encode(value, length_struct=_U16):
+            data = str(value).encode('utf-8')
+            return length_struct.pack(len(data)) + data
+
+        parts = [b'']  # Placeholder for the header.
+        offset = _STAMP_HEADER.size
+        for value in strings:
+            parts.append(encode(value, _U32))
+            offset += len(parts[-1])
+        record_offsets = []
+        for entry in files:
+            subentries = entry.get('entries', ())
+            record = [
+                encode(entry['path']),
+                encode(entry['tag']),
+                _U32.pack(len(subentries)),
+            ]
+            for subentry in subentries:
+                record.append(encode(subentry['path']))
+                record.append(_U64.pack(subentry['tag']))
+            record_offsets.append(offset)
+            parts.append(b''.join(record))
+            offset += len(parts[-1])
+        parts.append(b''.join(_U64.pack(o) for o in record_offsets))
+        parts[0] = _STAMP_HEADER.pack(
+            _STAMP_MAGIC,
+            _STAMP_VERSION,
+            bytes.fromhex(self.FilesMd5()),
+            bytes.fromhex(self.StringsMd5()),
+            len(strings),
+            len(files),
+            offset,
+        )
+        fileobj.write(b''.join(parts))
 
     def _AssertNotQueried(self):
         assert self._files_md5 is None
@@ -413,6 +628,8 @@ class _Metadata:
 
     def GetStrings(self):
         """Returns the list of input strings."""
+        if self._reader:
+            return self._reader.GetStrings()
         return self._strings
 
     def FilesMd5(self):
@@ -442,11 +659,15 @@ class _Metadata:
 
     def GetTag(self, path, subpath=None):
         """Returns the tag for the given path / subpath."""
+        if self._reader:
+            return self._reader.GetTag(path, subpath)
         ret = self._GetEntry(path, subpath)
         return ret and ret['tag']
 
     def IterPaths(self):
         """Returns a generator for all top-level paths."""
+        if self._reader:
+            return self._reader.IterPaths()
         return (e['path'] for e in self._files)
 
     def IterSubpaths(self, path):
@@ -455,6 +676,8 @@ class _Metadata:
         If the given path is not a zip file or doesn't exist, returns an empty
         iterable.
         """
+        if self._reader:
+            return iter(self._reader.GetEntries(path) or ())
         outer_entry = self._GetEntry(path)
         if not outer_entry:
             return ()
@@ -463,15 +686,242 @@ class _Metadata:
 
 
 def _ComputeTagForPath(path):
-    stat_result = os.stat(path)
-    if stat_result.st_size > 1 * 1024 * 1024:
-        # Fallback to mtime for large files so that md5_check does not take too long
-        # to run.
-        return int(stat_result.st_mtime)
-    md5 = hashlib.md5()
+    """Returns a hash of the contents of |path|."""
+    # blake2b is considerably faster than md5, which matters for large inputs.
+    h = hashlib.blake2b(digest_size=16)
     with open(path, 'rb') as f:
-        md5.update(f.read())
-    return md5.hexdigest()
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _TagCache:
+    """Caches file tags across actions within an output directory.
+
+    Entries are keyed by (path, inode, size, mtime_ns), so any modification to
+    a file causes it to be re-hashed. The cache is an sqlite database, which
+    makes it safe to use from many concurrently running actions. All errors
+    from the database are treated as cache misses.
+
+    Args:
+      db_path: Path to the sqlite database.
+    """
+
+    def __init__(self, db_path):
+        self._db_path = db_path
+        self._conn = None
+        self._pending = []
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def Open(cls):
+        """Returns the cache for the current output directory, or None."""
+        if _TAG_CACHE_ENV == '0':
+            return None
+        if _TAG_CACHE_ENV:
+            return cls(_TAG_CACHE_ENV)
+        # Actions run from the root of the output directory.
+        if not os.path.exists('args.gn'):
+            return None
+        return cls(_TAG_CACHE_FILENAME)
+
+    def _Connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=60)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tags (path TEXT PRIMARY KEY, '
+                'inode INTEGER, size INTEGER, mtime_ns INTEGER, tag TEXT)'
+            )
+            for table in ('stats', 'meta'):
+                conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {table} '
+                    '(name TEXT PRIMARY KEY, value INTEGER)'
+                )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _Lookup(self, key_path, stat_result):
+        if self._conn is False:
+            return None
+        try:
+            row = (
+                self._Connect()
+                .execute(
+                    'SELECT inode, size, mtime_ns, tag FROM tags '
+                    'WHERE path = ?',
+                    (key_path,),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            logging.warning('Disabling md5_check tag cache: %s', e)
+            self._conn = False
+            return None
+        if row and row[:3] == (
+            stat_result.st_ino,
+            stat_result.st_size,
+            stat_result.st_mtime_ns,
+        ):
+            return row[3]
+        return None
+
+    def GetTags(self, paths, map_func=map):
+        """Returns tags for |paths|, hashing only those that are not cached.
+
+        Args:
+          paths: List of paths to return tags for.
+          map_func: Used to hash uncached paths (e.g. Executor.map).
+        """
+        tags = {}
+        uncached = {}
+        for path in paths:
+            if path in tags or path in uncached:
+                continue
+            key_path = os.path.abspath(path)
+            stat_result = os.stat(path)
+            tag = self._Lookup(key_path, stat_result)
+            if tag is None:
+                uncached[path] = (key_path, stat_result)
+            else:
+                tags[path] = tag
+        self.hits += len(tags)
+        self.misses += len(uncached)
+
+        new_tags = map_func(_ComputeTagForPath, uncached)
+        now = time.time_ns()
+        for (path, (key_path, stat_result)), tag in zip(
+            uncached.items(), new_tags
+        ):
+            tags[path] = tag
+            if now - stat_result.st_mtime_ns > _TAG_CACHE_RACY_WINDOW_NS:
+                self._pending.append(
+                    (
+                        key_path,
+                        stat_result.st_ino,
+                        stat_result.st_size,
+                        stat_result.st_mtime_ns,
+                        tag,
+                    )
+                )
+        return [tags[p] for p in paths]
+
+    def GetTag(self, path):
+        """Returns the tag for |path|, hashing it only if not cached."""
+        return self.GetTags([path])[0]
+
+    def _FindEvictions(self, conn):
+        """Returns paths to drop if eviction is due, or None otherwise.
+
+        Only reads from the database, so it runs before the write transaction.
+        """
+        row = conn.execute(
+            'SELECT value FROM meta WHERE name = ?', ('last_evict',)
+        ).fetchone()
+        if row and time.time() - row[0] < _TAG_CACHE_EVICT_INTERVAL_SECS:
+            return None
+        paths = [r[0] for r in conn.execute('SELECT path FROM tags')]
+        return [(p,) for p in paths if not os.path.exists(p)]
+
+    def _AppendStats(self):
+        # A single small O_APPEND write, so concurrent actions need no lock.
+        fd = os.open(
+            self._db_path + _TAG_CACHE_STATS_SUFFIX,
+            os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+            0o644,
+        )
+        try:
+            os.write(fd, _TAG_CACHE_STATS_RECORD.pack(self.hits, self.misses))
+        finally:
+            os.close(fd)
+
+    def _FoldStats(self, conn):
+        """Moves the counters of the stats file into the database."""
+        stats_path = self._db_path + _TAG_CACHE_STATS_SUFFIX
+        folded_path = f'{stats_path}.{os.getpid()}'
+        try:
+            os.rename(stats_path, folded_path)
+        except FileNotFoundError:
+            return
+        hits, misses = _ReadStatsFile(folded_path)
+        os.unlink(folded_path)
+        for name, value in (('hits', hits), ('misses', misses)):
+            conn.execute(
+                'INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) '
+                'DO UPDATE SET value = value + excluded.value',
+                (name, value),
+            )
+
+    def Close(self):
+        """Writes new entries and counters."""
+        if self._conn is False or not (self.hits or self.misses):
+            return
+        try:
+            self._AppendStats()
+        except OSError as e:
+            logging.warning('Failed to update md5_check tag cache stats: %s', e)
+        try:
+            conn = self._Connect()
+            deleted = self._FindEvictions(conn)
+            # Most actions of a no-op build have nothing to write, and skipping
+            # the transaction keeps them from serializing on its lock.
+            if self._pending or deleted is not None:
+                with conn:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?)',
+                        self._pending,
+                    )
+                    if deleted is not None:
+                        conn.executemany(
+                            'DELETE FROM tags WHERE path = ?', deleted
+                        )
+                        conn.execute(
+                            'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                            ('last_evict', int(time.time())),
+                        )
+                        self._FoldStats(conn)
+            conn.close()
+        except (sqlite3.Error, OSError) as e:
+            logging.warning('Failed to update md5_check tag cache: %s', e)
+        self._conn = False
+        self._pending = []
+
+
+def _ReadStatsFile(path):
+    """Returns the summed (hits, misses) of a tag cache stats file."""
+    hits = misses = 0
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return hits, misses
+    # Ignores a record that is still being written.
+    end = len(data) - len(data) % _TAG_CACHE_STATS_RECORD.size
+    for h, m in _TAG_CACHE_STATS_RECORD.iter_unpack(data[:end]):
+        hits += h
+        misses += m
+    return hits, misses
+
+
+def GetTagCacheStats(db_path=_TAG_CACHE_FILENAME):
+    """Returns a dict of counters (e.g. "hits", "misses") for a tag cache."""
+    ret = {}
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path, timeout=60)
+        try:
+            ret = dict(conn.execute('SELECT name, value FROM stats'))
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
+    hits, misses = _ReadStatsFile(db_path + _TAG_CACHE_STATS_SUFFIX)
+    if hits or misses:
+        ret['hits'] = ret.get('hits', 0) + hits
+        ret['misses'] = ret.get('misses', 0) + misses
+    return ret
 
 
 def _ComputeInlineMd5(iterable):
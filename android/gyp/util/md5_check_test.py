@@ -3,11 +3,15 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import concurrent.futures
 import fnmatch
+import json
 import os
+import sqlite3
 import sys
 import tempfile
 import unittest
+from unittest import mock
 import zipfile
 
 sys.path.insert(
@@ -210,5 +214,174 @@ class TestMd5Check(unittest.TestCase):
         )
 
 
+class TestMetadata(unittest.TestCase):
+    def _CreateMetadata(self):
+        metadata = md5_check._Metadata(track_entries=True)
+        metadata.AddStrings(['string1', 'string2'])
+        metadata.AddFile('b.txt', 'tagb')
+        metadata.AddZipFile('a.jar', [('Foo.class', 1), ('Bar.class', 2**32)])
+        metadata.AddFile('c.txt', 'tagc')
+        return metadata
+
+    def _RoundTrip(self, metadata):
+        with tempfile.NamedTemporaryFile() as f:
+            metadata.ToFile(f)
+            f.flush()
+            f.seek(0)
+            return md5_check._Metadata.FromFile(f)
+
+    def testBinaryRoundTrip(self):
+        metadata = self._CreateMetadata()
+        loaded = self._RoundTrip(metadata)
+        self.assertEqual(loaded.FilesMd5(), metadata.FilesMd5())
+        self.assertEqual(loaded.StringsMd5(), metadata.StringsMd5())
+        self.assertEqual(loaded.GetStrings(), ['string1', 'string2'])
+        self.assertEqual(list(loaded.IterPaths()), ['a.jar', 'b.txt', 'c.txt'])
+        for path in ('a.jar', 'b.txt', 'c.txt', 'missing.txt'):
+            self.assertEqual(loaded.GetTag(path), metadata.GetTag(path))
+        self.assertEqual(
+            list(loaded.IterSubpaths('a.jar')), ['Foo.class', 'Bar.class']
+        )
+        self.assertEqual(loaded.GetTag('a.jar', 'Bar.class'), 2**32)
+        self.assertIsNone(loaded.GetTag('a.jar', 'Missing.class'))
+        self.assertIsNone(loaded.GetTag('b.txt', 'Foo.class'))
+        self.assertEqual(list(loaded.IterSubpaths('b.txt')), [])
+
+    def testLazyEntries(self):
+        loaded = self._RoundTrip(self._CreateMetadata())
+        self.assertEqual(loaded.GetTag('c.txt'), 'tagc')
+        self.assertEqual(loaded._reader._entries, {})
+        loaded.GetTag('a.jar', 'Foo.class')
+        self.assertEqual(list(loaded._reader._entries), ['a.jar'])
+
+    def testUntrackedEntries(self):
+        metadata = md5_check._Metadata()
+        metadata.AddStrings(['string1'])
+        metadata.AddFile('b.txt', 'tagb')
+        loaded = self._RoundTrip(metadata)
+        self.assertEqual(loaded.FilesMd5(), metadata.FilesMd5())
+        self.assertEqual(list(loaded.IterPaths()), [])
+
+    def testReadsJson(self):
+        metadata = self._CreateMetadata()
+        obj = {
+            'files-md5': metadata.FilesMd5(),
+            'strings-md5': metadata.StringsMd5(),
+            'input-files': [
+                {
+                    'path': 'a.jar',
+                    'tag': 'taga',
+                    'entries': [{'path': 'Foo.class', 'tag': 1}],
+                },
+            ],
+            'input-strings': ['string1'],
+        }
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(json.dumps(obj).encode('utf-8'))
+            f.flush()
+            f.seek(0)
+            loaded = md5_check._Metadata.FromFile(f)
+        self.assertEqual(loaded.FilesMd5(), metadata.FilesMd5())
+        self.assertEqual(loaded.GetStrings(), ['string1'])
+        self.assertEqual(loaded.GetTag('a.jar', 'Foo.class'), 1)
+
+
+class TestTagCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _WriteInput(self, name, data, mtime=1000000000):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        # Old mtimes are required for entries to be cached.
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def _GetTags(self, *paths):
+        cache = md5_check._TagCache(self.db_path)
+        tags = [cache.GetTag(p) for p in paths]
+        cache.Close()
+        return tags, cache.hits, cache.misses
+
+    def testHitsAndMisses(self):
+        path1 = self._WriteInput('1.txt', b'one')
+        path2 = self._WriteInput('2.txt', b'two')
+        tags, hits, misses = self._GetTags(path1, path2)
+        self.assertEqual(
+            tags,
+            [
+                md5_check._ComputeTagForPath(path1),
+                md5_check._ComputeTagForPath(path2),
+            ],
+        )
+        self.assertEqual((hits, misses), (0, 2))
+
+        self.assertEqual(self._GetTags(path1, path2), (tags, 2, 0))
+        self.assertEqual(
+            md5_check.GetTagCacheStats(self.db_path), {'hits': 2, 'misses': 2}
+        )
+
+    def testGetTagsPreservesOrder(self):
+        paths = [self._WriteInput(f'{i}.txt', b'%d' % i) for i in range(20)]
+        paths.append(paths[0])
+        cache = md5_check._TagCache(self.db_path)
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            tags = cache.GetTags(paths, executor.map)
+        cache.Close()
+        self.assertEqual(tags, [md5_check._ComputeTagForPath(p) for p in paths])
+        self.assertEqual((cache.hits, cache.misses), (0, 20))
+
+    def testModifiedFile(self):
+        path = self._WriteInput('1.txt', b'one')
+        (old_tag,), _, _ = self._GetTags(path)
+        self._WriteInput('1.txt', b'two', mtime=1000000001)
+        (new_tag,), hits, misses = self._GetTags(path)
+        self.assertNotEqual(old_tag, new_tag)
+        self.assertEqual((hits, misses), (0, 1))
+
+    def testRecentlyModifiedFileNotCached(self):
+        path = self._WriteInput('1.txt', b'one')
+        os.utime(path)
+        self._GetTags(path)
+        self.assertEqual(self._GetTags(path)[1:], (0, 1))
+
+    def testEvictsDeletedFiles(self):
+        path1 = self._WriteInput('1.txt', b'one')
+        path2 = self._WriteInput('2.txt', b'two')
+        self._GetTags(path1, path2)
+        os.unlink(path2)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('DELETE FROM meta')
+        self._GetTags(path1)
+        with sqlite3.connect(self.db_path) as conn:
+            paths = [r[0] for r in conn.execute('SELECT path FROM tags')]
+        self.assertEqual(paths, [os.path.abspath(path1)])
+
+    def testHitsDoNotWriteToDatabase(self):
+        path = self._WriteInput('1.txt', b'one')
+        self._GetTags(path)
+        # Another action holds the write lock. Actions with only hits must not
+        # wait for it.
+        with sqlite3.connect(self.db_path, isolation_level=None) as other:
+            other.execute('BEGIN IMMEDIATE')
+            connect = sqlite3.connect
+            with mock.patch.object(
+                md5_check.sqlite3,
+                'connect',
+                lambda p, timeout: connect(p, timeout=0.1),
+            ):
+                with self.assertNoLogs(level='WARNING'):
+                    self.assertEqual(self._GetTags(path)[1:], (1, 0))
+            other.execute('ROLLBACK')
+        self.assertEqual(
+            md5_check.GetTagCacheStats(self.db_path), {'hits': 1, 'misses': 1}
+        )
+
+
 if __name__ == '__main__':
     unittest.main()
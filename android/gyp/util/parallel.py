@@ -4,12 +4,19 @@
 """Helpers related to multiprocessing.
 
 Based on: //tools/binary_size/libsupersize/parallel.py
+
+Jobs whose function and arguments can be pickled run on a pool of worker
+processes that is shared by all calls within the process, and started on first
+use. Other jobs run on a pool created for the call, which receives them through
+fork() instead.
 """
 
 import atexit
+import functools
 import logging
 import multiprocessing
 import os
+import pickle
 import sys
 import threading
 import traceback
@@ -18,6 +25,12 @@ DISABLE_ASYNC = os.environ.get('DISABLE_ASYNC') == '1'
 if DISABLE_ASYNC:
     logging.warning('Running in synchronous mode.')
 
+# Caps the number of worker processes when --max-workers is not passed, e.g.
+# when running a script by hand.
+_MAX_WORKERS_ENV = 'PARALLEL_MAX_WORKERS'
+# Set by SetMaxWorkers(), from the android_parallel_max_workers GN arg.
+_max_workers = None
+
 _all_pools = None
 _is_child_process = False
 _silence_exceptions = False
@@ -26,6 +39,13 @@ _silence_exceptions = False
 _fork_params = None
 _fork_kwargs = None
 
+_shared_pool = None
+_shared_pool_size = 0
+_shared_pool_lock = threading.Lock()
+# The function and kwargs most recently unpickled by a shared pool worker, as
+# (payload, func, kwargs).
+_worker_call = None
+
 # Ensure fork is used on MacOS for multiprocessing compatibility.
 # Starting from Python 3.8, the "spawn" method is the default on MacOS.
 # On Linux hosts this line will be a no-op.
@@ -63,34 +83,64 @@ class _ExceptionWrapper:
             )
 
 
+def _CallAndWrapExceptions(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        # Only keep the exception type for builtin exception types or else risk
+        # further marshalling exceptions.
+        exception_type = None
+        if hasattr(__builtins__, type(e).__name__):
+            exception_type = type(e).__name__
+        # multiprocessing is supposed to catch and return exceptions automatically
+        # but it doesn't seem to work properly :(.
+        return _ExceptionWrapper(traceback.format_exc(), exception_type)
+    except BaseException:
+        return _ExceptionWrapper(traceback.format_exc())
+
+
 class _FuncWrapper:
     """Runs on the fork()'ed side to catch exceptions and spread *args."""
 
     def __init__(self, func):
-        global _is_child_process
-        _is_child_process = True
         self._func = func
 
     def __call__(self, index, _=None):
         global _fork_kwargs
-        try:
-            if (
-                _fork_kwargs is None
-            ):  # Clarifies _fork_kwargs is map for pylint.
-                _fork_kwargs = {}
-            params = _fork_params[index]  # pylint: disable=unsubscriptable-object
-            return self._func(*params, **_fork_kwargs)
-        except Exception as e:
-            # Only keep the exception type for builtin exception types or else risk
-            # further marshalling exceptions.
-            exception_type = None
-            if hasattr(__builtins__, type(e).__name__):
-                exception_type = type(e).__name__
-            # multiprocessing is supposed to catch and return exceptions automatically
-            # but it doesn't seem to work properly :(.
-            return _ExceptionWrapper(traceback.format_exc(), exception_type)
-        except BaseException:
-            return _ExceptionWrapper(traceback.format_exc())
+        global _is_child_process
+        # Set here rather than in __init__(), which runs in the parent.
+        _is_child_process = True
+        if _fork_kwargs is None:  # Clarifies _fork_kwargs is map for pylint.
+            _fork_kwargs = {}
+        params = _fork_params[index]  # pylint: disable=unsubscriptable-object
+        return _CallAndWrapExceptions(self._func, params, _fork_kwargs)
+
+
+def _CallChunk(call_payload, chunk_payload):
+    """Runs in a shared pool worker.
+
+    Args:
+      call_payload: The pickled (func, kwargs) of the call.
+      chunk_payload: A pickled list of (index, args).
+
+    Returns:
+      A list of (index, return value).
+    """
+    global _is_child_process
+    global _worker_call
+    _is_child_process = True
+    # Chunks of the same call share the unpickled function.
+    if _worker_call is None or _worker_call[0] != call_payload:
+        _worker_call = (call_payload, *pickle.loads(call_payload))
+    _, func, kwargs = _worker_call
+    return [
+        (index, _CallAndWrapExceptions(func, args, kwargs))
+        for index, args in pickle.loads(chunk_payload)
+    ]
+
+
+def _CallOne(call_payload, chunk_payload):
+    return _CallChunk(call_payload, chunk_payload)[0][1]
 
 
 class _WrappedResult:
@@ -162,25 +212,96 @@ def _CheckForException(value):
         sys.exit(1)
 
 
-def _MakeProcessPool(job_params, **job_kwargs):
+def AddCommandLineFlags(parser):
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        help='Maximum number of worker processes. Defaults to $%s, or to the '
+        'number of CPUs.' % _MAX_WORKERS_ENV,
+    )
+
+
+def SetMaxWorkers(max_workers):
+    """Caps the number of worker processes of pools started afterwards."""
+    global _max_workers
+    _max_workers = max_workers
+
+
+def _MaxWorkers():
+    max_workers = multiprocessing.cpu_count()
+    value = _max_workers or os.environ.get(_MAX_WORKERS_ENV)
+    if value:
+        max_workers = min(max_workers, max(1, int(value)))
+    return max_workers
+
+
+def _RegisterPool(pool):
     global _all_pools
+    if _all_pools is None:
+        _all_pools = []
+        atexit.register(_TerminatePools)
+    _all_pools.append(pool)
+
+
+def _MakeProcessPool(job_params, **job_kwargs):
     global _fork_params
     global _fork_kwargs
     assert _fork_params is None
     assert _fork_kwargs is None
-    pool_size = min(len(job_params), multiprocessing.cpu_count())
+    pool_size = min(len(job_params), _MaxWorkers())
     _fork_params = job_params
     _fork_kwargs = job_kwargs
     ret = multiprocessing.Pool(pool_size)
     _fork_params = None
     _fork_kwargs = None
-    if _all_pools is None:
-        _all_pools = []
-        atexit.register(_TerminatePools)
-    _all_pools.append(ret)
+    _RegisterPool(ret)
     return ret
 
 
+def _GetSharedPool(num_workers):
+    """Returns the shared pool, (re)starting it with at least |num_workers|."""
+    global _shared_pool
+    global _shared_pool_size
+    with _shared_pool_lock:
+        if _shared_pool is None or _shared_pool_size < num_workers:
+            if _shared_pool is not None:
+                # Its workers exit once they finish their queued chunks.
+                _shared_pool.close()
+            _shared_pool = multiprocessing.Pool(num_workers)
+            _shared_pool_size = num_workers
+            _RegisterPool(_shared_pool)
+        return _shared_pool
+
+
+def _PickleChunks(func, kwargs, chunks):
+    """Returns the pickled call and chunks, or None if they cannot be pickled."""
+    # Workers cannot use the shared pool of the process they were forked from.
+    if _is_child_process:
+        return None
+    try:
+        call_payload = pickle.dumps((func, kwargs))
+        chunk_payloads = [pickle.dumps(chunk) for chunk in chunks]
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return None
+    return call_payload, chunk_payloads
+
+
+def _SplitIntoChunks(items, num_workers):
+    """Splits items into chunks that get smaller towards the end.
+
+    Idle workers take the next chunk from the pool's queue. Large chunks early
+    on reduce the per-chunk overhead, while small ones at the end keep workers
+    from idling while others finish a large chunk.
+    """
+    chunks = []
+    start = 0
+    while start < len(items):
+        size = max(1, (len(items) - start) // (4 * num_workers))
+        chunks.append(items[start : start + size])
+        start += size
+    return chunks
+
+
 def ForkAndCall(func, args):
     """Runs |func| in a fork'ed process.
 
@@ -190,6 +311,12 @@ def ForkAndCall(func, args):
     if DISABLE_ASYNC:
         pool = None
         result = _ImmediateResult(func(*args))
+    elif payloads := _PickleChunks(func, {}, [[(0, args)]]):
+        pool = None
+        call_payload, (chunk_payload,) = payloads
+        result = _GetSharedPool(1).apply_async(
+            _CallOne, (call_payload, chunk_payload)
+        )
     else:
         pool = _MakeProcessPool([args])  # Omit |kwargs|.
         result = pool.apply_async(_FuncWrapper(func), (0,))
@@ -197,6 +324,41 @@ def ForkAndCall(func, args):
     return _WrappedResult(result, pool=pool)
 
 
+def BulkForkAndCallUnordered(func, arg_tuples, **kwargs):
+    """Like BulkForkAndCall(), but yields results as soon as they are ready.
+
+    Yields:
+      (index, return value) tuples, where |index| is the position of the args
+      within |arg_tuples|.
+    """
+    arg_tuples = list(arg_tuples)
+    if not arg_tuples:
+        return
+
+    if DISABLE_ASYNC:
+        for i, args in enumerate(arg_tuples):
+            yield i, func(*args, **kwargs)
+        return
+
+    num_workers = min(len(arg_tuples), _MaxWorkers())
+    chunks = _SplitIntoChunks(list(enumerate(arg_tuples)), num_workers)
+    payloads = _PickleChunks(func, kwargs, chunks)
+    if payloads is None:
+        yield from enumerate(
+            _BulkForkAndCallInNewPool(func, arg_tuples, kwargs)
+        )
+        return
+
+    call_payload, chunk_payloads = payloads
+    pool = _GetSharedPool(num_workers)
+    for results in pool.imap_unordered(
+        functools.partial(_CallChunk, call_payload), chunk_payloads
+    ):
+        for index, result in results:
+            _CheckForException(result)
+            yield index, result
+
+
 def BulkForkAndCall(func, arg_tuples, **kwargs):
     """Calls |func| in a fork'ed process for each set of args within |arg_tuples|.
 
@@ -205,15 +367,16 @@ def BulkForkAndCall(func, arg_tuples, **kwargs):
 
     Yields the return values in order.
     """
-    arg_tuples = list(arg_tuples)
-    if not arg_tuples:
-        return
+    pending = {}
+    next_index = 0
+    for index, result in BulkForkAndCallUnordered(func, arg_tuples, **kwargs):
+        pending[index] = result
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
 
-    if DISABLE_ASYNC:
-        for args in arg_tuples:
-            yield func(*args, **kwargs)
-        return
 
+def _BulkForkAndCallInNewPool(func, arg_tuples, kwargs):
     pool = _MakeProcessPool(arg_tuples, **kwargs)
     wrapped_func = _FuncWrapper(func)
     try:
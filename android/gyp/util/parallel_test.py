@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import argparse
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+)
+from util import parallel
+
+
+def _Add(a, b, c=0):
+    return a + b + c
+
+
+def _Apply(predicate, value):
+    return predicate(value)
+
+
+def _Raise():
+    raise ValueError('Oops')
+
+
+class ParallelTest(unittest.TestCase):
+    def testBulkForkAndCall(self):
+        arg_tuples = [(i, 1) for i in range(100)]
+        self.assertEqual(
+            list(parallel.BulkForkAndCall(_Add, arg_tuples, c=10)),
+            [i + 11 for i in range(100)],
+        )
+        self.assertEqual(list(parallel.BulkForkAndCall(_Add, [])), [])
+
+    def testBulkForkAndCallUnordered(self):
+        arg_tuples = [(i, i) for i in range(50)]
+        results = list(parallel.BulkForkAndCallUnordered(_Add, arg_tuples))
+        self.assertEqual(sorted(results), [(i, 2 * i) for i in range(50)])
+
+    def testSharedPoolIsReused(self):
+        list(parallel.BulkForkAndCall(_Add, [(1, 2)] * 4))
+        pool = parallel._shared_pool
+        self.assertIsNotNone(pool)
+        list(parallel.BulkForkAndCall(_Add, [(1, 2)] * 2))
+        self.assertEqual(parallel.ForkAndCall(_Add, (1, 2)).get(), 3)
+        self.assertIs(parallel._shared_pool, pool)
+
+    def testUnpicklableArgs(self):
+        # Lambdas cannot be pickled, so these go through fork() instead.
+        arg_tuples = [(lambda x: x * 2, i) for i in range(10)]
+        self.assertEqual(
+            list(parallel.BulkForkAndCall(_Apply, arg_tuples)),
+            [i * 2 for i in range(10)],
+        )
+        self.assertEqual(
+            parallel.ForkAndCall(_Apply, (lambda x: -x, 3)).get(), -3
+        )
+        # Later calls can still use the shared pool.
+        self.assertFalse(parallel._is_child_process)
+
+    def testException(self):
+        with self.assertRaises(SystemExit):
+            list(parallel.BulkForkAndCall(_Raise, [()]))
+        parallel._silence_exceptions = False
+
+    def testSplitIntoChunks(self):
+        chunks = parallel._SplitIntoChunks(list(range(100)), 2)
+        self.assertEqual(sum(chunks, []), list(range(100)))
+        self.assertEqual(len(chunks[0]), 12)
+        self.assertEqual(len(chunks[-1]), 1)
+
+    def testMaxWorkers(self):
+        parser = argparse.ArgumentParser()
+        parallel.AddCommandLineFlags(parser)
+        self.assertIsNone(parser.parse_args([]).max_workers)
+        self.addCleanup(parallel.SetMaxWorkers, None)
+        with mock.patch('multiprocessing.cpu_count', return_value=8):
+            with mock.patch.dict(os.environ, {parallel._MAX_WORKERS_ENV: '4'}):
+                self.assertEqual(parallel._MaxWorkers(), 4)
+                # --max-workers takes precedence over the environment.
+                parallel.SetMaxWorkers(
+                    parser.parse_args(['--max-workers=2']).max_workers
+                )
+                self.assertEqual(parallel._MaxWorkers(), 2)
+            parallel.SetMaxWorkers(16)
+            self.assertEqual(parallel._MaxWorkers(), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -77,6 +77,17 @@ _input_paths = []
 # set_output_dir() before using methods in this module.
 _output_dir_path = ''
 
+# Parsed JSON that outlives a single invocation (see enable_json_cache()).
+# Maps absolute path -> (stat key, parsed JSON).
+_json_cache = None
+# Paths that were not found in (or were stale in) _json_cache.
+_json_cache_misses = []
+
+# Trie of the walks done by DepsList.recursive(), keyed by the ParamsJson of
+# the walked lists. Nodes are [walk, children], where walk is the postorder
+# dict of the topological walk of the list that ends at the node, or None.
+_recursive_walks = [None, {}]
+
 
 def set_output_dir(path):
     """Resolve paths relative to this directory."""
@@ -89,13 +100,52 @@ def all_read_file_paths():
     return list(_input_paths)
 
 
+def enable_json_cache(cache):
+    """Reuses parsed JSON from |cache|, which is a dict owned by the caller.
+
+    Used by write_build_config.py's server mode, where each request runs in a
+    fork()ed child so that callers mutating the returned JSON is harmless.
+    """
+    global _json_cache
+    _json_cache = cache
+
+
+def json_cache_misses():
+    """Returns absolute paths that were parsed without help from the cache."""
+    return list(_json_cache_misses)
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def update_json_cache(cache, paths):
+    """Parses |paths| into |cache| (a dict passed to enable_json_cache())."""
+    for path in paths:
+        try:
+            key = _stat_key(path)
+            cache[path] = (key, _read_json(path))
+        except (OSError, ValueError):
+            cache.pop(path, None)
+
+
 def _get_json(path):
     """Reads a JSON file and records the path for depfile tracking."""
     path = os.path.join(_output_dir_path, path)
     _input_paths.append(path)
-    with open(path, encoding='utf-8') as f:
-        config = json.load(f)
-    return config
+    if _json_cache is not None:
+        abs_path = os.path.abspath(path)
+        entry = _json_cache.get(abs_path)
+        if entry and entry[0] == _stat_key(abs_path):
+            return entry[1]
+        _json_cache_misses.append(abs_path)
+    return _read_json(path)
 
 
 @functools.cache  # pylint: disable=method-cache-max-size-none
@@ -112,18 +162,20 @@ def get_params(path):
     return ParamsJson(path, _get_json(path))
 
 
-def _topological_walk(top, deps_func):
+def _topological_walk(top, deps_func, seen=None):
     """Gets the list of all transitive dependencies in topological order.
 
     Args:
       top: A list of the top level nodes
       deps_func: A function that takes a node and returns a list of its direct
           dependencies.
+      seen: Dict of nodes already visited (in postorder). Updated in-place.
     Returns:
       A list of all transitive dependencies of nodes in top in order (a node will
       appear in the list at a lower index than all of its dependencies).
     """
-    seen = {}
+    if seen is None:
+        seen = {}
 
     def discover(nodes):
         for node in nodes:
@@ -236,8 +288,23 @@ class DepsList(_HashableList):
     @functools.cache  # pylint: disable=method-cache-max-size-none
     def recursive(self):
         """Returns all transitive dependencies."""
+        # Walks are shared between lists with the same contents, and a list
+        # that extends a previously walked list (e.g. deps + [apk_under_test])
+        # walks only the new nodes.
+        node = _recursive_walks
+        prefix_walk = {}
+        prefix_len = 0
+        for i, dep in enumerate(self):
+            node = node[1].setdefault(dep, [None, {}])
+            if node[0] is not None:
+                prefix_walk = node[0]
+                prefix_len = i + 1
+        if node[0] is None:
+            seen = dict(prefix_walk)
+            _topological_walk(self[prefix_len:], _deps_for_traversal, seen)
+            node[0] = seen
         # Reverse so that deps appear with higher indices.
-        return self.walk(lambda x: True)
+        return DepsList(reversed(node[0]))
 
     @functools.cache  # pylint: disable=method-cache-max-size-none
     def recursive_resource_deps(self):
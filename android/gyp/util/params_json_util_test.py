@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+)
+from util import params_json_util
+
+
+def _NaiveRecursive(deps_list):
+    # The pre-memoization implementation of DepsList.recursive().
+    return params_json_util.DepsList(
+        params_json_util._topological_walk(
+            deps_list, params_json_util._deps_for_traversal
+        )
+    )
+
+
+class TestDepsList(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        params_json_util.set_output_dir(self._tmp_dir.name)
+        params_json_util.get_params.cache_clear()
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _WriteGraph(self, num_nodes, seed):
+        """Writes a random DAG of .params.json files and returns their names."""
+        rng = random.Random(seed)
+        names = [f'n{i}.params.json' for i in range(num_nodes)]
+        for i, name in enumerate(names):
+            # Only depend on higher-numbered nodes to keep the graph acyclic.
+            later = names[i + 1 :]
+            data = {
+                'type': rng.choice(['java_library', 'android_resources']),
+                'deps_configs': rng.sample(later, min(len(later), 3)),
+            }
+            if later and rng.random() < 0.2:
+                data['type'] = 'group'
+                data['public_deps_configs'] = rng.sample(later, 1)
+            path = os.path.join(self._tmp_dir.name, name)
+            with open(path, 'w') as f:
+                json.dump(data, f)
+        return names
+
+    def testRecursiveMatchesNaiveWalk(self):
+        names = self._WriteGraph(60, seed=1)
+        for params in map(params_json_util.get_params, names):
+            deps = params.deps()
+            self.assertEqual(deps.recursive(), _NaiveRecursive(deps))
+            # Extending a walked list reuses its walk.
+            extended = deps + [params_json_util.get_params(names[-1])]
+            self.assertEqual(extended.recursive(), _NaiveRecursive(extended))
+            # So does a list with the same contents.
+            same = params_json_util.DepsList(deps)
+            self.assertEqual(same.recursive(), _NaiveRecursive(deps))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,350 @@
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Caches that compile_resources.py shares between targets and builds."""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from util import build_utils
+
+# The aapt2 compile cache evicts least recently used entries beyond this size.
+_COMPILE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# Work dirs and lock files of the aapt2 compile cache live in this subdir.
+_COMPILE_CACHE_WORK_DIR = 'work'
+# Prefix of entries that are being written or deleted.
+_COMPILE_CACHE_TMP_PREFIX = 'tmp-'
+# Leftovers of interrupted builds older than this are deleted.
+_COMPILE_CACHE_STALE_SECONDS = 24 * 60 * 60
+
+# The steps that rename resources, in the order in which they run.
+RENAME_STAGES = ('locale', 'webp', 'drawable')
+
+
+def ComputeSha1(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return hashlib.sha1(data).hexdigest()
+
+
+class WebPCache:
+    """A size-bounded cache of webp images, shared by all targets.
+
+    Images are hard-linked into and out of the cache directory. Since atimes
+    are unreliable (e.g. noatime mounts), an index records the size and last
+    use of each image. Flush() updates it under a lock at the end of each
+    build, and evicts least recently used images beyond |max_bytes|.
+    """
+
+    _INDEX_NAME = 'index.json'
+    _LOCK_NAME = 'index.lock'
+
+    def __init__(self, cache_dir, max_bytes):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        # Guards the attributes below, as images are converted on threads.
+        self._lock = threading.Lock()
+        # Maps the names of images used by this build to their sizes.
+        self._used = {}
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evicted = 0
+        self.total_bytes = 0
+        build_utils.MakeDirectory(cache_dir)
+
+    def Get(self, name, webp_path):
+        """Links the image |name| to |webp_path|. Returns whether it exists."""
+        try:
+            os.link(os.path.join(self._cache_dir, name), webp_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.num_misses += 1
+            return False
+        size = os.path.getsize(webp_path)
+        with self._lock:
+            self.num_hits += 1
+            self._used[name] = size
+        return True
+
+    def Put(self, name, webp_path):
+        try:
+            os.link(webp_path, os.path.join(self._cache_dir, name))
+        except OSError:
+            # Because of concurrent run, a webp image may already exist.
+            pass
+        size = os.path.getsize(webp_path)
+        with self._lock:
+            self._used[name] = size
+
+    def _ReadIndex(self):
+        """Returns the index, in sync with the images in the cache directory.
+
+        Maps image names to [size, last_used_time] lists.
+        """
+        try:
+            with open(os.path.join(self._cache_dir, self._INDEX_NAME)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        names = set(os.listdir(self._cache_dir))
+        names -= {self._INDEX_NAME, self._LOCK_NAME}
+        # Drop images that were deleted, and add those that were never indexed
+        # (e.g. by builds that were interrupted).
+        index = {k: v for k, v in index.items() if k in names}
+        for name in names - index.keys():
+            try:
+                stat = os.stat(os.path.join(self._cache_dir, name))
+            except OSError:
+                continue
+            index[name] = [stat.st_size, stat.st_atime]
+        return index
+
+    def _WriteIndex(self, index):
+        index_path = os.path.join(self._cache_dir, self._INDEX_NAME)
+        tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+
+    def Flush(self):
+        """Records the images used by this build, and evicts old images."""
+        now = time.time()
+        with open(os.path.join(self._cache_dir, self._LOCK_NAME), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            index = self._ReadIndex()
+            for name, size in self._used.items():
+                index[name] = [size, now]
+            self.total_bytes = sum(size for size, _ in index.values())
+            for name in sorted(index, key=lambda n: index[n][1]):
+                if self.total_bytes <= self._max_bytes:
+                    break
+                self.total_bytes -= index.pop(name)[0]
+                self.num_evicted += 1
+                try:
+                    os.remove(os.path.join(self._cache_dir, name))
+                except FileNotFoundError:
+                    pass
+            self._WriteIndex(index)
+
+
+class RenameRecorder:
+    """Records renames so that they can be cached and registered later."""
+
+    def __init__(self, renames):
+        self._renames = renames
+
+    def RegisterRename(self, old_archive_path, new_archive_path):
+        self._renames.append((old_archive_path, new_archive_path))
+
+
+class ResZip:
+    """A dependency resource zip, and the partials compiled from it."""
+
+    def __init__(self, path, is_overlay):
+        self.path = path
+        self.is_overlay = is_overlay
+        # Set when the zip is compiled in a work dir of the compile cache.
+        self.cache_key = None
+        # Resource directories that the zip was extracted to.
+        self.subdirs = []
+        # List of (partial_path, is_filtered) tuples, in |subdirs| order.
+        self.partials = []
+        # Renames of each of RENAME_STAGES, to register with the path_info.
+        self.renames = {stage: [] for stage in RENAME_STAGES}
+
+
+def RegisterRenames(res_zips, path_info):
+    """Registers the renames of |res_zips| with |path_info|.
+
+    Renames are registered in the order in which they happen when all zips are
+    processed together, i.e. stage by stage.
+    """
+    for stage in RENAME_STAGES:
+        for res_zip in res_zips:
+            for old_path, new_path in res_zip.renames[stage]:
+                path_info.RegisterRename(old_path, new_path)
+
+
+def PartialsLinkArgs(res_zips):
+    """Returns the aapt2 link arguments for the partials of |res_zips|.
+
+    Partials with filtered values are compiled first, and are linked first.
+    Partials of overlay zips are preceded by -R.
+    """
+    partials = [(p, z.is_overlay) for z in res_zips for p in z.partials]
+    partials.sort(key=lambda x: not x[0][1])
+    args = []
+    for (partial_path, _), is_overlay in partials:
+        if is_overlay:
+            args += ['-R']
+        args += [partial_path]
+    return args
+
+
+def _LinkOrCopy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class CompileCache:
+    """A cache of aapt2 compile partials, shared by all targets.
+
+    Entries are keyed by the path and digest of a resource zip and by |salt|,
+    which covers everything else that affects the zip's partials. Each entry
+    is a directory with the partials and the renames of one zip. Like the webp
+    cache, it is safe to use from concurrent builds: entries are written under
+    a temporary name, and renamed into place once complete.
+
+    Partials embed the absolute paths of resources, so a zip that is not cached
+    is compiled in a work dir named after its key, which makes the partials the
+    same no matter which target compiles them. A lock file ensures that only
+    one build uses a work dir at a time. Other builds do not wait for it, and
+    compile the zip in their own temp dir without caching it.
+    """
+
+    def __init__(self, cache_dir, salt):
+        self._cache_dir = cache_dir
+        self._work_dir = os.path.join(cache_dir, _COMPILE_CACHE_WORK_DIR)
+        self._salt = salt
+        # Maps keys to the file descriptors of their locked lock files.
+        self._locked = {}
+        self._num_stored = 0
+        build_utils.MakeDirectory(self._work_dir)
+
+    def ComputeKey(self, res_zip):
+        data = '\n'.join([self._salt, res_zip, ComputeSha1(res_zip)])
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def Lookup(self, key, partials_dir, prefix):
+        """Links the partials of the entry for |key| into |partials_dir|.
+
+        Returns:
+          A (partials, renames) tuple as stored by Store(), with the paths of
+          the linked partials, or None if there is no entry.
+        """
+        entry_dir = os.path.join(self._cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, 'entry.json')) as f:
+                entry = json.load(f)
+            partials = []
+            for i, is_filtered in enumerate(entry['partials']):
+                partial_path = os.path.join(partials_dir, f'{prefix}_{i}.zip')
+                _LinkOrCopy(os.path.join(entry_dir, f'{i}.zip'), partial_path)
+                partials.append((partial_path, is_filtered))
+            # Marks the entry as recently used.
+            os.utime(entry_dir)
+        except (OSError, ValueError):
+            # Missing, or being evicted by another build.
+            return None
+        return partials, entry['renames']
+
+    def TryLock(self, key):
+        """Locks the work dir for |key|, and empties it.
+
+        Returns:
+          The work dir, or None if another build is using it.
+        """
+        lock_path = os.path.join(self._work_dir, key + '.lock')
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        # Evict() deletes lock files that have not been used for a while.
+        os.utime(fd)
+        self._locked[key] = fd
+        work_dir = os.path.join(self._work_dir, key)
+        # Interrupted builds may have left files behind.
+        build_utils.DeleteDirectory(work_dir)
+        build_utils.MakeDirectory(work_dir)
+        return work_dir
+
+    def Store(self, key, partials, renames):
+        """Stores an entry for |key|, unless another build already did.
+
+        Returns:
+          Whether this build stored the entry.
+        """
+        tmp_dir = tempfile.mkdtemp(
+            prefix=_COMPILE_CACHE_TMP_PREFIX, dir=self._cache_dir
+        )
+        for i, (partial_path, _) in enumerate(partials):
+            _LinkOrCopy(partial_path, os.path.join(tmp_dir, f'{i}.zip'))
+        entry = {
+            'partials': [is_filtered for _, is_filtered in partials],
+            'renames': renames,
+        }
+        with open(os.path.join(tmp_dir, 'entry.json'), 'w') as f:
+            json.dump(entry, f)
+        try:
+            os.rename(tmp_dir, os.path.join(self._cache_dir, key))
+        except OSError:
+            # Another build stored the entry in the meantime.
+            shutil.rmtree(tmp_dir)
+            return False
+        self._num_stored += 1
+        return True
+
+    def Release(self):
+        """Deletes and unlocks the work dirs locked by TryLock()."""
+        for key, fd in self._locked.items():
+            build_utils.DeleteDirectory(os.path.join(self._work_dir, key))
+            os.close(fd)
+        self._locked = {}
+
+    def Evict(self):
+        """Deletes the least recently used entries beyond the size limit."""
+        if not self._num_stored:
+            return
+        now = time.time()
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self._cache_dir):
+            try:
+                mtime = entry.stat().st_mtime
+                if entry.name.startswith(_COMPILE_CACHE_TMP_PREFIX):
+                    if now - mtime > _COMPILE_CACHE_STALE_SECONDS:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                if entry.name == _COMPILE_CACHE_WORK_DIR:
+                    continue
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            except OSError:
+                # Evicted by another build.
+                continue
+            entries.append((mtime, entry.name, size))
+            total_size += size
+
+        for _, name, size in sorted(entries):
+            if total_size <= _COMPILE_CACHE_MAX_BYTES:
+                break
+            total_size -= size
+            # Rename first so that Lookup() never sees a partial entry.
+            evicted_dir = os.path.join(
+                self._cache_dir,
+                f'{_COMPILE_CACHE_TMP_PREFIX}evicted-{os.getpid()}-{name}',
+            )
+            try:
+                os.rename(os.path.join(self._cache_dir, name), evicted_dir)
+            except OSError:
+                continue
+            shutil.rmtree(evicted_dir, ignore_errors=True)
+
+        for entry in os.scandir(self._work_dir):
+            key = entry.name.removesuffix('.lock')
+            if key == entry.name or key in self._locked:
+                continue
+            try:
+                if now - entry.stat().st_mtime > _COMPILE_CACHE_STALE_SECONDS:
+                    os.remove(entry.path)
+            except OSError:
+                pass
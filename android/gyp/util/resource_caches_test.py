@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+)
+from util import resource_caches
+
+
+def _WriteFile(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def _ReadFile(path):
+    with open(path) as f:
+        return f.read()
+
+
+class _FakePathInfo:
+    def __init__(self):
+        self.renames = []
+
+    def RegisterRename(self, old_archive_path, new_archive_path):
+        self.renames.append((old_archive_path, new_archive_path))
+
+
+class CompileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._cache_dir = os.path.join(self._temp_dir.name, 'cache')
+        self._partials_dir = os.path.join(self._temp_dir.name, 'partials')
+        os.mkdir(self._partials_dir)
+        self._caches = []
+
+    def tearDown(self):
+        for cache in self._caches:
+            cache.Release()
+        self._temp_dir.cleanup()
+
+    def _CreateCache(self, salt='salt'):
+        cache = resource_caches.CompileCache(self._cache_dir, salt)
+        self._caches.append(cache)
+        return cache
+
+    def _CreatePartials(self, name, contents):
+        partials = []
+        for i, (data, is_filtered) in enumerate(contents):
+            path = os.path.join(self._temp_dir.name, f'{name}_{i}.flat')
+            _WriteFile(path, data)
+            partials.append((path, is_filtered))
+        return partials
+
+    def _CacheEntries(self):
+        return sorted(set(os.listdir(self._cache_dir)) - {'work'})
+
+    def testComputeKey(self):
+        res_zip = os.path.join(self._temp_dir.name, 'a.zip')
+        _WriteFile(res_zip, 'a')
+        key = self._CreateCache().ComputeKey(res_zip)
+        self.assertEqual(key, self._CreateCache().ComputeKey(res_zip))
+        self.assertNotEqual(key, self._CreateCache('other').ComputeKey(res_zip))
+        _WriteFile(res_zip, 'b')
+        self.assertNotEqual(key, self._CreateCache().ComputeKey(res_zip))
+
+    def testLookupMissing(self):
+        cache = self._CreateCache()
+        self.assertIsNone(cache.Lookup('key', self._partials_dir, 'p'))
+        self.assertEqual(os.listdir(self._partials_dir), [])
+
+    def testStoreAndLookup(self):
+        cache = self._CreateCache()
+        partials = self._CreatePartials(
+            'a', [('filtered', True), ('all', False)]
+        )
+        renames = {'locale': [['a', 'b']], 'webp': [], 'drawable': []}
+        self.assertTrue(cache.Store('key', partials, renames))
+
+        entry = cache.Lookup('key', self._partials_dir, 'p')
+        self.assertIsNotNone(entry)
+        linked_partials, linked_renames = entry
+        self.assertEqual(
+            linked_partials,
+            [
+                (os.path.join(self._partials_dir, 'p_0.zip'), True),
+                (os.path.join(self._partials_dir, 'p_1.zip'), False),
+            ],
+        )
+        self.assertEqual(
+            [_ReadFile(p) for p, _ in linked_partials], ['filtered', 'all']
+        )
+        self.assertEqual(linked_renames, renames)
+        self.assertEqual(self._CacheEntries(), ['key'])
+
+    def testStoreExistingEntry(self):
+        cache = self._CreateCache()
+        other_cache = self._CreateCache()
+        renames = {'locale': [], 'webp': [], 'drawable': []}
+        self.assertTrue(
+            other_cache.Store(
+                'key', self._CreatePartials('a', [('a', False)]), renames
+            )
+        )
+        self.assertFalse(
+            cache.Store(
+                'key', self._CreatePartials('b', [('b', False)]), renames
+            )
+        )
+        self.assertEqual(cache._num_stored, 0)
+        # The temporary entry is deleted, and the stored one is kept.
+        self.assertEqual(self._CacheEntries(), ['key'])
+        partials, _ = cache.Lookup('key', self._partials_dir, 'p')
+        self.assertEqual(_ReadFile(partials[0][0]), 'a')
+
+    def testTryLock(self):
+        cache = self._CreateCache()
+        other_cache = self._CreateCache()
+        work_dir = cache.TryLock('key')
+        self.assertEqual(os.listdir(work_dir), [])
+        _WriteFile(os.path.join(work_dir, 'leftover'), '')
+        self.assertIsNone(other_cache.TryLock('key'))
+        self.assertIsNotNone(other_cache.TryLock('other_key'))
+
+        cache.Release()
+        self.assertFalse(os.path.exists(work_dir))
+        # The work dir is emptied when it is locked.
+        self.assertEqual(other_cache.TryLock('key'), work_dir)
+        self.assertEqual(os.listdir(work_dir), [])
+
+    def testEvict(self):
+        cache = self._CreateCache()
+        renames = {'locale': [], 'webp': [], 'drawable': []}
+        now = time.time()
+        for name, age in [('newest', 0), ('oldest', 20), ('middle', 10)]:
+            partials = self._CreatePartials(name, [('x' * 100, False)])
+            cache.Store(name, partials, renames)
+            entry_dir = os.path.join(self._cache_dir, name)
+            os.utime(entry_dir, (now - age, now - age))
+        entry_size = sum(
+            f.stat().st_size
+            for f in os.scandir(os.path.join(self._cache_dir, 'newest'))
+        )
+
+        stale_time = now - 2 * resource_caches._COMPILE_CACHE_STALE_SECONDS
+        stale_tmp_dir = os.path.join(self._cache_dir, 'tmp-stale')
+        fresh_tmp_dir = os.path.join(self._cache_dir, 'tmp-fresh')
+        for path in (stale_tmp_dir, fresh_tmp_dir):
+            os.mkdir(path)
+        os.utime(stale_tmp_dir, (stale_time, stale_time))
+        work_dir = os.path.join(self._cache_dir, 'work')
+        stale_lock = os.path.join(work_dir, 'stale.lock')
+        _WriteFile(stale_lock, '')
+        os.utime(stale_lock, (stale_time, stale_time))
+        cache.TryLock('locked')
+        locked_lock = os.path.join(work_dir, 'locked.lock')
+        os.utime(locked_lock, (stale_time, stale_time))
+
+        with mock.patch.object(
+            resource_caches, '_COMPILE_CACHE_MAX_BYTES', 2 * entry_size
+        ):
+            cache.Evict()
+        self.assertEqual(
+            self._CacheEntries(), ['middle', 'newest', 'tmp-fresh']
+        )
+        self.assertEqual(
+            sorted(os.listdir(work_dir)), ['locked', 'locked.lock']
+        )
+
+    def testEvictWithoutStore(self):
+        renames = {'locale': [], 'webp': [], 'drawable': []}
+        partials = self._CreatePartials('a', [('a', False)])
+        self._CreateCache().Store('key', partials, renames)
+        with mock.patch.object(resource_caches, '_COMPILE_CACHE_MAX_BYTES', 0):
+            # Caches that stored nothing did not grow the cache.
+            self._CreateCache().Evict()
+            self.assertEqual(self._CacheEntries(), ['key'])
+
+
+class WebPCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._cache_dir = os.path.join(self._temp_dir.name, 'cache')
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _CachePath(self, name):
+        return os.path.join(self._cache_dir, name)
+
+    def _WriteIndex(self, index):
+        with open(self._CachePath('index.json'), 'w') as f:
+            json.dump(index, f)
+
+    def _ReadIndex(self):
+        with open(self._CachePath('index.json')) as f:
+            return json.load(f)
+
+    def testGetAndPut(self):
+        webp_path = os.path.join(self._temp_dir.name, 'a.webp')
+        out_path = os.path.join(self._temp_dir.name, 'out.webp')
+        cache = resource_caches.WebPCache(self._cache_dir, 100)
+        self.assertFalse(cache.Get('a', out_path))
+        self.assertFalse(os.path.exists(out_path))
+        _WriteFile(webp_path, 'webp')
+        cache.Put('a', webp_path)
+        # Concurrent builds may put the same image.
+        cache.Put('a', webp_path)
+
+        other_cache = resource_caches.WebPCache(self._cache_dir, 100)
+        self.assertTrue(other_cache.Get('a', out_path))
+        self.assertEqual(_ReadFile(out_path), 'webp')
+        self.assertEqual((cache.num_hits, cache.num_misses), (0, 1))
+        self.assertEqual((other_cache.num_hits, other_cache.num_misses), (1, 0))
+
+    def testReadIndex(self):
+        cache = resource_caches.WebPCache(self._cache_dir, 100)
+        self._WriteIndex({'indexed': [4, 10], 'deleted': [4, 20]})
+        _WriteFile(self._CachePath('indexed'), 'abcd')
+        _WriteFile(self._CachePath('unindexed'), 'ab')
+        os.utime(self._CachePath('unindexed'), (30, 30))
+        # Deleted images are dropped, and unindexed ones are added with their
+        # atime.
+        self.assertEqual(
+            cache._ReadIndex(), {'indexed': [4, 10], 'unindexed': [2, 30]}
+        )
+
+    def testReadIndexInvalid(self):
+        cache = resource_caches.WebPCache(self._cache_dir, 100)
+        _WriteFile(self._CachePath('index.json'), '{')
+        _WriteFile(self._CachePath('a'), 'a')
+        os.utime(self._CachePath('a'), (10, 10))
+        self.assertEqual(cache._ReadIndex(), {'a': [1, 10]})
+
+    def testFlush(self):
+        cache = resource_caches.WebPCache(self._cache_dir, 100)
+        for name in ('a', 'b'):
+            _WriteFile(self._CachePath(name), 'x' * 40)
+        self._WriteIndex({'a': [40, 10], 'b': [40, 20]})
+        out_path = os.path.join(self._temp_dir.name, 'a.webp')
+        self.assertTrue(cache.Get('a', out_path))
+        cache.Flush()
+
+        self.assertEqual((cache.num_evicted, cache.total_bytes), (0, 80))
+        index = self._ReadIndex()
+        self.assertEqual(index['b'], [40, 20])
+        # Images used by the build are marked as recently used.
+        self.assertGreater(index['a'][1], 20)
+
+    def testFlushEvictsLeastRecentlyUsed(self):
+        cache = resource_caches.WebPCache(self._cache_dir, 60)
+        for name in ('a', 'b', 'c'):
+            _WriteFile(self._CachePath(name), 'x' * 40)
+        self._WriteIndex({'a': [40, 10], 'b': [40, 30], 'c': [40, 20]})
+        new_path = os.path.join(self._temp_dir.name, 'new.webp')
+        _WriteFile(new_path, 'x' * 10)
+        cache.Put('new', new_path)
+        cache.Flush()
+
+        self.assertEqual((cache.num_evicted, cache.total_bytes), (2, 50))
+        self.assertEqual(self._ReadIndex().keys(), {'b', 'new'})
+        self.assertEqual(
+            sorted(os.listdir(self._cache_dir)),
+            ['b', 'index.json', 'index.lock', 'new'],
+        )
+
+
+class ResZipTest(unittest.TestCase):
+    def testRegisterRenames(self):
+        first = resource_caches.ResZip('first.zip', False)
+        first.renames['locale'] = [('1/values-in', '1/values-id')]
+        first.renames['drawable'] = [('1/a.png', '1/a')]
+        second = resource_caches.ResZip('second.zip', True)
+        second.renames['locale'] = [('2/values-iw', '2/values-he')]
+        second.renames['webp'] = [('2/b.png', '2/b.webp')]
+        path_info = _FakePathInfo()
+        resource_caches.RegisterRenames([first, second], path_info)
+        # Renames are registered stage by stage, as if the zips were
+        # processed together.
+        self.assertEqual(
+            path_info.renames,
+            [
+                ('1/values-in', '1/values-id'),
+                ('2/values-iw', '2/values-he'),
+                ('2/b.png', '2/b.webp'),
+                ('1/a.png', '1/a'),
+            ],
+        )
+
+    def testPartialsLinkArgs(self):
+        first = resource_caches.ResZip('first.zip', False)
+        first.partials = [('a_filtered', True), ('a', False)]
+        overlay = resource_caches.ResZip('overlay.zip', True)
+        overlay.partials = [('b', False), ('b_filtered', True)]
+        last = resource_caches.ResZip('last.zip', False)
+        last.partials = [('c', False)]
+        # Filtered partials come first, and each group keeps the zip order.
+        self.assertEqual(
+            resource_caches.PartialsLinkArgs([first, overlay, last]),
+            ['a_filtered', '-R', 'b_filtered', 'a', '-R', 'b', 'c'],
+        )
+        self.assertEqual(resource_caches.PartialsLinkArgs([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,10 @@ from util import build_utils
 # https://man7.org/linux/man-pages/man7/unix.7.html#:~:text=abstract:
 SOCKET_ADDRESS = '\0chromium_build_server_socket'
 BUILD_SERVER_ENV_VARIABLE = 'INVOKED_BY_BUILD_SERVER'
+# How long MaybeSendRequest() waits for the server, in seconds. Longer than
+# the server waits for its write_build_config.py process, so that the server
+# can report the failure first.
+REQUEST_TIMEOUT = 120
 
 ADD_TASK = 'add_task'
 QUERY_BUILD = 'query_build'
@@ -25,6 +29,7 @@ POLL_HEARTBEAT = 'poll_heartbeat'
 REGISTER_BUILDER = 'register_builder'
 CANCEL_BUILD = 'cancel_build'
 STOP_SERVER = 'stop_server'
+WRITE_BUILD_CONFIG = 'write_build_config'
 
 SERVER_SCRIPT = (
     pathlib.Path(build_utils.DIR_SOURCE_ROOT)
@@ -99,6 +104,31 @@ def MaybeRunCommand(name, argv, stamp_file, use_build_server=False):
     return True
 
 
+def MaybeSendRequest(message_type, message):
+    """Sends a request to the build server and returns its response.
+
+    Unlike MaybeRunCommand(), this blocks until the server has handled the
+    request. Returns None if the server is not available, in which case the
+    caller should do the work itself.
+    """
+    if platform.system() == 'Darwin':
+        return None
+    if BUILD_SERVER_ENV_VARIABLE in os.environ:
+        return None
+    with contextlib.closing(socket.socket(socket.AF_UNIX)) as sock:
+        sock.settimeout(REQUEST_TIMEOUT)
+        try:
+            sock.connect(SOCKET_ADDRESS)
+            SendMessage(sock, dict(message, message_type=message_type))
+            response = ReceiveMessage(sock)
+        except OSError:
+            # Includes socket.timeout, e.g. when the server is wedged.
+            return None
+    if not response or 'error' in response:
+        return None
+    return response
+
+
 def MaybeTouch(stamp_file):
     """Touch |stamp_file| if we are not running under the build_server."""
     # If we are running under the build server, the stamp file has already been
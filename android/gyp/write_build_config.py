@@ -15,11 +15,16 @@ See //build/android/docs/build_config.md for more information.
 import argparse
 import itertools
 import os
+import select
+import socket
 import sys
+import tempfile
+import traceback
 import xml.dom.minidom
 
 from util import build_utils
 from util import params_json_util
+from util import server_utils
 import action_helpers
 
 
@@ -46,8 +51,12 @@ class OrderedSet(dict):
             self[k] = True
 
     def difference_update(self, iterable):
-        for k in iterable:
-            self.pop(k, None)
+        if not isinstance(iterable, dict):
+            iterable = dict.fromkeys(iterable)
+        # Intersect key views (a set operation) rather than probing every key
+        # of |iterable|, which is often much larger than |self|.
+        for k in self.keys() & iterable.keys():
+            del self[k]
 
 
 class AndroidManifest:
@@ -664,13 +673,112 @@ def _CreateLintConfig(params, javac_config, manifest_config):
     return config
 
 
-def main():
+def _HandleRequest(conn, misses_fd):
+    """Runs main() for a single request. Called in a fork()ed child."""
+    returncode = 1
+    try:
+        request = server_utils.ReceiveMessage(conn)
+        os.chdir(request['cwd'])
+        with tempfile.TemporaryFile() as output:
+            os.dup2(output.fileno(), sys.stdout.fileno())
+            os.dup2(output.fileno(), sys.stderr.fileno())
+            try:
+                main(request['args'])
+                returncode = 0
+            except SystemExit as e:
+                if isinstance(e.code, str):
+                    sys.stderr.write(e.code + '\n')
+                else:
+                    returncode = e.code or 0
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            output.seek(0)
+            text = output.read().decode('utf-8', errors='replace')
+        server_utils.SendMessage(
+            conn, {'returncode': returncode, 'output': text}
+        )
+        with os.fdopen(misses_fd, 'wb') as f:
+            f.write('\n'.join(params_json_util.json_cache_misses()).encode())
+    finally:
+        os._exit(0)
+
+
+def _ServeRequests(listener):
+    """Serves requests forwarded by fast_local_dev_server.py.
+
+    Parsed .params.json and .build_config.json files are kept in memory. Each
+    request is handled by a fork()ed child so that requests cannot affect one
+    another. Children report back which files they had to parse so that they
+    can be added to the cache.
+    """
+    json_cache = {}
+    params_json_util.enable_json_cache(json_cache)
+    parent_pid = os.getppid()
+    # Map of pipe fd -> data read so far.
+    pending_misses = {}
+    # Exit along with the build server.
+    while os.getppid() == parent_pid:
+        readable = select.select([listener, *pending_misses], [], [], 1)[0]
+        for fd in readable:
+            if fd is listener:
+                conn = listener.accept()[0]
+                read_fd, write_fd = os.pipe()
+                if os.fork() == 0:
+                    listener.close()
+                    os.close(read_fd)
+                    _HandleRequest(conn, write_fd)
+                conn.close()
+                os.close(write_fd)
+                pending_misses[read_fd] = b''
+            elif data := os.read(fd, 65536):
+                pending_misses[fd] += data
+            else:
+                os.close(fd)
+                paths = pending_misses.pop(fd).decode().splitlines()
+                params_json_util.update_json_cache(json_cache, paths)
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except ChildProcessError:
+            pass
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description='Writes a .build_config.json file.'
     )
     action_helpers.add_depfile_arg(parser)
     parser.add_argument('--output', help='.build_config.json to write.')
-    options = parser.parse_args()
+    parser.add_argument(
+        '--use-build-server',
+        action='store_true',
+        help='Have the build server write the config when it is running.',
+    )
+    parser.add_argument(
+        '--serve-fd',
+        type=int,
+        help='Serve requests from the build server on this listening socket.',
+    )
+    options = parser.parse_args(argv)
+
+    if options.serve_fd is not None:
+        _ServeRequests(socket.socket(fileno=options.serve_fd))
+        return
+
+    if options.use_build_server:
+        response = server_utils.MaybeSendRequest(
+            server_utils.WRITE_BUILD_CONFIG,
+            {
+                'args': sys.argv[1:] if argv is None else argv,
+                'cwd': os.getcwd(),
+            },
+        )
+        if response is not None:
+            sys.stdout.write(response['output'])
+            sys.exit(response['returncode'])
+
     build_config_path = options.output
 
     params = params_json_util.get_params(
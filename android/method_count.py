@@ -5,48 +5,129 @@
 
 
 import argparse
+import array
+import concurrent.futures
+import contextlib
+import hashlib
 import os
 import re
+import sys
 import zipfile
 
 from pylib.dex import dex_parser
 
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import zip_helpers
+
+
+def _MethodSignatureHashes(dexfile):
+    """Returns an array of 64-bit hashes of each method's signature.
+
+    Hashes are much smaller than signature tuples, and collisions are
+    negligible (~1e-8 for a million methods).
+    """
+    digests = []
+    for parts in dexfile.IterMethodSignatureParts():
+        class_name, return_type, method_name, parameter_types = parts
+        # Names cannot contain NUL, so this is unambiguous.
+        key = '\0'.join(
+            (class_name, return_type, method_name, *parameter_types)
+        )
+        # Strings decoded from MUTF-8 may contain unpaired surrogates.
+        digests.append(
+            hashlib.blake2b(
+                key.encode('utf-8', 'surrogatepass'), digest_size=8
+            ).digest()
+        )
+    ret = array.array('Q')
+    ret.frombytes(b''.join(digests))
+    return ret
+
+
+def _DexCounts(dexfile):
+    return {
+        'fields': dexfile.header.field_ids_size,
+        'methods': dexfile.header.method_ids_size,
+        'strings': dexfile.header.string_ids_size,
+        'types': dexfile.header.type_ids_size,
+    }
+
+
+@contextlib.contextmanager
+def _OpenZip(path, split_subpath=None):
+    with zipfile.ZipFile(path, 'r') as z:
+        if not split_subpath:
+            yield z
+            return
+        # Read the split's entries from |path| rather than loading all of it.
+        split_file = zip_helpers.open_entry_file(path, z.getinfo(split_subpath))
+    with split_file, zipfile.ZipFile(split_file) as split:
+        yield split
+
+
+def _ProcessZipEntry(path, split_subpath, subpath):
+    """Returns the counts and method hashes of a .dex within a zip."""
+    with _OpenZip(path, split_subpath) as z:
+        dexfile = dex_parser.DexFile(z.read(subpath))
+    return _DexCounts(dexfile), _MethodSignatureHashes(dexfile)
+
 
 class DexStatsCollector:
     """Tracks count of method/field/string/type as well as unique methods."""
 
     def __init__(self):
-        # Signatures of all methods from all seen dex files.
-        self._unique_methods = set()
+        # Hashes of the signatures of all methods from all seen dex files.
+        # Duplicates are removed only when counting.
+        self._method_hashes = array.array('Q')
         # Map of label -> { metric -> count }.
         self._counts_by_label = {}
 
-    def _CollectFromDexfile(self, label, dexfile):
+    def _AddStats(self, label, counts, method_hashes):
         assert label not in self._counts_by_label, 'exists: ' + label
-        self._counts_by_label[label] = {
-            'fields': dexfile.header.field_ids_size,
-            'methods': dexfile.header.method_ids_size,
-            'strings': dexfile.header.string_ids_size,
-            'types': dexfile.header.type_ids_size,
-        }
-        self._unique_methods.update(dexfile.IterMethodSignatureParts())
-
-    def CollectFromZip(self, label, path):
-        """Add dex stats from an .apk/.jar/.aab/.zip."""
-        with zipfile.ZipFile(path, 'r') as z:
-            for subpath in z.namelist():
-                if not re.match(r'.*classes\d*\.dex$', subpath):
-                    continue
-                dexfile = dex_parser.DexFile(bytearray(z.read(subpath)))
-                self._CollectFromDexfile(
-                    '{}!{}'.format(label, subpath), dexfile
+        self._counts_by_label[label] = counts
+        self._method_hashes.extend(method_hashes)
+
+    def CollectFromZip(self, label, path, split_subpath=None):
+        """Add dex stats from an .apk/.jar/.aab/.zip.
+
+        Dex files are parsed in parallel, in separate processes.
+
+        Args:
+          label: Prefix for the labels of the dex files.
+          path: Path to the zip file.
+          split_subpath: If set, dex files are read from the .apk at this path
+            within |path| (e.g. a split within an .apks) without extracting it.
+        """
+        with _OpenZip(path, split_subpath) as z:
+            subpaths = [
+                p for p in z.namelist() if re.match(r'.*classes\d*\.dex$', p)
+            ]
+        if len(subpaths) <= 1:
+            results = [
+                _ProcessZipEntry(path, split_subpath, p) for p in subpaths
+            ]
+        else:
+            max_workers = min(len(subpaths), os.cpu_count() or 1)
+            with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+                results = list(
+                    pool.map(
+                        _ProcessZipEntry,
+                        [path] * len(subpaths),
+                        [split_subpath] * len(subpaths),
+                        subpaths,
+                    )
                 )
+        for subpath, (counts, method_hashes) in zip(subpaths, results):
+            self._AddStats(
+                '{}!{}'.format(label, subpath), counts, method_hashes
+            )
 
     def CollectFromDex(self, label, path):
         """Add dex stats from a .dex file."""
-        with open(path, 'rb') as f:
-            dexfile = dex_parser.DexFile(bytearray(f.read()))
-        self._CollectFromDexfile(label, dexfile)
+        with dex_parser.DexFile.Open(path) as dexfile:
+            self._AddStats(
+                label, _DexCounts(dexfile), _MethodSignatureHashes(dexfile)
+            )
 
     def MergeFrom(self, parent_label, other):
         """Add dex stats from another DexStatsCollector."""
@@ -54,12 +135,12 @@ class DexStatsCollector:
         for label, other_counts in other._counts_by_label.items():
             new_label = '{}-{}'.format(parent_label, label)
             self._counts_by_label[new_label] = other_counts.copy()
-        self._unique_methods.update(other._unique_methods)
+        self._method_hashes.extend(other._method_hashes)
         # pylint: enable=protected-access
 
     def GetUniqueMethodCount(self):
         """Returns total number of unique methods across encountered dex files."""
-        return len(self._unique_methods)
+        return len(set(self._method_hashes))
 
     def GetCountsByLabel(self):
         """Returns dict of label -> {metric -> count}."""
@@ -10,8 +10,12 @@ is provided, but it does not include error handling or validation.
 """
 
 import argparse
+import array
 import collections
+import contextlib
 import errno
+import functools
+import mmap
 import os
 import re
 import struct
@@ -65,6 +69,10 @@ _ClassDefItem = collections.namedtuple(
     'annotations_off,class_data_off,static_values_off',
 )
 
+# Number of decoded strings to keep. Type and method name strings are looked up
+# repeatedly when iterating method signatures.
+_STRING_CACHE_SIZE = 1 << 16
+
 
 class _MemoryItemList:
     """Base class for repeated memory items."""
@@ -111,7 +119,7 @@ class _MemoryItemList:
     def __repr__(self):
         item_type_part = ''
         if self.size != 0:
-            item_type = type(self._items[0])
+            item_type = type(self[0])
             item_type_part = ', item type={}'.format(item_type.__name__)
 
         return '{}(offset={:#x}, size={}{})'.format(
@@ -119,39 +127,95 @@ class _MemoryItemList:
         )
 
 
-class _TypeIdItemList(_MemoryItemList):
-    def __init__(self, reader, offset, size):
-        factory = lambda x: _TypeIdItem(x.ReadUInt())
-        super().__init__(reader, offset, size, factory)
+class _TableItemList(_MemoryItemList):
+    """A list of fixed-size items, which are decoded on first access.
+
+    Items are unpacked in bulk (rather than one field at a time) into plain
+    tuples, and are wrapped in their namedtuple type only when accessed.
+    """
 
+    _FORMAT = None
+    _ITEM_TYPE = None
 
-class _ProtoIdItemList(_MemoryItemList):
     def __init__(self, reader, offset, size):
-        factory = lambda x: _ProtoIdItem(
-            x.ReadUInt(), x.ReadUInt(), x.ReadUInt()
-        )
-        super().__init__(reader, offset, size, factory)
+        # pylint: disable=super-init-not-called
+        self.offset = offset
+        self.size = size
+        self._reader = reader
 
+    @functools.cached_property
+    def rows(self):
+        """A list of tuples of the fields of each item."""
+        item_size = struct.calcsize(self._FORMAT)
+        with self._reader.View(self.offset, self.size * item_size) as view:
+            return list(struct.iter_unpack(self._FORMAT, view))
 
-class _MethodIdItemList(_MemoryItemList):
-    def __init__(self, reader, offset, size):
-        factory = lambda x: _MethodIdItem(
-            x.ReadUShort(), x.ReadUShort(), x.ReadUInt()
-        )
-        super().__init__(reader, offset, size, factory)
+    def __iter__(self):
+        return map(self._ITEM_TYPE._make, self.rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._ITEM_TYPE._make(row) for row in self.rows[key]]
+        return self._ITEM_TYPE._make(self.rows[key])
+
+    def __len__(self):
+        return self.size
+
+
+class _TypeIdItemList(_TableItemList):
+    _FORMAT = '<I'
+    _ITEM_TYPE = _TypeIdItem
+
+    @functools.cached_property
+    def descriptor_idxs(self):
+        """An array of the descriptor_idx of each type."""
+        return self._reader.ReadUIntArray(self.offset, self.size)
+
+
+class _ProtoIdItemList(_TableItemList):
+    _FORMAT = '<III'
+    _ITEM_TYPE = _ProtoIdItem
+
+
+class _MethodIdItemList(_TableItemList):
+    _FORMAT = '<HHI'
+    _ITEM_TYPE = _MethodIdItem
 
 
 class _StringItemList(_MemoryItemList):
+    """Strings, which are decoded on demand and cached."""
+
     def __init__(self, reader, offset, size):
-        reader.Seek(offset)
-        string_item_offsets = iter([reader.ReadUInt() for _ in range(size)])
+        # pylint: disable=super-init-not-called
+        self.offset = offset
+        self.size = size
+        self._reader = reader
+        self.GetString = functools.lru_cache(maxsize=_STRING_CACHE_SIZE)(
+            self._DecodeString
+        )
+
+    @functools.cached_property
+    def _data_offsets(self):
+        return self._reader.ReadUIntArray(self.offset, self.size)
+
+    def _DecodeString(self, string_item_idx):
+        return self._reader.ReadString(self._data_offsets[string_item_idx])
+
+    def __iter__(self):
+        return (self[i] for i in range(self.size))
 
-        def factory(x):
-            data_offset = next(string_item_offsets)
-            string = x.ReadString(data_offset)
-            return _StringDataItem(len(string), string)
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(self.size)[key]]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('string index out of range')
+        string = self.GetString(key)
+        return _StringDataItem(len(string), string)
 
-        super().__init__(reader, offset, size, factory)
+    def __len__(self):
+        return self.size
 
 
 class _TypeListItem(_MemoryItemList):
@@ -177,16 +241,9 @@ class _TypeListItemList(_MemoryItemList):
         super().__init__(reader, offset, size, _TypeListItem)
 
 
-class _ClassDefItemList(_MemoryItemList):
-    def __init__(self, reader, offset, size):
-        reader.Seek(offset)
-
-        def factory(x):
-            return _ClassDefItem(
-                *(x.ReadUInt() for _ in range(len(_ClassDefItem._fields)))
-            )
-
-        super().__init__(reader, offset, size, factory)
+class _ClassDefItemList(_TableItemList):
+    _FORMAT = '<8I'
+    _ITEM_TYPE = _ClassDefItem
 
 
 class _DexMapItem:
@@ -236,6 +293,20 @@ class _DexReader:
     def Tell(self):
         return self._pos
 
+    def View(self, offset, size):
+        """Returns a memoryview of |size| bytes at |offset| (without copying)."""
+        return memoryview(self._data)[offset : offset + size]
+
+    def ReadUIntArray(self, offset, size):
+        """Returns an array of |size| uint32s at |offset|."""
+        ret = array.array('I')
+        assert ret.itemsize == 4
+        with self.View(offset, size * 4) as view:
+            ret.frombytes(view)
+        if sys.byteorder == 'big':
+            ret.byteswap()
+        return ret
+
     def ReadUByte(self):
         return self._ReadData('<B')
 
@@ -248,6 +319,12 @@ class _DexReader:
     def ReadString(self, data_offset):
         string_length, string_offset = self._ReadULeb128(data_offset)
         string_data_offset = string_offset + data_offset
+        # Fast path: ASCII strings are encoded identically in MUTF-8, with one
+        # byte per UTF-16 code unit.
+        end = string_data_offset + string_length
+        data = self._data[string_data_offset:end]
+        if data.isascii() and 0 not in data and self._data[end] == 0:
+            return data.decode('ascii')
         return self._DecodeMUtf8(string_length, string_data_offset)
 
     def AlignUpTo(self, align_unit):
@@ -381,56 +458,92 @@ class DexFile:
     }
 
     def __init__(self, data):
-        """Decodes dex file memory sections.
+        """Reads the dex file header.
+
+        Other sections are decoded lazily, when first accessed.
 
         Args:
-          data: bytearray containing the contents of a dex file.
+          data: bytes-like object (e.g. bytes, bytearray, mmap) containing the
+            contents of a dex file. Must not be modified while in use.
         """
         self.reader = _DexReader(data)
         self.header = self.reader.ReadHeader()
-        self.map_list = _DexMapList(self.reader, self.header.map_off)
-        self.type_item_list = _TypeIdItemList(
+        self._type_list_strings_by_offset = {}
+
+    @classmethod
+    @contextlib.contextmanager
+    def Open(cls, path):
+        """Yields a DexFile that reads |path| via mmap."""
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield cls(data)
+
+    @functools.cached_property
+    def map_list(self):
+        return _DexMapList(self.reader, self.header.map_off)
+
+    @functools.cached_property
+    def type_item_list(self):
+        return _TypeIdItemList(
             self.reader, self.header.type_ids_off, self.header.type_ids_size
         )
-        self.proto_item_list = _ProtoIdItemList(
+
+    @functools.cached_property
+    def proto_item_list(self):
+        return _ProtoIdItemList(
             self.reader, self.header.proto_ids_off, self.header.proto_ids_size
         )
-        self.method_item_list = _MethodIdItemList(
+
+    @functools.cached_property
+    def method_item_list(self):
+        return _MethodIdItemList(
             self.reader, self.header.method_ids_off, self.header.method_ids_size
         )
-        self.string_item_list = _StringItemList(
+
+    @functools.cached_property
+    def string_item_list(self):
+        return _StringItemList(
             self.reader, self.header.string_ids_off, self.header.string_ids_size
         )
-        self.class_def_item_list = _ClassDefItemList(
+
+    @functools.cached_property
+    def class_def_item_list(self):
+        return _ClassDefItemList(
             self.reader, self.header.class_defs_off, self.header.class_defs_size
         )
 
+    @functools.cached_property
+    def type_list_item_list(self):
         type_list_key = _DexMapList.TYPE_TYPE_LIST
         if type_list_key in self.map_list:
             map_list_item = self.map_list[type_list_key]
-            self.type_list_item_list = _TypeListItemList(
+            return _TypeListItemList(
                 self.reader, map_list_item.offset, map_list_item.size
             )
-        else:
-            self.type_list_item_list = _TypeListItemList(self.reader, 0, 0)
-        self._type_lists_by_offset = {
-            type_list.offset: type_list
-            for type_list in self.type_list_item_list
-        }
+        return _TypeListItemList(self.reader, 0, 0)
 
     def GetString(self, string_item_idx):
-        string_item = self.string_item_list[string_item_idx]
-        return string_item.data
+        return self.string_item_list.GetString(string_item_idx)
 
     def GetTypeString(self, type_item_idx):
-        type_item = self.type_item_list[type_item_idx]
-        return self.GetString(type_item.descriptor_idx)
+        descriptor_idx = self.type_item_list.descriptor_idxs[type_item_idx]
+        return self.GetString(descriptor_idx)
 
     def GetTypeListStringsByOffset(self, offset):
         if not offset:
             return ()
-        type_list = self._type_lists_by_offset[offset]
-        return tuple(self.GetTypeString(item.type_idx) for item in type_list)
+        ret = self._type_list_strings_by_offset.get(offset)
+        if ret is None:
+            # Read only the referenced type list rather than all of them.
+            self.reader.Seek(offset)
+            size = self.reader.ReadUInt()
+            with self.reader.View(offset + 4, size * 2) as view:
+                ret = tuple(
+                    self.GetTypeString(type_idx)
+                    for (type_idx,) in struct.iter_unpack('<H', view)
+                )
+            self._type_list_strings_by_offset[offset] = ret
+        return ret
 
     @staticmethod
     def ResolveClassAccessFlags(access_flags):
@@ -447,14 +560,13 @@ class DexFile:
           Tuples that look like:
             (class name, return type, method name, (parameter type, ...)).
         """
-        for method_item in self.method_item_list:
-            class_name_string = self.GetTypeString(method_item.type_idx)
-            method_name_string = self.GetString(method_item.name_idx)
-            proto_item = self.proto_item_list[method_item.proto_idx]
-            return_type_string = self.GetTypeString(proto_item.return_type_idx)
-            parameter_types = self.GetTypeListStringsByOffset(
-                proto_item.parameters_off
-            )
+        proto_rows = self.proto_item_list.rows
+        for type_idx, proto_idx, name_idx in self.method_item_list.rows:
+            class_name_string = self.GetTypeString(type_idx)
+            method_name_string = self.GetString(name_idx)
+            _, return_type_idx, parameters_off = proto_rows[proto_idx]
+            return_type_string = self.GetTypeString(return_type_idx)
+            parameter_types = self.GetTypeListStringsByOffset(parameters_off)
             yield (
                 class_name_string,
                 return_type_string,
@@ -528,7 +640,7 @@ class _DumpSummary(_DumpCommand):
 
 
 def _DumpDexItems(dexfile_data, name, item):
-    dexfile = DexFile(bytearray(dexfile_data))
+    dexfile = DexFile(dexfile_data)
     print('dex_parser: Dumping {} for {}'.format(item, name))
     cmds = {
         'summary': _DumpSummary,
@@ -576,7 +688,8 @@ def main():
 
     else:
         with open(args.input, 'rb') as f:
-            _DumpDexItems(f.read(), args.input, args.item)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                _DumpDexItems(data, args.input, args.item)
 
 
 if __name__ == '__main__':
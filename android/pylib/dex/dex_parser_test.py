@@ -0,0 +1,160 @@
+#!/usr/bin/env vpython3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Tests for dex_parser.py."""
+
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+)
+from pylib.dex import dex_parser
+
+_HEADER_SIZE = 0x70
+
+
+def _Uleb128(value):
+    ret = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            ret.append(byte | 0x80)
+        else:
+            ret.append(byte)
+            return bytes(ret)
+
+
+def _CreateDex(strings, types, protos, methods):
+    """Returns the bytes of a minimal dex file.
+
+    Args:
+      strings: List of strings (encoded as UTF-8, so must not contain
+        supplementary characters).
+      types: List of string indices.
+      protos: List of (shorty_idx, return_type_idx, [parameter type_idx]).
+      methods: List of (type_idx, proto_idx, name_idx).
+    """
+    string_ids_off = _HEADER_SIZE
+    type_ids_off = string_ids_off + 4 * len(strings)
+    proto_ids_off = type_ids_off + 4 * len(types)
+    method_ids_off = proto_ids_off + 12 * len(protos)
+    data_off = method_ids_off + 8 * len(methods)
+
+    data = bytearray()
+    type_lists = []
+    for _, _, params in protos:
+        if not params:
+            type_lists.append(0)
+            continue
+        type_lists.append(data_off + len(data))
+        data += struct.pack(f'<I{len(params)}H', len(params), *params)
+        data += b'\0' * (-len(data) % 4)
+    string_offsets = []
+    for s in strings:
+        string_offsets.append(data_off + len(data))
+        data += _Uleb128(len(s)) + s.encode('utf-8') + b'\0'
+    data += b'\0' * (-len(data) % 4)
+    map_off = data_off + len(data)
+    type_list_offsets = [off for off in type_lists if off]
+    map_items = [(0x1001, len(type_list_offsets), min(type_list_offsets))]
+    data += struct.pack('<I', len(map_items))
+    for item in map_items:
+        data += struct.pack('<HHII', item[0], 0, item[1], item[2])
+
+    header = struct.pack(
+        '<8sI20s20I',
+        b'dex\n035\0',
+        0,
+        b'\0' * 20,
+        data_off + len(data),
+        _HEADER_SIZE,
+        0x12345678,
+        0,
+        0,
+        map_off,
+        len(strings),
+        string_ids_off,
+        len(types),
+        type_ids_off,
+        len(protos),
+        proto_ids_off,
+        0,
+        0,
+        len(methods),
+        method_ids_off,
+        0,
+        0,
+        len(data),
+        data_off,
+    )
+    return b''.join(
+        [
+            header,
+            struct.pack(f'<{len(strings)}I', *string_offsets),
+            struct.pack(f'<{len(types)}I', *types),
+            b''.join(
+                struct.pack('<III', shorty, ret, type_list)
+                for (shorty, ret, _), type_list in zip(protos, type_lists)
+            ),
+            b''.join(struct.pack('<HHI', *m) for m in methods),
+            data,
+        ]
+    )
+
+
+_TEST_DEX = _CreateDex(
+    strings=['LFoo;', 'V', 'VI', 'I', 'bar', 'café', 'baz'],
+    types=[0, 1, 3],
+    protos=[(1, 1, []), (2, 1, [2, 2])],
+    methods=[(0, 0, 4), (0, 1, 5), (0, 1, 6)],
+)
+
+
+class DexFileTest(unittest.TestCase):
+    def _CheckDexFile(self, dexfile):
+        self.assertEqual(dexfile.header.method_ids_size, 3)
+        self.assertEqual(
+            list(dexfile.IterMethodSignatureParts()),
+            [
+                ('LFoo;', 'V', 'bar', ()),
+                ('LFoo;', 'V', 'café', ('I', 'I')),
+                ('LFoo;', 'V', 'baz', ('I', 'I')),
+            ],
+        )
+        self.assertEqual(dexfile.GetString(5), 'café')
+        self.assertEqual(dexfile.string_item_list[-2].utf16_size, 4)
+        self.assertEqual(len(dexfile.string_item_list), 7)
+        self.assertEqual(
+            dexfile.method_item_list[1],
+            dex_parser._MethodIdItem(type_idx=0, proto_idx=1, name_idx=5),
+        )
+        self.assertEqual(
+            [t.descriptor_idx for t in dexfile.type_item_list], [0, 1, 3]
+        )
+        self.assertEqual(len(dexfile.type_list_item_list), 1)
+
+    def testBytes(self):
+        self._CheckDexFile(dex_parser.DexFile(_TEST_DEX))
+
+    def testMmap(self):
+        with tempfile.NamedTemporaryFile(suffix='.dex') as f:
+            f.write(_TEST_DEX)
+            f.flush()
+            with dex_parser.DexFile.Open(f.name) as dexfile:
+                self._CheckDexFile(dexfile)
+
+    def testSectionsAreLazy(self):
+        dexfile = dex_parser.DexFile(_TEST_DEX)
+        self.assertEqual(dexfile.GetTypeString(0), 'LFoo;')
+        self.assertNotIn('method_item_list', vars(dexfile))
+        self.assertNotIn('class_def_item_list', vars(dexfile))
+
+
+if __name__ == '__main__':
+    unittest.main()
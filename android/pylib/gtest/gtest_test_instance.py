@@ -3,13 +3,14 @@
 # found in the LICENSE file.
 
 
+import concurrent.futures
+import functools
 import html.parser
 import json
 import logging
 import os
 import re
 import tempfile
-import threading
 import xml.etree.ElementTree
 
 from devil.android import apk_helper
@@ -21,6 +22,7 @@ from pylib.base import test_run
 from pylib.symbols import deobfuscator
 from pylib.symbols import stack_symbolizer
 from pylib.utils import test_filter
+from pylib.utils import test_timings
 
 with host_paths.SysPath(host_paths.BUILD_UTIL_PATH):
     from lib.common import unittest_util
@@ -164,116 +166,186 @@ def ParseGTestListTests(raw_list):
     return ret
 
 
-def ParseGTestOutput(output, symbolizer, device_abi):
-    """Parses raw gtest output and returns a list of results.
+class GTestOutputParser:
+    """Incrementally parses raw gtest output into results.
 
-    Args:
-      output: A list of output lines.
-      symbolizer: The symbolizer used to symbolize stack.
-      device_abi: Device abi that is needed for symbolization.
-    Returns:
-      A list of base_test_result.BaseTestResults.
+    Lines can be fed as they arrive (e.g. from a pipe), and each result is
+    returned as soon as its test finishes, so that only the log of the most
+    recent test is buffered.
+
+    Native stacks are symbolized on a background thread. Results are returned
+    with their unsymbolized log, which is replaced by the symbolized one by the
+    time Finish() returns.
     """
-    duration = 0
-    fallback_result_type = None
-    log = []
-    stack = []
-    result_type = None
-    results = []
-    test_name = None
 
-    def symbolize_stack_and_merge_with_log():
-        log_string = '\n'.join(log or [])
-        if not stack:
-            stack_string = ''
-        else:
-            stack_string = '\n'.join(
-                symbolizer.ExtractAndResolveNativeStackTraces(stack, device_abi)
+    def __init__(self, symbolizer, device_abi):
+        self._symbolizer = symbolizer
+        self._device_abi = device_abi
+        self._executor = None
+        self._pending_symbolizations = []
+        self._done = False
+
+        self._duration = 0
+        self._fallback_result_type = None
+        self._log = []
+        self._stack = []
+        self._result_type = None
+        self._test_name = None
+
+    def _SymbolizeAndSetLog(self, result, log_string, stack):
+        stack_string = '\n'.join(
+            self._symbolizer.ExtractAndResolveNativeStackTraces(
+                stack, self._device_abi
             )
-        return '%s\n%s' % (log_string, stack_string)
-
-    def handle_possibly_unknown_test():
-        if test_name is not None:
-            results.append(
-                base_test_result.BaseTestResult(
-                    TestNameWithoutDisabledPrefix(test_name),
-                    # If we get here, that means we started a test, but it did not
-                    # produce a definitive test status output, so assume it crashed.
-                    # crbug/1191716
-                    fallback_result_type or base_test_result.ResultType.CRASH,
-                    duration,
-                    log=symbolize_stack_and_merge_with_log(),
+        )
+        result.SetLog('%s\n%s' % (log_string, stack_string))
+
+    def _CreateResult(self, result_type):
+        log_string = '\n'.join(self._log)
+        result = base_test_result.BaseTestResult(
+            TestNameWithoutDisabledPrefix(self._test_name),
+            result_type,
+            self._duration,
+            log='%s\n' % log_string,
+        )
+        if self._stack:
+            if not self._executor:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1
                 )
+            self._pending_symbolizations.append(
+                self._executor.submit(
+                    self._SymbolizeAndSetLog,
+                    result,
+                    log_string,
+                    list(self._stack),
+                )
+            )
+        self._test_name = None
+        return result
+
+    def _HandlePossiblyUnknownTest(self):
+        if self._test_name is None:
+            return []
+        # If we get here, that means we started a test, but it did not
+        # produce a definitive test status output, so assume it crashed.
+        # crbug/1191716
+        return [
+            self._CreateResult(
+                self._fallback_result_type or base_test_result.ResultType.CRASH
             )
+        ]
+
+    def ProcessLine(self, l):
+        """Consumes a line of output.
 
-    for l in output:
-        matcher = _RE_TEST_STATUS.match(l)
-        launcher_main_start_match = _RE_LAUNCHER_MAIN_START.match(l)
+        Returns:
+          A list of the base_test_result.BaseTestResults of the tests that
+          finished with this line.
+        """
+        if self._done:
+            return []
+        results = []
+        # All the regexes below other than the stack one start with a '[', so
+        # the other lines (most of the output) skip them.
+        is_bracketed = l.startswith('[')
+        matcher = is_bracketed and _RE_TEST_STATUS.match(l)
+        is_launcher_main_start = l.startswith('>>ScopedMainEntryLogger')
         if matcher:
-            if matcher.group(1) == 'RUN':
-                handle_possibly_unknown_test()
-                duration = 0
-                fallback_result_type = None
-                log = []
-                stack = []
-                result_type = None
-            elif matcher.group(1) == 'OK':
-                result_type = base_test_result.ResultType.PASS
-            elif matcher.group(1) == 'SKIPPED':
-                result_type = base_test_result.ResultType.SKIP
-            elif matcher.group(1) == 'FAILED':
-                result_type = base_test_result.ResultType.FAIL
-            elif matcher.group(1) == 'CRASHED':
-                fallback_result_type = base_test_result.ResultType.CRASH
+            status = matcher.group(1)
+            if status == 'RUN':
+                results += self._HandlePossiblyUnknownTest()
+                self._duration = 0
+                self._fallback_result_type = None
+                self._log = []
+                self._stack = []
+                self._result_type = None
+            elif status == 'OK':
+                self._result_type = base_test_result.ResultType.PASS
+            elif status == 'SKIPPED':
+                self._result_type = base_test_result.ResultType.SKIP
+            elif status == 'FAILED':
+                self._result_type = base_test_result.ResultType.FAIL
+            elif status == 'CRASHED':
+                self._fallback_result_type = base_test_result.ResultType.CRASH
             # Be aware that test name and status might not appear on same line.
-            test_name = matcher.group(2) if matcher.group(2) else test_name
-            duration = int(matcher.group(3)) if matcher.group(3) else 0
-
-        else:
-            # Can possibly add more matchers, such as different results from DCHECK.
+            self._test_name = matcher.group(2) or self._test_name
+            self._duration = int(matcher.group(3)) if matcher.group(3) else 0
+        elif is_launcher_main_start:
+            self._result_type = base_test_result.ResultType.CRASH
+            self._duration = None  # Don't know. Not using 0 as this is unknown.
+        elif is_bracketed:
+            # Can possibly add more matchers, such as different results from
+            # DCHECK.
             currently_running_matcher = _RE_TEST_CURRENTLY_RUNNING.match(l)
-            dcheck_matcher = _RE_TEST_DCHECK_FATAL.match(l)
-
             if currently_running_matcher:
-                test_name = currently_running_matcher.group(1)
-                result_type = base_test_result.ResultType.CRASH
-                duration = (
-                    None  # Don't know. Not using 0 as this is unknown vs 0.
-                )
-            elif dcheck_matcher or launcher_main_start_match:
-                result_type = base_test_result.ResultType.CRASH
-                duration = (
-                    None  # Don't know.  Not using 0 as this is unknown vs 0.
-                )
-
-        if not launcher_main_start_match:
-            log.append(l)
-            if not matcher and _STACK_LINE_RE.match(l):
-                stack.append(l)
-
-        if _RE_ANY_TESTS_FAILED.match(l):
-            break
-
-        if result_type and test_name:
+                self._test_name = currently_running_matcher.group(1)
+                self._result_type = base_test_result.ResultType.CRASH
+                self._duration = None
+            elif _RE_TEST_DCHECK_FATAL.match(l):
+                self._result_type = base_test_result.ResultType.CRASH
+                self._duration = None
+
+        if not is_launcher_main_start:
+            self._log.append(l)
+            if not matcher and '#' in l and _STACK_LINE_RE.match(l):
+                self._stack.append(l)
+
+        if is_bracketed and _RE_ANY_TESTS_FAILED.match(l):
+            self._done = True
+            return results
+
+        if self._result_type and self._test_name:
             # Don't bother symbolizing output if the test passed.
-            if result_type == base_test_result.ResultType.PASS:
-                stack = []
-            results.append(
-                base_test_result.BaseTestResult(
-                    TestNameWithoutDisabledPrefix(test_name),
-                    result_type,
-                    duration,
-                    log=symbolize_stack_and_merge_with_log(),
-                )
-            )
-            test_name = None
+            if self._result_type == base_test_result.ResultType.PASS:
+                self._stack = []
+            results.append(self._CreateResult(self._result_type))
+        return results
+
+    def Finish(self):
+        """Signals the end of the output.
 
-    else:
+        Returns:
+          A list containing the base_test_result.BaseTestResult of the test that
+          was running when the output ended, if any.
+        """
+        results = []
         # Executing this after tests have finished with a failure causes a
         # duplicate test entry to be added to results. crbug/1380825
-        handle_possibly_unknown_test()
+        if not self._done:
+            results = self._HandlePossiblyUnknownTest()
+            self._done = True
+        if self._executor:
+            for future in self._pending_symbolizations:
+                future.result()
+            self._pending_symbolizations = []
+            self._executor.shutdown()
+            self._executor = None
+        return results
 
-    return results
+    def Parse(self, output):
+        """Yields the results of the given lines, followed by Finish()'s."""
+        try:
+            for l in output:
+                yield from self.ProcessLine(l)
+                if self._done:
+                    break
+        finally:
+            results = self.Finish()
+        yield from results
+
+
+def ParseGTestOutput(output, symbolizer, device_abi):
+    """Parses raw gtest output and returns a list of results.
+
+    Args:
+      output: A list of output lines.
+      symbolizer: The symbolizer used to symbolize stack.
+      device_abi: Device abi that is needed for symbolization.
+    Returns:
+      A list of base_test_result.BaseTestResults.
+    """
+    return list(GTestOutputParser(symbolizer, device_abi).Parse(output))
 
 
 def ParseGTestXML(xml_content):
@@ -431,6 +503,12 @@ def IsPreTest(full_test_name):
     return _PREFIX_PRE in test_name
 
 
+# FilterTests() is called for each shard / device with the same filters.
+@functools.lru_cache(maxsize=32)
+def _CompileGtestFilter(gtest_filter):
+    return unittest_util.GtestFilter(gtest_filter)
+
+
 class GtestTestInstance(test_instance.TestInstance):
     def __init__(self, args, data_deps_delegate, error_func):
         super().__init__()
@@ -444,7 +522,6 @@ class GtestTestInstance(test_instance.TestInstance):
         self._exe_dist_dir = None
         self._external_shard_index = args.test_launcher_shard_index
         self._extract_test_list_from_filter = args.extract_test_list_from_filter
-        self._filter_tests_lock = threading.Lock()
         self._gs_test_artifacts_bucket = args.gs_test_artifacts_bucket
         self._isolated_script_test_output = args.isolated_script_test_output
         self._isolated_script_test_perf_output = (
@@ -455,6 +532,11 @@ class GtestTestInstance(test_instance.TestInstance):
         self._store_tombstones = args.store_tombstones
         self._suite = args.suite_name[0]
         self._total_external_shards = args.test_launcher_total_shards
+        self._test_timings = None
+        if args.test_launcher_timing_db:
+            self._test_timings = test_timings.TestTimingDatabase.Load(
+                args.test_launcher_timing_db
+            )
         self._wait_for_java_debugger = args.wait_for_java_debugger
         self._use_existing_test_data = args.use_existing_test_data
         self._deploy_mock_openxr_runtime = args.deploy_mock_openxr_runtime
@@ -679,6 +761,10 @@ class GtestTestInstance(test_instance.TestInstance):
     def test_launcher_batch_limit(self):
         return self._test_launcher_batch_limit
 
+    @property
+    def test_timings(self):
+        return self._test_timings
+
     @property
     def total_external_shards(self):
         return self._total_external_shards
@@ -757,44 +843,55 @@ class GtestTestInstance(test_instance.TestInstance):
         ]
         if self._gtest_filters:
             gtest_filter_strings.extend(self._gtest_filters)
-
-        filtered_test_list = test_list
-        # This lock is required because on older versions of Python
-        # |unittest_util.FilterTestNames| use of |fnmatch| is not threadsafe.
-        with self._filter_tests_lock:
-            for gtest_filter_string in gtest_filter_strings:
-                logging.debug('Filtering tests using: %s', gtest_filter_string)
-                filtered_test_list = unittest_util.FilterTestNames(
-                    filtered_test_list,
-                    gtest_filter_string,
-                    TestNameWithoutPrefixes,
-                )
-
-            if self._gtest_filters:
-                out_filtered_test_list = list(
-                    set(test_list) - set(filtered_test_list)
+        for gtest_filter_string in gtest_filter_strings:
+            logging.debug('Filtering tests using: %s', gtest_filter_string)
+        gtest_filters = [_CompileGtestFilter(f) for f in gtest_filter_strings]
+        user_gtest_filters = gtest_filters[1:]
+
+        # Classify each test in one pass. Filters apply in sequence, and each
+        # orders its output by the first positive pattern matched (see
+        # unittest_util.FilterTestNames()), so tests are sorted by the index of
+        # the pattern matched in each filter, last filter first.
+        matched_tests = []
+        disabled_tests = []
+        for order, test in enumerate(test_list):
+            test_stripped = TestNameWithoutPrefixes(test)
+            sort_key = []
+            for gtest_filter in gtest_filters:
+                index = gtest_filter.Match(test, test_stripped)
+                if index is None:
+                    break
+                sort_key.append(index)
+            else:
+                sort_key.reverse()
+                matched_tests.append((sort_key, order, test))
+                continue
+
+            if not user_gtest_filters:
+                continue
+            # Tests that are filtered out only because they are disabled.
+            test_name_no_disabled = TestNameWithoutDisabledPrefix(test)
+            if test_name_no_disabled == test:
+                continue
+            test_name_no_disabled_stripped = TestNameWithoutPrefixes(
+                test_name_no_disabled
+            )
+            if all(
+                gtest_filter.Match(
+                    test_name_no_disabled, test_name_no_disabled_stripped
                 )
-                disabled_tests = []
-                for test in out_filtered_test_list:
-                    test_name_no_disabled = TestNameWithoutDisabledPrefix(test)
-                    if test_name_no_disabled == test:
-                        continue
-                    if all(
-                        unittest_util.FilterTestNames(
-                            [test_name_no_disabled],
-                            gtest_filter,
-                            TestNameWithoutPrefixes,
-                        )
-                        for gtest_filter in self._gtest_filters
-                    ):
-                        disabled_tests.append(test)
-                if disabled_tests:
-                    if self._run_disabled:
-                        filtered_test_list += disabled_tests
-                    else:
-                        test_run.ShowDisabledTestsHint(
-                            count=len(disabled_tests)
-                        )
+                is not None
+                for gtest_filter in user_gtest_filters
+            ):
+                disabled_tests.append(test)
+
+        matched_tests.sort()
+        filtered_test_list = [test for _, _, test in matched_tests]
+        if disabled_tests:
+            if self._run_disabled:
+                filtered_test_list += disabled_tests
+            else:
+                test_run.ShowDisabledTestsHint(count=len(disabled_tests))
         return filtered_test_list
 
     def _GenerateDisabledFilterString(self, disabled_prefixes):
@@ -6,6 +6,7 @@
 
 import os
 import unittest
+from unittest import mock
 
 import sys
 
@@ -280,6 +281,55 @@ class GtestTestInstanceTests(unittest.TestCase):
         self.assertEqual(1, actual[0].GetDuration())
         self.assertEqual(base_test_result.ResultType.SKIP, actual[0].GetType())
 
+    def testGTestOutputParser_incremental(self):
+        parser = gtest_test_instance.GTestOutputParser(None, None)
+        self.assertEqual([], parser.ProcessLine('[ RUN      ] FooTest.Bar'))
+        actual = parser.ProcessLine('[       OK ] FooTest.Bar (1 ms)')
+        self.assertEqual(1, len(actual))
+        self.assertEqual('FooTest.Bar', actual[0].GetName())
+        self.assertEqual(base_test_result.ResultType.PASS, actual[0].GetType())
+        self.assertEqual([], parser.ProcessLine('[ RUN      ] FooTest.Baz'))
+        actual = parser.Finish()
+        self.assertEqual(1, len(actual))
+        self.assertEqual('FooTest.Baz', actual[0].GetName())
+        self.assertEqual(base_test_result.ResultType.CRASH, actual[0].GetType())
+
+    def testGTestOutputParser_stopsAtFailureSummary(self):
+        parser = gtest_test_instance.GTestOutputParser(None, None)
+        raw_output = iter(
+            [
+                '[ RUN      ] FooTest.Bar',
+                '[   FAILED ] FooTest.Bar (1 ms)',
+                '[  FAILED  ] 1 test, listed below:',
+                '[   FAILED ] FooTest.Bar',
+            ]
+        )
+        actual = list(parser.Parse(raw_output))
+        self.assertEqual(1, len(actual))
+        self.assertEqual(base_test_result.ResultType.FAIL, actual[0].GetType())
+        # Lines after the summary are not consumed.
+        self.assertEqual(['[   FAILED ] FooTest.Bar'], list(raw_output))
+
+    def testGTestOutputParser_symbolizesStack(self):
+        symbolizer = mock.Mock()
+        symbolizer.ExtractAndResolveNativeStackTraces.return_value = iter(
+            ['symbolized']
+        )
+        raw_output = [
+            '[ RUN      ] FooTest.Bar',
+            '  #00 pc 0001 libfoo.so',
+            '[   FAILED ] FooTest.Bar (1 ms)',
+        ]
+        actual = gtest_test_instance.ParseGTestOutput(
+            raw_output, symbolizer, 'arm64-v8a'
+        )
+        symbolizer.ExtractAndResolveNativeStackTraces.assert_called_once_with(
+            ['  #00 pc 0001 libfoo.so'], 'arm64-v8a'
+        )
+        self.assertEqual(
+            raw_output + ['symbolized'], actual[0].GetLog().splitlines()
+        )
+
     def testParseGTestXML_none(self):
         actual = gtest_test_instance.ParseGTestXML(None)
         self.assertEqual([], actual)
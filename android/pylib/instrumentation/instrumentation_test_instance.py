@@ -22,6 +22,7 @@ from pylib.symbols import stack_symbolizer
 from pylib.utils import dexdump
 from pylib.utils import gold_utils
 from pylib.utils import test_filter
+from pylib.utils import test_timings
 
 with host_paths.SysPath(host_paths.BUILD_UTIL_PATH):
     from lib.common import unittest_util
@@ -704,6 +705,11 @@ class InstrumentationTestInstance(test_instance.TestInstance):
 
         self._external_shard_index = args.test_launcher_shard_index
         self._total_external_shards = args.test_launcher_total_shards
+        self._test_timings = None
+        if args.test_launcher_timing_db:
+            self._test_timings = test_timings.TestTimingDatabase.Load(
+                args.test_launcher_timing_db
+            )
 
         self._is_unit_test = False
         self._initializeUnitTestFlag(args)
@@ -1169,6 +1175,10 @@ class InstrumentationTestInstance(test_instance.TestInstance):
     def timeout_scale(self):
         return self._timeout_scale
 
+    @property
+    def test_timings(self):
+        return self._test_timings
+
     @property
     def total_external_shards(self):
         return self._total_external_shards
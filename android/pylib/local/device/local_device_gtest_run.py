@@ -40,6 +40,7 @@ from pylib.symbols import stack_symbolizer
 from pylib.utils import code_coverage_utils
 from pylib.utils import device_dependencies
 from pylib.utils import logdog_helper
+from pylib.utils import test_timings
 from py_trace_event import trace_event
 from py_utils import contextlib_ext
 from py_utils import tempfile_ext
@@ -717,6 +718,11 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
         # so that other tests can be run.
         device_count = len(self._env.devices)
         batch_size = self._test_instance.test_launcher_batch_limit
+        timings = self._GetTestTimings()
+        if timings:
+            return self._PlanShardsForDevices(
+                tests, device_count, batch_size, timings
+            )
         shards = []
 
         for i in range(device_count):
@@ -744,6 +750,44 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
 
         return shards
 
+    def _PlanShardsForDevices(self, tests, device_count, batch_size, timings):
+        """Creates batches of similar duration, longest first."""
+        default_duration = timings.GetDefaultDuration()
+
+        def get_duration(test):
+            return self._GetTestDuration(timings, test, default_duration)
+
+        shards = []
+        single_tests = []
+        for test in tests:
+            if isinstance(test, list):
+                assert _IsPreTestGroup(test), (
+                    f'Expecting a PRE test group, got {test}'
+                )
+                shards.append(test)
+            elif test in self._crashes:
+                shards.append([test])
+            else:
+                single_tests.append(test)
+        shards += test_timings.PlanBatches(
+            single_tests, device_count, batch_size, get_duration
+        )
+        # Devices pull shards from a shared queue, so start the longest first.
+        shard_durations = [sum(map(get_duration, s)) for s in shards]
+        order = sorted(range(len(shards)), key=lambda i: -shard_durations[i])
+        shard_durations = [shard_durations[i] for i in order]
+        logging.info(
+            'Predicted duration of %d shards on %d devices: %.1fs',
+            len(shards),
+            device_count,
+            test_timings.SimulateMakespan(shard_durations, device_count) / 1000,
+        )
+        return [shards[i] for i in order]
+
+    # override
+    def _GetTestTimings(self):
+        return self._test_instance.test_timings
+
     # override
     def _GetTests(self):
         """Get the tests to run on the current shard.
@@ -1200,20 +1244,35 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
         if not self._env.skip_clear_data:
             self._delegate.Clear(device)
 
-        for l in output:
-            logging.info(l)
-
         # Parse the output.
         # TODO(crbug.com/366267015): Transition test scripts away from parsing
         # stdout.
+        output_parser = None
+        if not (
+            self._test_instance.enable_xml_result_parsing
+            or self._test_instance.isolated_script_test_output
+        ):
+            output_parser = gtest_test_instance.GTestOutputParser(
+                self._test_instance.symbolizer, device.product_cpu_abi
+            )
+        # Parse while logging so that stacks are symbolized in the background
+        # while the rest of the output is logged.
+        results = []
+        try:
+            for l in output:
+                logging.info(l)
+                if output_parser:
+                    results.extend(output_parser.ProcessLine(l))
+        finally:
+            # Also shuts down the symbolizer's executor if logging or parsing
+            # raises.
+            if output_parser:
+                results.extend(output_parser.Finish())
+
         if self._test_instance.enable_xml_result_parsing:
             results = gtest_test_instance.ParseGTestXML(gtest_xml)
         elif self._test_instance.isolated_script_test_output:
             results = gtest_test_instance.ParseGTestJSON(gtest_json)
-        else:
-            results = gtest_test_instance.ParseGTestOutput(
-                output, self._test_instance.symbolizer, device.product_cpu_abi
-            )
 
         tombstones_url = None
         for r in results:
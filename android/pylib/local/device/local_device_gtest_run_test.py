@@ -20,6 +20,7 @@ from pylib.base import base_test_result
 from pylib.gtest import gtest_test_instance
 from pylib.local.device import local_device_environment
 from pylib.local.device import local_device_gtest_run
+from pylib.utils import test_timings
 
 import mock  # pylint: disable=import-error
 
@@ -39,6 +40,7 @@ class LocalDeviceGtestRunTest(unittest.TestCase):
             ),
             mock.MagicMock(spec=gtest_test_instance.GtestTestInstance),
         )
+        self._obj._test_instance.test_timings = None
 
     def testExtractTestsFromFilter(self):
         # Checks splitting by colons.
@@ -219,6 +221,44 @@ class LocalDeviceGtestRunTest(unittest.TestCase):
         actual_shards = self._obj._CreateShardsForDevices(tests)
         self.assertListEqual(actual_shards, expected_shards)
 
+    def test_CreateShardsForDevices_withTimings(self):
+        self._obj._env.devices = [1, 2]
+        self._obj._test_instance.test_launcher_batch_limit = 3
+        self._obj._test_instance.test_timings = test_timings.TestTimingDatabase(
+            {
+                'TestSuite1.PRE_TestName1': 1,
+                'TestSuite1.TestName1': 1,
+                'TestSuite1.TestName2': 10,
+                'TestSuite1.TestName3': 6,
+                'TestSuite2.TestName1': 5,
+                'TestSuite2.TestName2': 1,
+            }
+        )
+        self._obj._crashes = set(['TestSuite1.CrashedTest1'])
+        tests = [
+            ['TestSuite1.PRE_TestName1', 'TestSuite1.TestName1'],
+            'TestSuite1.TestName2',
+            'TestSuite1.TestName3',
+            'TestSuite1.CrashedTest1',
+            'TestSuite2.TestName1',
+            'TestSuite2.TestName2',
+            # Assumed to take the median duration (3ms).
+            'TestSuite2.Unknown',
+        ]
+        # Longest first: 13ms, 12ms, 3ms, 2ms.
+        expected_shards = [
+            ['TestSuite1.TestName2', 'TestSuite2.Unknown'],
+            [
+                'TestSuite1.TestName3',
+                'TestSuite2.TestName1',
+                'TestSuite2.TestName2',
+            ],
+            ['TestSuite1.CrashedTest1'],
+            ['TestSuite1.PRE_TestName1', 'TestSuite1.TestName1'],
+        ]
+        actual_shards = self._obj._CreateShardsForDevices(tests)
+        self.assertListEqual(actual_shards, expected_shards)
+
     def test_GetTestsToRetry(self):
         test_data = [
             ('TestSuite1.TestName1', base_test_result.ResultType.PASS),
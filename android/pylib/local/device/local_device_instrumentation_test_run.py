@@ -1246,6 +1246,10 @@ class LocalDeviceInstrumentationTestRun(
             test = test[-1]
         return instrumentation_test_instance.GetUniqueTestName(test)
 
+    # override
+    def _GetTestTimings(self):
+        return self._test_instance.test_timings
+
     # override
     def _RunTest(self, device, test):
         extras = {}
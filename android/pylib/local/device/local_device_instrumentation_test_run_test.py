@@ -28,6 +28,7 @@ class LocalDeviceInstrumentationTestRunTest(unittest.TestCase):
         super().setUp()
         self._env = mock_environment.MockEnvironment()
         self._ti = mock_test_instance.MockTestInstance()
+        self._ti.test_timings = None
         self._obj = local_device_instrumentation_test_run.LocalDeviceInstrumentationTestRun(
             self._env, self._ti
         )
@@ -3,7 +3,6 @@
 # found in the LICENSE file.
 
 import fnmatch
-import hashlib
 import logging
 import os
 import signal
@@ -25,6 +24,7 @@ from pylib.base import test_collection
 from pylib.base import test_exception
 from pylib.base import test_run
 from pylib.utils import device_dependencies
+from pylib.utils import test_timings
 from pylib.local.device import local_device_environment
 
 from lib.proto import exception_recorder
@@ -323,9 +323,14 @@ class LocalDeviceTestRun(test_run.TestRun):
                 shard_index, total_shards
             )
 
-        sharded_tests = []
-
         grouped_tests = self._GroupTests(tests)
+        timings = self._GetTestTimings()
+        if timings:
+            return self._PlanExternalShards(
+                grouped_tests, shard_index, total_shards, timings
+            )
+
+        sharded_tests = []
         for test in grouped_tests:
             test_name = self._GetUniqueTestName(test)
             if self._DeterministicHash(test_name) % total_shards == shard_index:
@@ -333,13 +338,55 @@ class LocalDeviceTestRun(test_run.TestRun):
 
         return sharded_tests
 
+    def _PlanExternalShards(self, tests, shard_index, total_shards, timings):
+        """Returns the tests of a shard, balancing shards by test duration."""
+        default_duration = timings.GetDefaultDuration()
+        shards = test_timings.PlanShards(
+            tests,
+            total_shards,
+            lambda t: self._GetTestDuration(timings, t),
+            lambda t: self._DeterministicHash(self._GetUniqueTestName(t)),
+            default_duration,
+        )
+        shard_durations = [
+            sum(
+                self._GetTestDuration(timings, t, default_duration)
+                for t in shard
+            )
+            for shard in shards
+        ]
+        logging.info(
+            'Predicted duration of this shard: %.1fs (slowest shard: %.1fs)',
+            shard_durations[shard_index] / 1000,
+            test_timings.SimulateMakespan(shard_durations, total_shards) / 1000,
+        )
+        return shards[shard_index]
+
+    def _GetTestDuration(self, timings, test, default=None):
+        """Returns the recorded duration of a test or test group, in ms.
+
+        Returns |default| if any test of the group has no recorded duration.
+        """
+        total = 0
+        for t in FlattenTestList([test]):
+            duration = timings.GetDuration(self._GetUniqueTestName(t))
+            if duration is None:
+                return default
+            total += duration
+        return total
+
+    def _GetTestTimings(self):
+        """Returns the test_timings.TestTimingDatabase to shard with, if any.
+
+        Can be overridden by subclasses.
+        """
+        # pylint: disable=no-self-use
+        return None
+
     def _DeterministicHash(self, test_name):
         """Return the deterministic hash for a test name, as an integer."""
         # pylint: disable=no-self-use
-        assert isinstance(test_name, str), 'Expecting a string.'
-        hash_bytes = hashlib.sha256(test_name.encode('utf-8')).digest()
-        # To speed thing up, only take the last 3 bytes
-        return int.from_bytes(hash_bytes[-3:], byteorder='big')
+        return test_timings.DeterministicHash(test_name)
 
     # Sort by hash so we don't put all tests in a slow suite in the same shard.
     def _SortTests(self, tests):
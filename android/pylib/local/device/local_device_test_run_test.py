@@ -17,6 +17,7 @@ sys.path.append(
 
 from pylib.base import base_test_result
 from pylib.local.device import local_device_test_run
+from pylib.utils import test_timings
 
 import mock  # pylint: disable=import-error
 
@@ -38,6 +39,17 @@ class TestLocalDeviceNonStringTestRun(local_device_test_run.LocalDeviceTestRun):
         return test['name']
 
 
+class TestLocalDeviceTimedTestRun(local_device_test_run.LocalDeviceTestRun):
+    # pylint: disable=abstract-method
+
+    def __init__(self, durations):
+        super().__init__(mock.MagicMock(), mock.MagicMock())
+        self._timings = test_timings.TestTimingDatabase(durations)
+
+    def _GetTestTimings(self):
+        return self._timings
+
+
 class TestLocalDeviceRetryTestRun(local_device_test_run.LocalDeviceTestRun):
     # pylint: disable=abstract-method
 
@@ -72,6 +84,28 @@ class LocalDeviceTestRunTest(unittest.TestCase):
             ['e', 'c', 'g', 'b', 'f', 'a', 'd'],
         )
 
+    def testApplyExternalSharding_withTimings(self):
+        test_run = TestLocalDeviceTimedTestRun({'a': 10, 'b': 6, 'c': 5})
+        self.assertEqual(
+            [
+                test_run._ApplyExternalSharding(['a', 'b', 'c'], i, 2)
+                for i in (0, 1)
+            ],
+            [['a'], ['b', 'c']],
+        )
+        # Unknown tests are sharded the same way as without timings.
+        tests = ['a', 'b', 'c', 'd', 'e', 'f']
+        hashed_run = TestLocalDeviceTestRun()
+        for i in (0, 1):
+            self.assertEqual(
+                [
+                    t
+                    for t in test_run._ApplyExternalSharding(tests, i, 2)
+                    if t in 'def'
+                ],
+                hashed_run._ApplyExternalSharding(['d', 'e', 'f'], i, 2),
+            )
+
     def testGetTestsToRetry_allTestsPassed(self):
         results = [
             base_test_result.BaseTestResult(
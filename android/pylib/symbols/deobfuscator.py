@@ -6,15 +6,12 @@ import logging
 import os
 
 from pylib import constants
+from . import retrace
 from .expensive_line_transformer import ExpensiveLineTransformer
-from .expensive_line_transformer import ExpensiveLineTransformerPool
 
 _MINIMUM_TIMEOUT = 10.0
 _PER_LINE_TIMEOUT = 0.005  # Should be able to process 200 lines per second.
 _PROCESS_START_TIMEOUT = 20.0
-_MAX_RESTARTS = 4  # Should be plenty unless tool is crashing on start-up.
-_POOL_SIZE = 4
-_PASSTHROUH_ON_FAILURE = False
 
 
 class Deobfuscator(ExpensiveLineTransformer):
@@ -51,17 +48,31 @@ class Deobfuscator(ExpensiveLineTransformer):
         return self._command
 
 
-class DeobfuscatorPool(ExpensiveLineTransformerPool):
+class DeobfuscatorPool:
+    """Deobfuscates lines in-process, with the same interface as the pool of
+    java_deobfuscate.py processes that it replaced.
+
+    Unlike Deobfuscator, this does not start a JVM (each of which required about
+    500MB of RAM). The .mapping file is indexed once (see retrace.py) and
+    TransformLines() can be called from multiple threads.
+    """
+
     def __init__(self, mapping_path):
-        # As of Sep 2017, each instance requires about 500MB of RAM, as measured by:
-        # /usr/bin/time -v build/android/stacktrace/java_deobfuscate.py \
-        #     out/Release/apks/ChromePublic.apk.mapping
         self.mapping_path = mapping_path
-        super().__init__(_MAX_RESTARTS, _POOL_SIZE, _PASSTHROUH_ON_FAILURE)
+        self._retracer = retrace.Retracer(mapping_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
 
     @property
     def name(self):
         return "deobfuscator-pool"
 
-    def CreateTransformer(self):
-        return Deobfuscator(self.mapping_path)
+    def TransformLines(self, lines):
+        return self._retracer.TransformLines(lines)
+
+    def Close(self):
+        self._retracer.Close()
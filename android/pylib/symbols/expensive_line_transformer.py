@@ -3,14 +3,14 @@
 # found in the LICENSE file.
 
 from abc import ABC, abstractmethod
+import concurrent.futures
 import logging
+import queue
 import subprocess
 import threading
 import time
 import uuid
 
-from devil.utils import reraiser_thread
-
 
 class ExpensiveLineTransformer(ABC):
     def __init__(
@@ -20,7 +20,7 @@ class ExpensiveLineTransformer(ABC):
         self._minimum_timeout = minimum_timeout
         self._per_line_timeout = per_line_timeout
         self._started = False
-        # Allow only one thread to call TransformLines() at a time.
+        # Allow only one thread to call TransformBatch() at a time.
         self._lock = threading.Lock()
         # Ensure that only one thread attempts to kill self._proc in Close().
         self._close_lock = threading.Lock()
@@ -29,6 +29,8 @@ class ExpensiveLineTransformer(ABC):
         self._proc = None
         # Start process eagerly to hide start-up latency.
         self._proc_start_time = None
+        # Lines read from the process's stdout, followed by None at EOF.
+        self._output = queue.Queue()
 
     def start(self):
         # delay the start of the process, to allow the initialization of the
@@ -54,8 +56,25 @@ class ExpensiveLineTransformer(ABC):
             universal_newlines=True,
             close_fds=True,
         )
+        # A single reader for the lifetime of the process, rather than one per
+        # TransformBatch() call.
+        threading.Thread(
+            target=self._ReadOutput,
+            args=(self._proc.stdout,),
+            name='%s-reader' % self.name,
+            daemon=True,
+        ).start()
         self._started = True
 
+    def _ReadOutput(self, stdout):
+        try:
+            for line in iter(stdout.readline, ''):
+                self._output.put(line[:-1])
+        except (IOError, ValueError):
+            # stdout was closed by Close().
+            pass
+        self._output.put(None)
+
     def IsClosed(self):
         return (
             not self._started
@@ -80,27 +99,36 @@ class ExpensiveLineTransformer(ABC):
         Returns:
           A list of strings without trailing newlines.
         """
-        if not lines:
-            return []
+        return self.TransformBatch([lines])[0]
+
+    def TransformBatch(self, batch):
+        """Transforms several lists of lines in a single round trip.
+
+        Args:
+          batch: A list of lists of strings without trailing newlines.
+
+        Returns:
+          A list with the transformed lines of each list in |batch|. Lists that
+          could not be transformed (process crashes, timeout, etc) are returned
+          as is.
+        """
+        ret = [[] for _ in batch]
+        pending = [i for i, lines in enumerate(batch) if lines]
+        if not pending:
+            return ret
 
         # symbolized output contain more lines than the input, as the symbolized
         # stacktraces will be added. To account for the extra output lines, keep
         # reading until this eof_line token is reached. Using a format that will
         # be considered a "useful line" without modifying its output by
         # third_party/android_platform/development/scripts/stack_core.py
-        eof_line = self.getEofLine()
-        out_lines = []
-
-        def _reader():
-            while True:
-                line = self._proc.stdout.readline()
-                # Return an empty string at EOF (when stdin is closed).
-                if not line:
-                    break
-                line = line[:-1]
-                if line == eof_line:
-                    break
-                out_lines.append(line)
+        eof_lines = {i: self.getEofLine() for i in pending}
+        num_lines = sum(len(batch[i]) for i in pending)
+
+        def _untransformed():
+            for i in pending:
+                ret[i] = batch[i]
+            return ret
 
         if self.IsBusy():
             logging.warning('%s: Having to wait for transformation.', self.name)
@@ -115,51 +143,72 @@ class ExpensiveLineTransformer(ABC):
                         self._proc.returncode,
                     )
                     self.Close()
-                return lines
-
-            reader_thread = reraiser_thread.ReraiserThread(_reader)
-            reader_thread.start()
+                return _untransformed()
 
             try:
-                self._proc.stdin.write('\n'.join(lines))
-                self._proc.stdin.write('\n{}\n'.format(eof_line))
+                self._proc.stdin.write(
+                    ''.join(
+                        '%s\n%s\n' % ('\n'.join(batch[i]), eof_lines[i])
+                        for i in pending
+                    )
+                )
                 self._proc.stdin.flush()
-                time_since_proc_start = time.time() - self._proc_start_time
-                timeout = max(
-                    0, self._process_start_timeout - time_since_proc_start
-                ) + max(
-                    self._minimum_timeout, len(lines) * self._per_line_timeout
+            except IOError:
+                logging.exception(
+                    '%s: Exception during transformation', self.name
                 )
-                reader_thread.join(timeout)
-                if self.IsClosed():
-                    logging.warning(
-                        '%s: Close() called by another thread during join().',
-                        self.name,
-                    )
-                    return lines
-                if reader_thread.is_alive():
+                self.Close()
+                return _untransformed()
+
+            time_since_proc_start = time.time() - self._proc_start_time
+            timeout = max(
+                0, self._process_start_timeout - time_since_proc_start
+            ) + max(self._minimum_timeout, num_lines * self._per_line_timeout)
+            deadline = time.time() + timeout
+            while pending:
+                i = pending[0]
+                out_lines = []
+                try:
+                    while True:
+                        line = self._output.get(
+                            timeout=max(0, deadline - time.time())
+                        )
+                        if line is None or line == eof_lines[i]:
+                            break
+                        out_lines.append(line)
+                except queue.Empty:
                     logging.error(
                         '%s: Timed out after %f seconds with input:',
                         self.name,
                         timeout,
                     )
-                    for l in lines:
+                    for l in batch[i]:
                         logging.error(l)
-                    logging.error(eof_line)
+                    logging.error(eof_lines[i])
                     logging.error('%s: End of timed out input.', self.name)
                     logging.error('%s: Timed out output was:', self.name)
                     for l in out_lines:
                         logging.error(l)
                     logging.error('%s: End of timed out output.', self.name)
                     self.Close()
-                    return lines
-                return out_lines
-            except IOError:
-                logging.exception(
-                    '%s: Exception during transformation', self.name
-                )
-                self.Close()
-                return lines
+                    return _untransformed()
+                if line is None:
+                    if self._closed_called:
+                        logging.warning(
+                            '%s: Close() called by another thread during '
+                            'transformation.',
+                            self.name,
+                        )
+                    else:
+                        logging.warning(
+                            '%s: Process exited during transformation.',
+                            self.name,
+                        )
+                        self.Close()
+                    return _untransformed()
+                ret[i] = out_lines
+                pending.pop(0)
+            return ret
 
     def Close(self):
         with self._close_lock:
@@ -193,13 +242,34 @@ class ExpensiveLineTransformer(ABC):
 
 
 class ExpensiveLineTransformerPool(ABC):
+    """Transforms lines using a pool of transformers.
+
+    Requests from any thread are queued, and each transformer is fed by its own
+    worker thread. A free worker takes all of the requests that are waiting (up
+    to _MAX_BATCH_LINES lines) and sends them in a single round trip, so that
+    many small requests do not each pay for a round trip. Transformers are
+    started as requests back up, up to |pool_size|.
+    """
+
+    # Maximum number of lines that a worker sends in one round trip.
+    _MAX_BATCH_LINES = 2000
+
     def __init__(self, max_restarts, pool_size, passthrough_on_failure):
         self._max_restarts = max_restarts
-        self._pool = [self.CreateTransformer() for _ in range(pool_size)]
+        self._pool_size = pool_size
         self._passthrough_on_failure = passthrough_on_failure
-        # Allow only one thread to select from the pool at a time.
+        # Guards the pool, the workers and the counts below.
         self._lock = threading.Lock()
         self._num_restarts = 0
+        self._num_idle_workers = 0
+        # Items are (lines, future), or None to stop a worker.
+        self._requests = queue.Queue()
+        self._pool = []
+        self._workers = []
+        self._closed = False
+        # Start one transformer eagerly to hide start-up latency.
+        with self._lock:
+            self._AddWorker()
 
     def __enter__(self):
         pass
@@ -207,40 +277,107 @@ class ExpensiveLineTransformerPool(ABC):
     def __exit__(self, *args):
         self.Close()
 
-    def TransformLines(self, lines):
+    def _AddWorker(self):
+        self._pool.append(self.CreateTransformer())
+        worker = threading.Thread(
+            target=self._WorkerMain,
+            args=(len(self._workers),),
+            name='%s-%d' % (self.name, len(self._workers)),
+            daemon=True,
+        )
+        self._workers.append(worker)
+        worker.start()
+
+    def SubmitLines(self, lines):
+        """Queues lines to be transformed.
+
+        Returns:
+          A concurrent.futures.Future for the transformed lines.
+        """
+        future = concurrent.futures.Future()
         with self._lock:
-            assert self._pool, 'TransformLines() called on a closed Pool.'
+            assert not self._closed, 'TransformLines() called on a closed Pool.'
+            self._requests.put((lines, future))
+            if (
+                self._requests.qsize() > self._num_idle_workers
+                and len(self._workers) < self._pool_size
+            ):
+                self._AddWorker()
+        return future
+
+    def TransformLines(self, lines):
+        if not lines:
+            return []
+        return self.SubmitLines(lines).result()
 
+    def _GetTransformer(self, index):
+        """Returns the worker's transformer, or None if transformation is broken.
+
+        Restarts the transformer if it was closed.
+        """
+        with self._lock:
             # transformation is broken.
             if self._num_restarts == self._max_restarts:
-                if self._passthrough_on_failure:
-                    return lines
-                raise Exception('%s is broken.' % self.name)
-
-            # Restart any closed transformer.
-            for i, d in enumerate(self._pool):
-                if d.IsClosed():
-                    logging.warning(
-                        '%s: Restarting closed instance.', self.name
-                    )
-                    self._pool[i] = self.CreateTransformer()
-                    self._num_restarts += 1
-                    if self._num_restarts == self._max_restarts:
-                        logging.warning('%s: MAX_RESTARTS reached.', self.name)
-                        if self._passthrough_on_failure:
-                            return lines
-                        raise Exception('%s is broken.' % self.name)
-
-            selected = next(
-                (x for x in self._pool if x.IsReady()), self._pool[0]
-            )
-            # Rotate the order so that next caller will not choose the same one.
-            self._pool.remove(selected)
-            self._pool.append(selected)
+                return None
+            if self._pool[index].IsClosed():
+                logging.warning('%s: Restarting closed instance.', self.name)
+                self._pool[index] = self.CreateTransformer()
+                self._num_restarts += 1
+                if self._num_restarts == self._max_restarts:
+                    logging.warning('%s: MAX_RESTARTS reached.', self.name)
+                    return None
+            return self._pool[index]
+
+    def _WorkerMain(self, index):
+        stop = False
+        while not stop:
+            with self._lock:
+                self._num_idle_workers += 1
+            item = self._requests.get()
+            with self._lock:
+                self._num_idle_workers -= 1
+            if item is None:
+                return
+            # Coalesce whatever else is waiting.
+            batch = [item]
+            num_lines = len(item[0])
+            while num_lines < self._MAX_BATCH_LINES:
+                try:
+                    item = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                num_lines += len(item[0])
 
-        return selected.TransformLines(lines)
+            try:
+                transformer = self._GetTransformer(index)
+                if transformer:
+                    results = transformer.TransformBatch([l for l, _ in batch])
+                elif self._passthrough_on_failure:
+                    results = [l for l, _ in batch]
+                else:
+                    raise Exception('%s is broken.' % self.name)
+            except Exception as e:  # pylint: disable=broad-except
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
 
     def Close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = self._workers
+        # Workers finish the requests queued before these.
+        for _ in workers:
+            self._requests.put(None)
+        for worker in workers:
+            worker.join()
         with self._lock:
             for d in self._pool:
                 d.Close()
@@ -0,0 +1,134 @@
+#!/usr/bin/env vpython3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Tests for expensive_line_transformer.py."""
+
+import concurrent.futures
+import os
+import sys
+import threading
+import unittest
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+)
+from pylib.symbols import expensive_line_transformer
+
+# Upper-cases lines that start with 'x', and echoes the others.
+_UPPER_SCRIPT = """\
+import sys
+for line in sys.stdin:
+    sys.stdout.write(line.upper() if line.startswith('x') else line)
+"""
+
+
+class _Upper(expensive_line_transformer.ExpensiveLineTransformer):
+    def __init__(self):
+        super().__init__(
+            process_start_timeout=10, minimum_timeout=10, per_line_timeout=0
+        )
+        self.start()
+
+    @property
+    def name(self):
+        return 'upper'
+
+    @property
+    def command(self):
+        return [sys.executable, '-u', '-c', _UPPER_SCRIPT]
+
+
+class _UpperPool(expensive_line_transformer.ExpensiveLineTransformerPool):
+    def __init__(self, pool_size=1, max_restarts=2):
+        self.transformers = []
+        super().__init__(
+            max_restarts=max_restarts,
+            pool_size=pool_size,
+            passthrough_on_failure=True,
+        )
+
+    def CreateTransformer(self):
+        transformer = _Upper()
+        self.transformers.append(transformer)
+        return transformer
+
+    @property
+    def name(self):
+        return 'upper-pool'
+
+
+class ExpensiveLineTransformerTest(unittest.TestCase):
+    def setUp(self):
+        self._transformer = _Upper()
+        self.addCleanup(self._transformer.Close)
+
+    def testTransformLines(self):
+        self.assertEqual(
+            self._transformer.TransformLines(['xa', 'b']), ['XA', 'b']
+        )
+
+    def testTransformBatch(self):
+        self.assertEqual(
+            self._transformer.TransformBatch([['xa'], [], ['b', 'xc']]),
+            [['XA'], [], ['b', 'XC']],
+        )
+
+    def testReturnsInputWhenProcessDies(self):
+        self._transformer.TransformLines(['xa'])
+        # pylint: disable=protected-access
+        self._transformer._proc.kill()
+        self._transformer._proc.wait()
+        self.assertEqual(self._transformer.TransformLines(['xa']), ['xa'])
+        self.assertTrue(self._transformer.IsClosed())
+
+
+class ExpensiveLineTransformerPoolTest(unittest.TestCase):
+    def testTransformLines(self):
+        pool = _UpperPool()
+        with pool:
+            self.assertEqual(pool.TransformLines(['xa', 'b']), ['XA', 'b'])
+            self.assertEqual(pool.TransformLines([]), [])
+
+    def testConcurrentRequests(self):
+        pool = _UpperPool(pool_size=2)
+        self.addCleanup(pool.Close)
+        requests = [['x%d' % i, 'y%d' % i] for i in range(50)]
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(pool.TransformLines, requests))
+        self.assertEqual(results, [['X%d' % i, 'y%d' % i] for i in range(50)])
+        self.assertLessEqual(len(pool.transformers), 2)
+
+    def testSubmitLines(self):
+        pool = _UpperPool()
+        futures = [pool.SubmitLines(['x%d' % i]) for i in range(10)]
+        pool.Close()
+        # Requests queued before Close() are still transformed.
+        self.assertEqual(
+            [f.result() for f in futures], [['X%d' % i] for i in range(10)]
+        )
+        self.assertEqual(pool.TransformLines([]), [])
+
+    def testRestartsAndPassesThrough(self):
+        pool = _UpperPool(max_restarts=1)
+        self.addCleanup(pool.Close)
+        self.assertEqual(pool.TransformLines(['xa']), ['XA'])
+        # pylint: disable=protected-access
+        pool.transformers[0]._proc.kill()
+        pool.transformers[0]._proc.wait()
+        # The restart limit is reached, so lines are passed through.
+        self.assertEqual(pool.TransformLines(['xa']), ['xa'])
+        self.assertEqual(pool.TransformLines(['xb']), ['xb'])
+
+    def testCloseIsIdempotent(self):
+        pool = _UpperPool()
+        done = threading.Event()
+        pool.SubmitLines(['xa']).add_done_callback(lambda _: done.set())
+        pool.Close()
+        pool.Close()
+        self.assertTrue(done.is_set())
+        self.assertTrue(all(t.IsClosed() for t in pool.transformers))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,860 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""In-process retrace of ProGuard / R8 .mapping files.
+
+A Python equivalent of //build/android/stacktrace/java_deobfuscate.py (which
+runs FlushingReTrace.java) that does not need a JVM.
+
+The .mapping file is parsed once into a binary index, which is stored next to
+it (or in the temp directory when that is not writable) and memory-mapped on
+subsequent uses. Lookups read directly from the mapped file, so memory use is
+proportional to the number of distinct symbols looked up rather than to the
+size of the mapping.
+
+Usage: retrace.py Foo.apk.mapping < foo.log
+"""
+
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+
+# Sub-patterns of the line regular expression, as defined by R8's retrace.
+_IDENTIFIER = r'(?:[^\W\d]|\$)[\w$]*'
+_TYPE = rf'(?:{_IDENTIFIER}\.)*{_IDENTIFIER}(?:\[\])*'
+_PLACEHOLDERS = {
+    # Class name.
+    'c': rf'(?:{_IDENTIFIER}\.)*{_IDENTIFIER}',
+    # Class name in binary form (with slashes).
+    'C': rf'(?:{_IDENTIFIER}/)*{_IDENTIFIER}',
+    # Method name.
+    'm': rf'(?:{_IDENTIFIER}|<init>|<clinit>)',
+    # Field name.
+    'f': _IDENTIFIER,
+    # Source file.
+    's': r'[\w$.\- ]*',
+    # Line number.
+    'l': r'\d+',
+    # Type.
+    't': _TYPE,
+    # Method arguments.
+    'a': rf'(?:{_TYPE}(?:\s*,\s*{_TYPE})*)?',
+}
+
+# Must be kept in sync with LINE_PARSE_REGEX in FlushingReTrace.java, which
+# documents each pattern.
+_LOGCAT_PREFIX = (
+    r'(?:[VDIWEF]/.*?\( *\d+\): |\d\d-\d\d [0-9:. ]+[VDIWEF] .*?: )?'
+)
+_LINE_PARSE_REGEX = (
+    _LOGCAT_PREFIX
+    + '(?:'
+    + r'(?:.*?(?::|\bat)\s+%c\.%m\s*\(\s*%s(?:\s*:\s*%l\s*)?\))|'
+    + r'(?:.*?\(\s*%s(?:\s*:\s*%l\s*)?\)\s*%c\.%m)|'
+    + r'(?:.*?\(%c\.%m\+%l\))|'
+    + r'(?:.*java\.lang\.NullPointerException.*["\']%t\s*%c\.(?:%f|%m\(%a\))["\'].*)|'
+    + r'(?:java\.lang\.VerifyError: %c)|'
+    + r'(?:java\.lang\.NoSuchFieldError: No instance field %f of type .*? in class'
+    + r' L%C;)|'
+    + r'(?:.*?Object of type %c .*)|'
+    + r'(?:.*L%C;.*)|'
+    + r'(?:.*?%c#%m.*?)|'
+    + r'(?:.* isTestClass for %c)|'
+    + r'(?:Caused by: %c:.*)|'
+    + r'(?:.*├─ %c .*)|'
+    + r'(?:.*\(%c↓ .*)|'
+    + r'(?:.*↓ (?:static )?%c\.%f.*)|'
+    + r'(?:.*?%c\.%m)|'
+    + r'(?:.*?"%c\.%m".*)|'
+    + r'(?:.*\b(?:[Cc]lass|[Tt]ype)\b.*?"%c".*)|'
+    + r'(?:.*\b(?:[Cc]lass|[Tt]ype)\b.*?%c)|'
+    + r'(?:%c:.*)|'
+    + r'(?:%c)'
+    + ')'
+)
+
+_PRIMITIVE_TYPES = frozenset(
+    [
+        'boolean',
+        'byte',
+        'char',
+        'double',
+        'float',
+        'int',
+        'long',
+        'short',
+        'void',
+    ]
+)
+
+# Index file format. All integers are little-endian.
+#
+# Header: magic, version, .mapping size, .mapping mtime_ns, number of strings,
+#     classes, methods and fields, and the file offsets of the string offsets,
+#     string data, class, method and field tables.
+# Strings: UTF-8 data, with a table of num_strings + 1 u32 offsets into it.
+# Classes: Sorted by obfuscated name. Members of each class are stored
+#     contiguously, sorted by obfuscated name (and then by .mapping order).
+_INDEX_MAGIC = b'RETRACE\0'
+_INDEX_VERSION = 2
+_INDEX_SUFFIX = '.retrace_index'
+_HEADER = struct.Struct('<8sIQQIIIIQQQQQ')
+_STRING_OFFSET = struct.Struct('<I')
+# obfuscated name, original name, source file, first method, num methods,
+# first field, num fields.
+_CLASS = struct.Struct('<7I')
+# obfuscated name, original name, original class, metadata (JSON list), flags,
+# obfuscated start line, obfuscated end line, original start line, original
+# end line.
+_METHOD = struct.Struct('<5I4i')
+# obfuscated name, original name.
+_FIELD = struct.Struct('<2I')
+_NONE = 0xFFFFFFFF
+_NO_LINE = -1
+# Set for inlined frames that follow the previous method entry.
+_FLAG_INLINED_CALLER = 1
+# Set for methods that R8 created by outlining code.
+_FLAG_OUTLINE = 2
+
+# Member metadata that affects retracing. See R8's MappingInformation.
+_OUTLINE_ID = 'com.android.tools.r8.outline'
+_OUTLINE_CALLSITE_ID = 'com.android.tools.r8.outlineCallsite'
+_REWRITE_FRAME_ID = 'com.android.tools.r8.rewriteFrame'
+_THROWS_CONDITION_RE = re.compile(r'throws\((L[^;]+;)\)')
+_REMOVE_INNER_FRAMES_RE = re.compile(r'removeInnerFrames\((\d+)\)')
+
+_CLASS_LINE_RE = re.compile(r'^(\S.*?) -> (\S+):$')
+_METHOD_LINE_RE = re.compile(
+    r'^\s+(?:(\d+):(\d+):)?\S+ ([^\s(]+)\([^)]*\)(?::(\d+)(?::(\d+))?)?'
+    r' -> (\S+)$'
+)
+_FIELD_LINE_RE = re.compile(r'^\s+\S+ ([^\s(]+) -> (\S+)$')
+
+
+class _IndexBuilder:
+    """Parses a .mapping file into the index format."""
+
+    def __init__(self):
+        self._strings = {}
+        # List of [obf, orig, source_file, methods, fields].
+        self._classes = []
+
+    def _Intern(self, s):
+        if s is None:
+            return _NONE
+        return self._strings.setdefault(s, len(self._strings))
+
+    def Parse(self, mapping_file):
+        cur_class = None
+        prev_method = None
+        for line in mapping_file:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            if line.lstrip().startswith('#'):
+                if cur_class is not None:
+                    self._ParseMetadata(
+                        cur_class,
+                        cur_class[3][-1] if prev_method is not None else None,
+                        line.lstrip(),
+                    )
+                continue
+            if not line[0].isspace():
+                m = _CLASS_LINE_RE.match(line)
+                cur_class = None
+                if m:
+                    cur_class = [m.group(2), m.group(1), None, [], []]
+                    self._classes.append(cur_class)
+                prev_method = None
+                continue
+            if cur_class is None:
+                continue
+            if m := _METHOD_LINE_RE.match(line):
+                (
+                    obf_start,
+                    obf_end,
+                    name,
+                    orig_start,
+                    orig_end,
+                    obf_name,
+                ) = m.groups()
+                orig_class = None
+                if '.' in name:
+                    orig_class, name = name.rsplit('.', 1)
+                    if orig_class == cur_class[1]:
+                        orig_class = None
+                obf_range = (
+                    (int(obf_start), int(obf_end))
+                    if obf_start is not None
+                    else None
+                )
+                flags = 0
+                # Inlined frames share the obfuscated range of the entry before
+                # them (which is the inlinee).
+                if (
+                    obf_range is not None
+                    and prev_method is not None
+                    and prev_method[0] == obf_name
+                    and prev_method[1] == obf_range
+                ):
+                    flags |= _FLAG_INLINED_CALLER
+                prev_method = (obf_name, obf_range)
+                orig_start = _NO_LINE if orig_start is None else int(orig_start)
+                orig_end = orig_start if orig_end is None else int(orig_end)
+                cur_class[3].append(
+                    [
+                        obf_name,
+                        name,
+                        orig_class,
+                        [],
+                        flags,
+                        obf_range[0] if obf_range else _NO_LINE,
+                        obf_range[1] if obf_range else _NO_LINE,
+                        orig_start,
+                        orig_end,
+                    ]
+                )
+            elif m := _FIELD_LINE_RE.match(line):
+                cur_class[4].append((m.group(2), m.group(1)))
+                prev_method = None
+
+    @staticmethod
+    def _ParseMetadata(cur_class, cur_method, line):
+        """Applies a metadata comment to the class or the preceding method."""
+        try:
+            metadata = json.loads(line[1:])
+        except ValueError:
+            return
+        if not isinstance(metadata, dict):
+            return
+        metadata_id = metadata.get('id')
+        if metadata_id == 'sourceFile':
+            cur_class[2] = metadata.get('fileName')
+        elif cur_method is None:
+            return
+        elif metadata_id == _OUTLINE_ID:
+            cur_method[4] |= _FLAG_OUTLINE
+        elif metadata_id in (_OUTLINE_CALLSITE_ID, _REWRITE_FRAME_ID):
+            cur_method[3].append(metadata)
+
+    def Write(self, f, mapping_stat):
+        self._classes.sort(key=lambda c: c[0].encode('utf-8'))
+        class_records = []
+        method_records = []
+        field_records = []
+        for obf, orig, source_file, methods, fields in self._classes:
+            # Sort members by name while keeping the order of inlined frames.
+            methods.sort(key=lambda x: x[0].encode('utf-8'))
+            fields.sort(key=lambda x: x[0].encode('utf-8'))
+            class_records.append(
+                _CLASS.pack(
+                    self._Intern(obf),
+                    self._Intern(orig),
+                    self._Intern(source_file),
+                    len(method_records),
+                    len(methods),
+                    len(field_records),
+                    len(fields),
+                )
+            )
+            for obf_name, name, orig_class, metadata, *rest in methods:
+                method_records.append(
+                    _METHOD.pack(
+                        self._Intern(obf_name),
+                        self._Intern(name),
+                        self._Intern(orig_class),
+                        self._Intern(
+                            json.dumps(metadata, sort_keys=True)
+                            if metadata
+                            else None
+                        ),
+                        *rest,
+                    )
+                )
+            for obf_name, name in fields:
+                field_records.append(
+                    _FIELD.pack(self._Intern(obf_name), self._Intern(name))
+                )
+
+        encoded_strings = [s.encode('utf-8') for s in self._strings]
+        string_offsets = [0]
+        for s in encoded_strings:
+            string_offsets.append(string_offsets[-1] + len(s))
+        offsets_pos = _HEADER.size
+        blob_pos = offsets_pos + _STRING_OFFSET.size * len(string_offsets)
+        classes_pos = blob_pos + string_offsets[-1]
+        methods_pos = classes_pos + _CLASS.size * len(class_records)
+        fields_pos = methods_pos + _METHOD.size * len(method_records)
+        f.write(
+            _HEADER.pack(
+                _INDEX_MAGIC,
+                _INDEX_VERSION,
+                mapping_stat.st_size,
+                mapping_stat.st_mtime_ns,
+                len(encoded_strings),
+                len(class_records),
+                len(method_records),
+                len(field_records),
+                offsets_pos,
+                blob_pos,
+                classes_pos,
+                methods_pos,
+                fields_pos,
+            )
+        )
+        f.write(struct.pack(f'<{len(string_offsets)}I', *string_offsets))
+        f.writelines(encoded_strings)
+        f.writelines(class_records)
+        f.writelines(method_records)
+        f.writelines(field_records)
+
+
+class _Method:
+    """A method entry from the index."""
+
+    def __init__(self, record, index):
+        (
+            self.obf_name,
+            self.name,
+            self.orig_class,
+            self.metadata,
+            self.flags,
+            self.obf_start,
+            self.obf_end,
+            self.orig_start,
+            self.orig_end,
+        ) = record
+        self.name = index.String(self.name)
+        if self.orig_class != _NONE:
+            self.orig_class = index.String(self.orig_class)
+        else:
+            self.orig_class = None
+        if self.metadata != _NONE:
+            self.metadata = json.loads(index.String(self.metadata))
+        else:
+            self.metadata = []
+
+    @property
+    def has_range(self):
+        return self.obf_start != _NO_LINE
+
+    @property
+    def is_outline(self):
+        return bool(self.flags & _FLAG_OUTLINE)
+
+    def OutlineCallsiteLine(self, outline_line):
+        """Returns the line that a call to an outline maps to, or None.
+
+        Args:
+          outline_line: The obfuscated line of the outline's frame.
+        """
+        for metadata in self.metadata:
+            if metadata.get('id') != _OUTLINE_CALLSITE_ID:
+                continue
+            line = metadata.get('positions', {}).get(str(outline_line))
+            if line is not None:
+                return line
+        return None
+
+    def InnerFramesToRemove(self, thrown_class):
+        """Returns how many inlined frames to drop for an exception.
+
+        Args:
+          thrown_class: Obfuscated name of the exception the frame is the top
+              frame of, or None.
+        """
+        ret = 0
+        for metadata in self.metadata:
+            if metadata.get('id') != _REWRITE_FRAME_ID:
+                continue
+            if not all(
+                _ConditionHolds(c, thrown_class)
+                for c in metadata.get('conditions', [])
+            ):
+                continue
+            for action in metadata.get('actions', []):
+                if m := _REMOVE_INNER_FRAMES_RE.fullmatch(action):
+                    ret += int(m.group(1))
+        return ret
+
+    def MapLine(self, line):
+        """Returns the original line number for an obfuscated one."""
+        if line is None:
+            return None
+        if self.orig_start == _NO_LINE:
+            # No original line info means lines were not changed.
+            return line
+        if not self.has_range or self.orig_start == self.orig_end:
+            return self.orig_start
+        return self.orig_start + line - self.obf_start
+
+
+def _OutlineCallsiteLine(chains, outline_line):
+    for chain in chains:
+        for method in chain:
+            line = method.OutlineCallsiteLine(outline_line)
+            if line is not None:
+                return line
+    return None
+
+
+def _ConditionHolds(condition, thrown_class):
+    m = _THROWS_CONDITION_RE.fullmatch(condition)
+    if not m or thrown_class is None:
+        return False
+    return m.group(1) == 'L%s;' % thrown_class.replace('.', '/')
+
+
+class MappingIndex:
+    """Read-only, memory-mapped index of a .mapping file. Thread-safe."""
+
+    def __init__(self, index_path):
+        with open(index_path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self.mapping_size,
+            self.mapping_mtime_ns,
+            _,
+            self._num_classes,
+            _,
+            _,
+            self._offsets_pos,
+            self._blob_pos,
+            self._classes_pos,
+            self._methods_pos,
+            self._fields_pos,
+        ) = _HEADER.unpack_from(self._mm)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            raise ValueError(f'{index_path} is not a retrace index')
+        # Caching is per-instance, and functools caches are thread-safe.
+        self.String = functools.lru_cache(maxsize=65536)(self._String)
+        self.LookupClass = functools.lru_cache(maxsize=16384)(self._LookupClass)
+
+    @staticmethod
+    def Build(mapping_path, index_path):
+        """Parses |mapping_path| and writes its index to |index_path|."""
+        builder = _IndexBuilder()
+        mapping_stat = os.stat(mapping_path)
+        with open(mapping_path, encoding='utf-8') as f:
+            builder.Parse(f)
+        index_dir = os.path.dirname(index_path) or '.'
+        # Write atomically since other processes may be reading the index.
+        with tempfile.NamedTemporaryFile(
+            dir=index_dir, prefix=os.path.basename(index_path), delete=False
+        ) as f:
+            try:
+                builder.Write(f, mapping_stat)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, index_path)
+
+    @classmethod
+    def ForMapping(cls, mapping_path):
+        """Returns an index for |mapping_path|, building it if necessary."""
+        mapping_stat = os.stat(mapping_path)
+        # Fall back to the temp dir when the mapping's directory is read-only.
+        path_hash = hashlib.md5(
+            os.path.abspath(mapping_path).encode('utf-8')
+        ).hexdigest()
+        candidates = [
+            mapping_path + _INDEX_SUFFIX,
+            os.path.join(
+                tempfile.gettempdir(),
+                f'{os.path.basename(mapping_path)}.{path_hash}{_INDEX_SUFFIX}',
+            ),
+        ]
+        for index_path in candidates:
+            try:
+                index = cls(index_path)
+                if (
+                    index.mapping_size == mapping_stat.st_size
+                    and index.mapping_mtime_ns == mapping_stat.st_mtime_ns
+                ):
+                    return index
+                index.Close()
+            except (OSError, ValueError, struct.error):
+                pass
+        for index_path in candidates:
+            try:
+                cls.Build(mapping_path, index_path)
+            except OSError:
+                continue
+            return cls(index_path)
+        raise OSError(f'Could not write a retrace index for {mapping_path}')
+
+    def Close(self):
+        self._mm.close()
+
+    def _String(self, i):
+        start, end = struct.unpack_from(
+            '<2I', self._mm, self._offsets_pos + _STRING_OFFSET.size * i
+        )
+        return self._mm[self._blob_pos + start : self._blob_pos + end].decode(
+            'utf-8'
+        )
+
+    def _StringBytes(self, i):
+        start, end = struct.unpack_from(
+            '<2I', self._mm, self._offsets_pos + _STRING_OFFSET.size * i
+        )
+        return self._mm[self._blob_pos + start : self._blob_pos + end]
+
+    def _Bisect(self, target, lo, hi, pos, record_size):
+        """Returns the first index in [lo, hi) with name >= |target|."""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (name,) = struct.unpack_from(
+                '<I', self._mm, pos + record_size * mid
+            )
+            if self._StringBytes(name) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _LookupClass(self, obf_name):
+        """Returns the class record for |obf_name|, or None."""
+        target = obf_name.encode('utf-8')
+        i = self._Bisect(
+            target, 0, self._num_classes, self._classes_pos, _CLASS.size
+        )
+        if i == self._num_classes:
+            return None
+        record = _CLASS.unpack_from(
+            self._mm, self._classes_pos + _CLASS.size * i
+        )
+        if self._StringBytes(record[0]) != target:
+            return None
+        return record
+
+    def OriginalClassName(self, obf_name):
+        record = self.LookupClass(obf_name)
+        return self.String(record[1]) if record else None
+
+    def SourceFile(self, class_record):
+        if class_record[2] == _NONE:
+            return None
+        return self.String(class_record[2])
+
+    def Methods(self, class_record, obf_name):
+        """Returns the _Method entries for |obf_name|, in .mapping order."""
+        _, _, _, first, count, _, _ = class_record
+        target = obf_name.encode('utf-8')
+        i = self._Bisect(
+            target, first, first + count, self._methods_pos, _METHOD.size
+        )
+        ret = []
+        while i < first + count:
+            record = _METHOD.unpack_from(
+                self._mm, self._methods_pos + _METHOD.size * i
+            )
+            if self._StringBytes(record[0]) != target:
+                break
+            ret.append(_Method(record, self))
+            i += 1
+        return ret
+
+    def FieldName(self, class_record, obf_name):
+        """Returns the original name of a field, or None."""
+        _, _, _, _, _, first, count = class_record
+        target = obf_name.encode('utf-8')
+        i = self._Bisect(
+            target, first, first + count, self._fields_pos, _FIELD.size
+        )
+        if i == first + count:
+            return None
+        obf, orig = _FIELD.unpack_from(
+            self._mm, self._fields_pos + _FIELD.size * i
+        )
+        if self._StringBytes(obf) != target:
+            return None
+        return self.String(orig)
+
+
+def _CompileLineRegex():
+    """Returns the line regex, and a map of group name -> placeholder."""
+    group_kinds = {}
+
+    def replace(m):
+        kind = m.group(1)
+        name = f'{kind}{len(group_kinds)}'
+        group_kinds[name] = kind
+        return f'(?P<{name}>{_PLACEHOLDERS[kind]})'
+
+    pattern = re.sub(r'%([cCmfslta])', replace, _LINE_PARSE_REGEX)
+    return re.compile(pattern), group_kinds
+
+
+def _InferSourceFile(class_name, obfuscated_source_file):
+    """Returns the source file of a class, as R8 infers it."""
+    simple_name = class_name.rsplit('.', 1)[-1].split('$', 1)[0]
+    extension = 'java'
+    if obfuscated_source_file and obfuscated_source_file.endswith('.kt'):
+        extension = 'kt'
+    return f'{simple_name}.{extension}'
+
+
+class StackTraceContext:
+    """State carried from one line of a stack trace to the next.
+
+    Some mapping metadata depends on the surrounding lines: an outline's frame
+    rewrites the line of its caller's frame, and inlined null checks drop
+    frames only for the top frame of a NullPointerException.
+    """
+
+    def __init__(self):
+        # Obfuscated name of the exception that the next frame belongs to.
+        self.thrown_class = None
+        # Obfuscated line of the outline frame that precedes the next frame.
+        self.outline_line = None
+
+
+class Retracer:
+    """Deobfuscates lines of logcat / stack traces. Thread-safe."""
+
+    def __init__(self, mapping_path):
+        self._index = MappingIndex.ForMapping(mapping_path)
+        self._line_re, self._group_kinds = _CompileLineRegex()
+
+    def Close(self):
+        self._index.Close()
+
+    def _RetraceType(self, type_name):
+        base = type_name.rstrip('[]')
+        if base in _PRIMITIVE_TYPES:
+            return type_name
+        orig = self._index.OriginalClassName(base)
+        return type_name if orig is None else orig + type_name[len(base) :]
+
+    def _RetraceArgs(self, args):
+        return re.sub(_TYPE, lambda m: self._RetraceType(m.group(0)), args)
+
+    def _Chains(self, class_record, method_name, line):
+        """Returns the chains of inlined methods that |line| may belong to."""
+        methods = self._index.Methods(class_record, method_name)
+        # Group inlined frames into chains.
+        chains = []
+        for method in methods:
+            if method.flags & _FLAG_INLINED_CALLER and chains:
+                chains[-1].append(method)
+            else:
+                chains.append([method])
+
+        if line is None:
+            return chains
+        candidates = [
+            c
+            for c in chains
+            if c[0].has_range and c[0].obf_start <= line <= c[0].obf_end
+        ]
+        if not candidates:
+            candidates = [c for c in chains if not c[0].has_range]
+        return candidates or chains
+
+    def _Frames(self, class_record, chains, line, thrown_class):
+        """Returns a list of alternatives, each a list of (class, method, line).
+
+        Each alternative lists inlined frames, innermost first.
+        """
+        orig_class = self._index.String(class_record[1])
+        ret = []
+        for chain in chains:
+            frames = []
+            num_removed = sum(
+                m.InnerFramesToRemove(thrown_class) for m in chain
+            )
+            for method in chain[num_removed:]:
+                frames.append(
+                    (
+                        method.orig_class or orig_class,
+                        method.name,
+                        method.MapLine(line),
+                    )
+                )
+            if frames not in ret:
+                ret.append(frames)
+        if line is None:
+            # Distinct overloads retrace to the same name.
+            deduped = []
+            for frames in ret:
+                key = [(c, m) for c, m, _ in frames]
+                if key not in [[(c, m) for c, m, _ in d] for d in deduped]:
+                    deduped.append(frames)
+            ret = deduped
+        return ret
+
+    def RetraceLine(self, line, context=None):
+        """Returns the deobfuscated line(s) for |line|.
+
+        Args:
+          line: The line to deobfuscate, without a trailing newline.
+          context: The StackTraceContext of the preceding lines, which is
+              updated for the lines that follow. Must be passed for all lines
+              of a stack trace for mapping metadata to be applied.
+        """
+        if context is None:
+            context = StackTraceContext()
+        m = self._line_re.fullmatch(line)
+        if not m:
+            return [line]
+        groups = {
+            name: m.span(name)
+            for name in self._group_kinds
+            if m.group(name) is not None
+        }
+        if not groups:
+            return [line]
+        by_kind = {}
+        for name in groups:
+            by_kind.setdefault(self._group_kinds[name], name)
+
+        class_record = None
+        class_group = by_kind.get('c') or by_kind.get('C')
+        if class_group:
+            obf_class = m.group(class_group)
+            if self._group_kinds[class_group] == 'C':
+                obf_class = obf_class.replace('/', '.')
+            class_record = self._index.LookupClass(obf_class)
+
+        # Replacements that are the same for all alternatives.
+        replacements = {}
+        for name in groups:
+            kind = self._group_kinds[name]
+            value = m.group(name)
+            if kind == 't':
+                replacements[name] = self._RetraceType(value)
+            elif kind == 'a':
+                replacements[name] = self._RetraceArgs(value)
+            elif class_record is None:
+                continue
+            elif kind == 'f':
+                field_name = self._index.FieldName(class_record, value)
+                if field_name is not None:
+                    replacements[name] = field_name
+            elif kind == 'C':
+                replacements[name] = self._index.String(
+                    class_record[1]
+                ).replace('.', '/')
+            elif kind == 'c':
+                replacements[name] = self._index.String(class_record[1])
+
+        method_group = by_kind.get('m')
+        thrown_class = context.thrown_class
+        outline_line = context.outline_line
+        context.thrown_class = None
+        context.outline_line = None
+        if class_group and not method_group and not by_kind.get('f'):
+            # Like R8, treat a lone class name as the exception of the frames
+            # that follow.
+            context.thrown_class = obf_class
+
+        if class_record is not None and method_group:
+            line_group = by_kind.get('l')
+            line_number = int(m.group(line_group)) if line_group else None
+            source_group = by_kind.get('s')
+            method_name = m.group(method_group)
+            chains = self._Chains(class_record, method_name, line_number)
+            if line_number is not None and chains:
+                if all(any(x.is_outline for x in c) for c in chains):
+                    # Outline frames are dropped, and their line selects the
+                    # position of the call in the caller's frame.
+                    context.outline_line = line_number
+                    return []
+                if outline_line is not None:
+                    callsite_line = _OutlineCallsiteLine(chains, outline_line)
+                    if callsite_line is not None:
+                        line_number = callsite_line
+                        chains = self._Chains(
+                            class_record, method_name, line_number
+                        )
+            alternatives = []
+            frames_list = self._Frames(
+                class_record, chains, line_number, thrown_class
+            )
+            for frames in frames_list:
+                lines = []
+                for frame_class, frame_method, frame_line in frames:
+                    r = dict(replacements)
+                    r[class_group] = frame_class
+                    r[method_group] = frame_method
+                    if line_group and frame_line is not None:
+                        r[line_group] = str(frame_line)
+                    if source_group:
+                        source_file = None
+                        if frame_class == self._index.String(class_record[1]):
+                            source_file = self._index.SourceFile(class_record)
+                        r[source_group] = source_file or _InferSourceFile(
+                            frame_class, m.group(source_group)
+                        )
+                    lines.append(r)
+                alternatives.append(lines)
+            if not alternatives:
+                alternatives = [[replacements]]
+        else:
+            alternatives = [[replacements]]
+
+        ret = []
+        for i, frames in enumerate(alternatives):
+            for r in frames:
+                new_line = _Substitute(line, groups, r)
+                if i > 0:
+                    # Mark ambiguous results the way R8's retrace does.
+                    indent = len(new_line) - len(new_line.lstrip())
+                    new_line = new_line[:indent] + '<OR> ' + new_line[indent:]
+                ret.append(new_line)
+        return ret
+
+    def TransformLines(self, lines):
+        """Deobfuscates lines (without trailing newlines).
+
+        May return more lines than given when frames were inlined or are
+        ambiguous.
+        """
+        ret = []
+        context = StackTraceContext()
+        for line in lines:
+            ret.extend(self.RetraceLine(line, context))
+        return ret
+
+
+def _Substitute(line, groups, replacements):
+    # Replace from right to left so that spans remain valid.
+    for name, (start, end) in sorted(
+        groups.items(), key=lambda x: x[1][0], reverse=True
+    ):
+        if name in replacements:
+            line = line[:start] + replacements[name] + line[end:]
+    return line
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1].startswith('-'):
+        sys.stderr.write(
+            'Usage: retrace.py Foo.apk.mapping < foo.log\n'
+            'Note: Deobfuscation of symbols outside the context of stack '
+            'traces will work only when lines match the regular expression '
+            'defined in FlushingReTrace.java.\n'
+        )
+        sys.exit(1)
+    retracer = Retracer(sys.argv[1])
+    context = StackTraceContext()
+    # Flush after each line (like FlushingReTrace) so that this can be used
+    # as a filter on streaming output.
+    for line in sys.stdin:
+        for out_line in retracer.RetraceLine(line.rstrip('\n'), context):
+            sys.stdout.write(out_line + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env vpython3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Tests for retrace.py."""
+
+import concurrent.futures
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from unittest import mock
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+)
+from pylib.symbols import retrace
+
+_TESTDATA_DIR = os.path.join(os.path.dirname(__file__), 'testdata')
+_SRC_ROOT = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', '..', '..')
+)
+_JAVA_DEOBFUSCATE_PATH = os.path.join(
+    _SRC_ROOT, 'build', 'android', 'stacktrace', 'java_deobfuscate.py'
+)
+_JAVA_PATH = os.path.join(
+    _SRC_ROOT, 'third_party', 'jdk', 'current', 'bin', 'java'
+)
+_R8_JAR_PATH = os.path.join(
+    _SRC_ROOT, 'third_party', 'r8', 'cipd', 'lib', 'r8.jar'
+)
+
+_TEST_MAP = textwrap.dedent("""\
+    # compiler: R8
+    this.was.Deobfuscated -> FOO:
+        int[] mFontFamily -> a
+        1:3:void someMethod(int,android.os.Bundle):65:67 -> bar
+        4:4:void org.other.Inlinee.inner():12:12 -> bar
+        4:4:void caller():70 -> bar
+        5:5:void first():10 -> baz
+        6:6:void second():20 -> baz
+        void noLines() -> qux
+    org.kotlin.Foo$Inner -> a.b:
+    # {"id":"sourceFile","fileName":"Foo.kt"}
+        1:1:void run():5 -> c
+    """)
+
+
+class RetracerTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._mapping_path = os.path.join(self._tmp_dir.name, 'a.mapping')
+        with open(self._mapping_path, 'w') as f:
+            f.write(_TEST_MAP)
+        self._retracer = retrace.Retracer(self._mapping_path)
+
+    def tearDown(self):
+        self._retracer.Close()
+        self._tmp_dir.cleanup()
+
+    def _Retrace(self, line):
+        return self._retracer.TransformLines([line])
+
+    def testFrame(self):
+        self.assertEqual(
+            self._Retrace('\tat FOO.bar(PG:2)'),
+            ['\tat this.was.Deobfuscated.someMethod(Deobfuscated.java:66)'],
+        )
+        # Unknown classes and lines that do not match are left as is.
+        self.assertEqual(
+            self._Retrace('\tat BAR.bar(PG:2)'), ['\tat BAR.bar(PG:2)']
+        )
+        self.assertEqual(self._Retrace('Here is a FOO'), ['Here is a FOO'])
+
+    def testInlinedFrames(self):
+        self.assertEqual(
+            self._Retrace('\tat FOO.bar(PG:4)'),
+            [
+                '\tat org.other.Inlinee.inner(Inlinee.java:12)',
+                '\tat this.was.Deobfuscated.caller(Deobfuscated.java:70)',
+            ],
+        )
+
+    def testAmbiguous(self):
+        self.assertEqual(
+            self._Retrace('\tat FOO.baz(PG:5)'),
+            ['\tat this.was.Deobfuscated.first(Deobfuscated.java:10)'],
+        )
+        self.assertEqual(
+            self._Retrace('\tat FOO.baz(PG:9)'),
+            [
+                '\tat this.was.Deobfuscated.first(Deobfuscated.java:10)',
+                '\t<OR> at this.was.Deobfuscated.second(Deobfuscated.java:20)',
+            ],
+        )
+
+    def testNoLineInfo(self):
+        self.assertEqual(
+            self._Retrace('\tat FOO.qux(PG:7)'),
+            ['\tat this.was.Deobfuscated.noLines(Deobfuscated.java:7)'],
+        )
+
+    def testSourceFileMetadata(self):
+        self.assertEqual(
+            self._Retrace('\tat a.b.c(SourceFile:1)'),
+            ['\tat org.kotlin.Foo$Inner.run(Foo.kt:5)'],
+        )
+
+    def testFieldsAndTypes(self):
+        self.assertEqual(
+            self._Retrace(
+                'java.lang.NullPointerException: Attempt to read from field '
+                "'int[] FOO.a' on a null object reference"
+            ),
+            [
+                'java.lang.NullPointerException: Attempt to read from field '
+                "'int[] this.was.Deobfuscated.mFontFamily' on a null object "
+                'reference'
+            ],
+        )
+        self.assertEqual(
+            self._Retrace(
+                'java.lang.NoSuchFieldError: No instance field a of type '
+                'Ljava/lang/Object; in class LFOO;'
+            ),
+            [
+                'java.lang.NoSuchFieldError: No instance field mFontFamily of '
+                'type Ljava/lang/Object; in class Lthis/was/Deobfuscated;'
+            ],
+        )
+
+    def testThreadSafe(self):
+        lines = ['\tat FOO.bar(PG:%d)' % (i % 6) for i in range(2000)]
+        expected = [self._Retrace(l) for l in lines]
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            actual = list(executor.map(self._Retrace, lines))
+        self.assertEqual(actual, expected)
+
+    def testIndexIsReused(self):
+        with mock.patch.object(
+            retrace.MappingIndex, 'Build', wraps=retrace.MappingIndex.Build
+        ) as build_mock:
+            retrace.Retracer(self._mapping_path).Close()
+            self.assertEqual(build_mock.call_count, 0)
+            with open(self._mapping_path, 'a') as f:
+                f.write('NEW -> c:\n')
+            retracer = retrace.Retracer(self._mapping_path)
+            self.assertEqual(build_mock.call_count, 1)
+        self.assertEqual(retracer.TransformLines(['c']), ['NEW'])
+        retracer.Close()
+
+
+class RetracerGoldenTest(unittest.TestCase):
+    def setUp(self):
+        # Retracer writes its index next to the mapping.
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._mapping_path = os.path.join(self._tmp_dir.name, 'golden.mapping')
+        shutil.copyfile(
+            os.path.join(_TESTDATA_DIR, 'golden.mapping'), self._mapping_path
+        )
+        self._retracer = retrace.Retracer(self._mapping_path)
+        with open(os.path.join(_TESTDATA_DIR, 'golden_input.txt')) as f:
+            self._input = f.read().splitlines()
+        with open(os.path.join(_TESTDATA_DIR, 'golden_expected.txt')) as f:
+            self._expected = f.read().splitlines()
+
+    def tearDown(self):
+        self._retracer.Close()
+        self._tmp_dir.cleanup()
+
+    def testGolden(self):
+        self.assertEqual(
+            self._retracer.TransformLines(self._input), self._expected
+        )
+
+    def testContextIsPerCall(self):
+        # Each call is a separate stack trace.
+        self.assertEqual(
+            self._retracer.TransformLines(
+                ['java.lang.NullPointerException: x']
+            ),
+            ['java.lang.NullPointerException: x'],
+        )
+        self.assertEqual(
+            self._retracer.TransformLines(['\tat c.a(SourceFile:4)']),
+            [
+                '\tat other.Class.inlinee(Class.java:23)',
+                '\tat foo.Bar.caller(Bar.java:7)',
+            ],
+        )
+
+    @unittest.skipUnless(
+        os.path.exists(_JAVA_PATH) and os.path.exists(_R8_JAR_PATH),
+        'Requires the JDK and R8 from a Chromium checkout.',
+    )
+    def testMatchesJavaDeobfuscate(self):
+        proc = subprocess.run(
+            [sys.executable, _JAVA_DEOBFUSCATE_PATH, self._mapping_path],
+            input=''.join(l + '\n' for l in self._input),
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(proc.stdout.splitlines(), self._expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env vpython3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Historical test durations, and shard planning based on them.
+
+Example usage:
+  # Record the durations from the results of previous runs.
+  test_timings.py update timings.json out/results1.json out/results2.json
+
+  # Compare the predicted makespan of hash and duration-based sharding.
+  test_timings.py simulate timings.json --shards 10 --tests-file tests.txt
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import tempfile
+
+# Weight of the most recent observation when updating a test's duration.
+_DECAY = 0.5
+
+
+def DeterministicHash(test_name):
+    """Return the deterministic hash for a test name, as an integer."""
+    assert isinstance(test_name, str), 'Expecting a string.'
+    hash_bytes = hashlib.sha256(test_name.encode('utf-8')).digest()
+    # To speed thing up, only take the last 3 bytes
+    return int.from_bytes(hash_bytes[-3:], byteorder='big')
+
+
+class TestTimingDatabase:
+    """Maps test names to their typical duration, in milliseconds."""
+
+    def __init__(self, durations=None):
+        self._durations = dict(durations or {})
+        self._default_duration = None
+
+    @classmethod
+    def Load(cls, path):
+        """Loads a database written by Save(), or an empty one if missing."""
+        if not os.path.exists(path):
+            logging.warning('Test timing database %s does not exist.', path)
+            return cls()
+        with open(path) as f:
+            return cls(json.load(f)['durations'])
+
+    def Save(self, path):
+        dirname = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(
+            'w', dir=dirname, suffix='.tmp', delete=False
+        ) as f:
+            json.dump({'durations': self._durations}, f, sort_keys=True)
+        os.replace(f.name, path)
+
+    def AddResults(self, json_results):
+        """Records durations from a dict created by GenerateJsonResultsFile.
+
+        A test's duration is a moving average that favors recent runs, so that
+        the database follows tests becoming faster or slower.
+        """
+        observed = {}
+        for iteration_data in json_results['per_iteration_data']:
+            for test, test_runs in iteration_data.items():
+                for run in test_runs:
+                    elapsed = run.get('elapsed_time_ms')
+                    if elapsed is not None:
+                        # Retries are just as slow, so keep the longest run.
+                        observed[test] = max(observed.get(test, 0), elapsed)
+        for test, elapsed in observed.items():
+            previous = self._durations.get(test)
+            if previous is not None:
+                elapsed = _DECAY * elapsed + (1 - _DECAY) * previous
+            self._durations[test] = elapsed
+        self._default_duration = None
+
+    def GetDuration(self, test_name):
+        """Returns the duration of a test in milliseconds, or None."""
+        return self._durations.get(test_name)
+
+    def GetDefaultDuration(self):
+        """Returns the duration to assume for unknown tests."""
+        if self._default_duration is None:
+            self._default_duration = (
+                statistics.median(self._durations.values())
+                if self._durations
+                else 0
+            )
+        return self._default_duration
+
+    def __len__(self):
+        return len(self._durations)
+
+
+def PlanShards(items, num_shards, get_duration, get_hash, default_duration=0):
+    """Splits items into shards using the longest-processing-time-first rule.
+
+    Items with a known duration are assigned, longest first, to the shard with
+    the least work so far. Items without one are assigned by hash, as they
+    would be without a timing database, and count as |default_duration|.
+
+    The result only depends on the arguments, so every external shard computes
+    the same plan.
+
+    Args:
+      items: List of items (tests or test groups).
+      num_shards: Number of shards.
+      get_duration: Returns the duration of an item, or None if unknown.
+      get_hash: Returns a deterministic hash of an item.
+      default_duration: Duration to assume for items of unknown duration.
+
+    Returns:
+      A list of |num_shards| lists of items. Items keep their relative order.
+    """
+    shards = [[] for _ in range(num_shards)]
+    loads = [0] * num_shards
+    known = []
+    for i, item in enumerate(items):
+        duration = get_duration(item)
+        if duration is None:
+            shard_index = get_hash(item) % num_shards
+            shards[shard_index].append((i, item))
+            loads[shard_index] += default_duration
+        else:
+            known.append((-duration, i, item))
+    known.sort(key=lambda x: x[:2])
+
+    heap = [(load, shard_index) for shard_index, load in enumerate(loads)]
+    heapq.heapify(heap)
+    for neg_duration, i, item in known:
+        load, shard_index = heapq.heappop(heap)
+        shards[shard_index].append((i, item))
+        heapq.heappush(heap, (load - neg_duration, shard_index))
+
+    return [[item for _, item in sorted(shard)] for shard in shards]
+
+
+def PlanBatches(items, num_workers, max_batch_size, get_duration):
+    """Splits items into batches of similar duration.
+
+    Creates enough batches to give every worker one, and to keep each within
+    |max_batch_size| items. Batches are returned longest first, so that the
+    slowest ones start first when workers pull them from a shared queue.
+
+    Args:
+      items: List of items (tests or test groups).
+      num_workers: Number of workers (e.g. devices) running the batches.
+      max_batch_size: Maximum number of items in a batch.
+      get_duration: Returns the (possibly estimated) duration of an item.
+
+    Returns:
+      A list of batches, each a list of items.
+    """
+    if not items:
+        return []
+    num_batches = max(
+        min(num_workers, len(items)), math.ceil(len(items) / max_batch_size)
+    )
+    durations = [get_duration(item) for item in items]
+    batches = [[] for _ in range(num_batches)]
+    heap = [(0, batch_index) for batch_index in range(num_batches)]
+    for i in sorted(range(len(items)), key=lambda i: -durations[i]):
+        load, batch_index = heapq.heappop(heap)
+        batch = batches[batch_index]
+        batch.append(i)
+        if len(batch) < max_batch_size:
+            heapq.heappush(heap, (load + durations[i], batch_index))
+    # Keep the original order within batches, but start the longest first.
+    batches = [sorted(batch) for batch in batches if batch]
+    batches.sort(key=lambda batch: -sum(durations[i] for i in batch))
+    return [[items[i] for i in batch] for batch in batches]
+
+
+def SimulateMakespan(durations, num_workers):
+    """Returns the predicted wall time of running jobs on workers.
+
+    Jobs are pulled in order from a shared queue by whichever worker is idle,
+    as done by test_collection.TestCollection.
+
+    Args:
+      durations: Durations of the jobs, in queue order.
+      num_workers: Number of workers.
+    """
+    finish_times = [0] * max(1, num_workers)
+    for duration in durations:
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
+
+
+def _Update(args):
+    db = TestTimingDatabase.Load(args.db)
+    for path in args.json_results:
+        with open(path) as f:
+            db.AddResults(json.load(f))
+    db.Save(args.db)
+    print('Recorded durations of %d tests.' % len(db))
+
+
+def _Simulate(args):
+    db = TestTimingDatabase.Load(args.db)
+    with open(args.tests_file) as f:
+        tests = [l.strip() for l in f if l.strip()]
+    default_duration = db.GetDefaultDuration()
+
+    def estimate(test):
+        duration = db.GetDuration(test)
+        return default_duration if duration is None else duration
+
+    hashed = [[] for _ in range(args.shards)]
+    for test in tests:
+        hashed[DeterministicHash(test) % args.shards].append(test)
+    planned = PlanShards(
+        tests, args.shards, db.GetDuration, DeterministicHash, default_duration
+    )
+    unknown = sum(1 for t in tests if db.GetDuration(t) is None)
+    print(
+        '%d tests (%d without timings), %d shards'
+        % (len(tests), unknown, args.shards)
+    )
+    for name, shards in (('hash', hashed), ('duration', planned)):
+        shard_durations = [sum(map(estimate, s)) for s in shards]
+        print(
+            '%-8s sharding: makespan %.1fs (shortest shard %.1fs)'
+            % (
+                name,
+                SimulateMakespan(shard_durations, args.shards) / 1000,
+                min(shard_durations) / 1000,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update_parser = subparsers.add_parser(
+        'update', help='Record test durations from --json-results-file files.'
+    )
+    update_parser.add_argument('db', help='Path to the timing database.')
+    update_parser.add_argument('json_results', nargs='+')
+    update_parser.set_defaults(func=_Update)
+
+    simulate_parser = subparsers.add_parser(
+        'simulate', help='Report the predicted makespan of external shards.'
+    )
+    simulate_parser.add_argument('db', help='Path to the timing database.')
+    simulate_parser.add_argument('--shards', type=int, required=True)
+    simulate_parser.add_argument(
+        '--tests-file',
+        required=True,
+        help='File listing a test name per line.',
+    )
+    simulate_parser.set_defaults(func=_Simulate)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
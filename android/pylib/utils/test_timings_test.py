@@ -0,0 +1,87 @@
+#!/usr/bin/env vpython3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Unit tests for test_timings.py."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+)
+from pylib.utils import test_timings
+
+
+def _JsonResults(durations_by_test):
+    return {
+        'per_iteration_data': [
+            {
+                test: [{'status': 'SUCCESS', 'elapsed_time_ms': duration}]
+                for test, duration in durations_by_test.items()
+            }
+        ]
+    }
+
+
+class TestTimingDatabaseTest(unittest.TestCase):
+    def testAddResults(self):
+        db = test_timings.TestTimingDatabase()
+        db.AddResults(_JsonResults({'A.a': 100, 'A.b': None}))
+        self.assertEqual(db.GetDuration('A.a'), 100)
+        self.assertIsNone(db.GetDuration('A.b'))
+        db.AddResults(_JsonResults({'A.a': 300, 'A.c': 10}))
+        self.assertEqual(db.GetDuration('A.a'), 200)
+        self.assertEqual(db.GetDefaultDuration(), 105)
+
+    def testSaveAndLoad(self):
+        db = test_timings.TestTimingDatabase({'A.a': 100})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'timings.json')
+            self.assertEqual(len(test_timings.TestTimingDatabase.Load(path)), 0)
+            db.Save(path)
+            loaded = test_timings.TestTimingDatabase.Load(path)
+        self.assertEqual(loaded.GetDuration('A.a'), 100)
+
+
+class PlanShardsTest(unittest.TestCase):
+    def testBalancesKnownDurations(self):
+        durations = {'a': 8, 'b': 7, 'c': 6, 'd': 5, 'e': 4}
+        shards = test_timings.PlanShards(
+            list(durations), 2, durations.get, lambda _: 0
+        )
+        self.assertEqual(shards, [['a', 'd', 'e'], ['b', 'c']])
+
+    def testUnknownTestsAreHashed(self):
+        durations = {'a': 1}
+        shards = test_timings.PlanShards(
+            ['a', 'x', 'y'], 3, durations.get, {'x': 4, 'y': 5}.get, 10
+        )
+        self.assertEqual(shards, [['a'], ['x'], ['y']])
+
+
+class PlanBatchesTest(unittest.TestCase):
+    def testBatches(self):
+        durations = {'a': 1, 'b': 9, 'c': 5, 'd': 5, 'e': 1}
+        batches = test_timings.PlanBatches(list(durations), 2, 3, durations.get)
+        self.assertEqual(batches, [['a', 'b', 'e'], ['c', 'd']])
+
+    def testRespectsMaxBatchSize(self):
+        tests = [str(i) for i in range(10)]
+        batches = test_timings.PlanBatches(tests, 1, 3, lambda _: 1)
+        self.assertEqual(len(batches), 4)
+        self.assertTrue(all(len(b) <= 3 for b in batches))
+        self.assertEqual(sorted(sum(batches, [])), tests)
+
+
+class SimulateMakespanTest(unittest.TestCase):
+    def testSimulateMakespan(self):
+        self.assertEqual(test_timings.SimulateMakespan([], 2), 0)
+        self.assertEqual(test_timings.SimulateMakespan([5, 3, 3], 2), 6)
+        self.assertEqual(test_timings.SimulateMakespan([3, 3, 5], 2), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
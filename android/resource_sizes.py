@@ -9,7 +9,9 @@ More information at //docs/speed/binary_size/metrics.md.
 
 import argparse
 import collections
-from contextlib import contextmanager
+import concurrent.futures
+import functools
+import hashlib
 import json
 import logging
 import os
@@ -18,6 +20,7 @@ import re
 import struct
 import sys
 import tempfile
+import threading
 import zipfile
 import zlib
 
@@ -53,6 +56,9 @@ with host_paths.SysPath(host_paths.TRACING_PATH):
 with host_paths.SysPath(_ANDROID_UTILS_PATH, 0):
     from util import build_utils  # pylint: disable=import-error
 
+with host_paths.SysPath(host_paths.BUILD_PATH):
+    import zip_helpers
+
 _BASE_CHART = {
     'format_version': '0.1',
     'benchmark_name': 'resource_sizes',
@@ -217,30 +223,48 @@ def _RunReadobj(so_path, options):
     )
 
 
-def _ExtractLibSectionSizesFromApk(apk_path, lib_path):
-    with Unzip(apk_path, filename=lib_path) as extracted_lib_path:
-        grouped_section_sizes = collections.defaultdict(int)
-        no_bits_section_sizes, section_sizes = _CreateSectionNameSizeMap(
-            extracted_lib_path
-        )
-        for group_name, section_names in _READELF_SIZES_METRICS.items():
-            for section_name in section_names:
-                if section_name in section_sizes:
-                    grouped_section_sizes[group_name] += section_sizes.pop(
-                        section_name
-                    )
+# Map of .so sha256 -> grouped section sizes. The same libraries appear in
+# several splits (and in both trichrome and non-trichrome inputs).
+_lib_section_sizes_cache = {}
+_lib_section_sizes_cache_lock = threading.Lock()
+
+
+def _ExtractLibSectionSizesFromApk(apk, lib_path):
+    lib_data = apk.read(lib_path)
+    key = hashlib.sha256(lib_data).digest()
+    with _lib_section_sizes_cache_lock:
+        grouped_section_sizes = _lib_section_sizes_cache.get(key)
+    if grouped_section_sizes is None:
+        grouped_section_sizes = _ComputeLibSectionSizes(lib_data)
+        with _lib_section_sizes_cache_lock:
+            _lib_section_sizes_cache[key] = grouped_section_sizes
+    return grouped_section_sizes.copy()
+
+
+def _ComputeLibSectionSizes(lib_data):
+    # llvm-readobj needs a file.
+    with tempfile.NamedTemporaryFile(suffix='.so') as f:
+        f.write(lib_data)
+        f.flush()
+        no_bits_section_sizes, section_sizes = _CreateSectionNameSizeMap(f.name)
+
+    grouped_section_sizes = collections.defaultdict(int)
+    for group_name, section_names in _READELF_SIZES_METRICS.items():
+        for section_name in section_names:
+            if section_name in section_sizes:
+                grouped_section_sizes[group_name] += section_sizes.pop(
+                    section_name
+                )
 
-        # Consider all NOBITS sections as .bss.
-        grouped_section_sizes['bss'] = sum(no_bits_section_sizes.values())
+    # Consider all NOBITS sections as .bss.
+    grouped_section_sizes['bss'] = sum(no_bits_section_sizes.values())
 
-        # Group any unknown section headers into the "other" group.
-        for section_header, section_size in section_sizes.items():
-            sys.stderr.write(
-                'Unknown elf section header: %s\n' % section_header
-            )
-            grouped_section_sizes['other'] += section_size
+    # Group any unknown section headers into the "other" group.
+    for section_header, section_size in section_sizes.items():
+        sys.stderr.write('Unknown elf section header: %s\n' % section_header)
+        grouped_section_sizes['other'] += section_size
 
-        return grouped_section_sizes
+    return grouped_section_sizes
 
 
 def _CreateSectionNameSizeMap(so_path):
@@ -258,6 +282,18 @@ def _CreateSectionNameSizeMap(so_path):
     return no_bits_section_sizes, section_sizes
 
 
+def _ParseSplitManifestAttributes(split_zip):
+    """Like _ParseManifestAttributes(), but for a split within an .apks."""
+    # aapt needs an .apk file, but only the manifest is read from it.
+    with tempfile.NamedTemporaryFile(suffix='.apk') as f:
+        with zipfile.ZipFile(f, 'w') as manifest_zip:
+            manifest_zip.writestr(
+                'AndroidManifest.xml', split_zip.read('AndroidManifest.xml')
+            )
+        f.flush()
+        return _ParseManifestAttributes(f.name)
+
+
 def _ParseManifestAttributes(apk_path):
     # Parses minSdkVersion and on-demand module attributes from the manifest.
     output = cmd_helper.GetCmdOutput(
@@ -341,15 +377,27 @@ def _AnalyzeInternal(
     apk_path,
     sdk_version,
     report_func,
-    dex_stats_collector,
     apks_path=None,
     split_name=None,
+    open_apk=None,
 ):
     """Analyse APK to determine size contributions of different file classes.
 
+    Does not collect dex stats (see method_count.DexStatsCollector).
+
+    Args:
+      apk_path: Path to the .apk (or to the split within |apks_path|).
+      sdk_version: minSdkVersion of the .apk.
+      report_func: Called with each metric.
+      apks_path: Path to the .apks, if analyzing a split within one.
+      split_name: Name of the split.
+      open_apk: Returns a new file object for the .apk. Opens |apk_path| if
+        not given.
+
     Returns: Normalized APK size.
     """
-    dex_stats_collector.CollectFromZip(split_name or '', apk_path)
+    if open_apk is None:
+        open_apk = functools.partial(open, apk_path, 'rb')
     file_groups = []
 
     def make_group(name):
@@ -376,7 +424,8 @@ def _AnalyzeInternal(
     assets = make_group('Other Android Assets')
     unknown = make_group('Unknown files')
 
-    with zipfile.ZipFile(apk_path, 'r') as apk:
+    with open_apk() as apk_file, zipfile.ZipFile(apk_file) as apk:
+        apk_size = apk_file.seek(0, os.SEEK_END)
         apk_contents = apk.infolist()
         # Account for zipalign overhead that exists in local file header.
         zipalign_overhead = sum(
@@ -422,7 +471,7 @@ def _AnalyzeInternal(
         # Oreo and above, compilation_filter=speed-profile
         dex_multiplier = speed_profile_dex_multiplier
 
-    total_apk_size = os.path.getsize(apk_path)
+    total_apk_size = apk_size
     for member in apk_contents:
         filename = member.filename
         # Undo asset path suffixing. https://crbug.com/357131361
@@ -566,7 +615,8 @@ def _AnalyzeInternal(
         int(total_install_size_android_go),
         'bytes',
     )
-    transfer_size = _CalculateCompressedSize(apk_path)
+    with open_apk() as apk_file:
+        transfer_size = _CalculateCompressedSize(apk_file)
     report_func(
         'TransferSize', 'Transfer size (deflate)', transfer_size, 'bytes'
     )
@@ -581,27 +631,32 @@ def _AnalyzeInternal(
 
     main_lib_info = native_code.FindLargest()
     native_code_unaligned_size = 0
-    for lib_info in native_code.AllEntries():
-        # Skip placeholders.
-        if lib_info.file_size == 0:
-            continue
-        section_sizes = _ExtractLibSectionSizesFromApk(
-            apk_path, lib_info.filename
-        )
-        native_code_unaligned_size += sum(
-            v for k, v in section_sizes.items() if k not in ('bss', 'tbss')
-        )
-        # Size of main .so vs remaining.
-        if lib_info == main_lib_info:
-            main_lib_size = lib_info.file_size
-            report_func('Specifics', 'main lib size', main_lib_size, 'bytes')
-            secondary_size = (
-                native_code.ComputeUncompressedSize() - main_lib_size
+    with open_apk() as apk_file, zipfile.ZipFile(apk_file) as apk:
+        for lib_info in native_code.AllEntries():
+            # Skip placeholders.
+            if lib_info.file_size == 0:
+                continue
+            section_sizes = _ExtractLibSectionSizesFromApk(
+                apk, lib_info.filename
+            )
+            native_code_unaligned_size += sum(
+                v for k, v in section_sizes.items() if k not in ('bss', 'tbss')
             )
-            report_func('Specifics', 'other lib size', secondary_size, 'bytes')
+            # Size of main .so vs remaining.
+            if lib_info == main_lib_info:
+                main_lib_size = lib_info.file_size
+                report_func(
+                    'Specifics', 'main lib size', main_lib_size, 'bytes'
+                )
+                secondary_size = (
+                    native_code.ComputeUncompressedSize() - main_lib_size
+                )
+                report_func(
+                    'Specifics', 'other lib size', secondary_size, 'bytes'
+                )
 
-            for metric_name, size in section_sizes.items():
-                report_func('MainLibInfo', metric_name, size, 'bytes')
+                for metric_name, size in section_sizes.items():
+                    report_func('MainLibInfo', metric_name, size, 'bytes')
 
     # Main metric that we want to monitor for jumps.
     normalized_apk_size = total_apk_size
@@ -686,29 +741,16 @@ def _AnalyzeInternal(
     return normalized_apk_size
 
 
-def _CalculateCompressedSize(file_path):
+def _CalculateCompressedSize(f):
     CHUNK_SIZE = 256 * 1024
     compressor = zlib.compressobj()
     total_size = 0
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
-            total_size += len(compressor.compress(chunk))
+    while chunk := f.read(CHUNK_SIZE):
+        total_size += len(compressor.compress(chunk))
     total_size += len(compressor.flush())
     return total_size
 
 
-@contextmanager
-def Unzip(zip_file, filename=None):
-    """Utility for temporary use of a single file in a zip archive."""
-    with build_utils.TempDir() as unzipped_dir:
-        unzipped_files = build_utils.ExtractAll(
-            zip_file, unzipped_dir, True, pattern=filename
-        )
-        if len(unzipped_files) == 0:
-            raise Exception('%s not found in %s' % (filename, zip_file))
-        yield unzipped_files[0]
-
-
 def _ConfigOutDir(out_dir):
     if out_dir:
         constants.SetOutputDirectory(out_dir)
@@ -734,11 +776,31 @@ def _IterSplits(namelist):
                     yield subpath, split_name
 
 
-def _ExtractToTempFile(zip_obj, subpath, temp_file):
-    temp_file.seek(0)
-    temp_file.truncate()
-    temp_file.write(zip_obj.read(subpath))
-    temp_file.flush()
+def _AnalyzeSplit(apks_zip, apks_path, subpath, split_name, sdk_version):
+    """Analyzes a split within an .apks without extracting it to disk.
+
+    Safe to call from multiple threads.
+
+    Returns: A tuple of (on_demand, normalized size, list of report_func args).
+    """
+    # Splits are read from the .apks as needed rather than held in memory.
+    open_apk = functools.partial(
+        zip_helpers.open_entry_file, apks_path, apks_zip.getinfo(subpath)
+    )
+    on_demand = False
+    if split_name != 'base':
+        with open_apk() as f, zipfile.ZipFile(f) as split_zip:
+            _, on_demand = _ParseSplitManifestAttributes(split_zip)
+    reports = []
+    size = _AnalyzeInternal(
+        subpath,
+        sdk_version,
+        lambda *args: reports.append(args),
+        apks_path=apks_path,
+        split_name=split_name,
+        open_apk=open_apk,
+    )
+    return on_demand, size, reports
 
 
 def _AnalyzeApkOrApks(report_func, apk_path):
@@ -748,61 +810,63 @@ def _AnalyzeApkOrApks(report_func, apk_path):
 
     if apk_path.endswith('.apk'):
         sdk_version, _ = _ParseManifestAttributes(apk_path)
-        _AnalyzeInternal(
-            apk_path, sdk_version, report_func, dex_stats_collector
-        )
+        dex_stats_collector.CollectFromZip('', apk_path)
+        _AnalyzeInternal(apk_path, sdk_version, report_func)
     elif apk_path.endswith('.apks'):
-        with tempfile.NamedTemporaryFile(suffix='.apk') as f:
-            with zipfile.ZipFile(apk_path) as z:
-                # Currently bundletool is creating two apks when .apks is created
-                # without specifying an sdkVersion. Always measure the one with an
-                # uncompressed shared library.
-                try:
-                    info = z.getinfo('splits/base-master_2.apk')
-                except KeyError:
-                    info = z.getinfo('splits/base-master.apk')
-                _ExtractToTempFile(z, info.filename, f)
-                sdk_version, _ = _ParseManifestAttributes(f.name)
-
-                orig_report_func = report_func
-                report_func = _AccumulatingReporter()
-
-                def do_measure(split_name, on_demand):
-                    logging.info(
-                        'Measuring %s on_demand=%s', split_name, on_demand
-                    )
-                    # Use no-op reporting functions to get normalized size for DFMs.
-                    inner_report_func = report_func
-                    inner_dex_stats_collector = dex_stats_collector
-                    if on_demand:
-                        inner_report_func = lambda *_: None
-                        inner_dex_stats_collector = (
-                            method_count.DexStatsCollector()
-                        )
-
-                    size = _AnalyzeInternal(
-                        f.name,
+        with zipfile.ZipFile(apk_path) as z:
+            # Currently bundletool is creating two apks when .apks is created
+            # without specifying an sdkVersion. Always measure the one with an
+            # uncompressed shared library.
+            try:
+                info = z.getinfo('splits/base-master_2.apk')
+            except KeyError:
+                info = z.getinfo('splits/base-master.apk')
+            with (
+                zip_helpers.open_entry_file(apk_path, info) as f,
+                zipfile.ZipFile(f) as base,
+            ):
+                sdk_version, _ = _ParseSplitManifestAttributes(base)
+
+            splits = [(info.filename, 'base')]
+            splits += [
+                (subpath, split_name)
+                for subpath, split_name in _IterSplits(z.namelist())
+                if split_name != 'base'
+            ]
+            # Splits are analyzed concurrently. Most of the time is spent in
+            # zlib and in subprocesses, which release the GIL.
+            max_workers = min(len(splits), os.cpu_count() or 1)
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+                futures = [
+                    pool.submit(
+                        _AnalyzeSplit,
+                        z,
+                        apk_path,
+                        subpath,
+                        split_name,
                         sdk_version,
-                        inner_report_func,
-                        inner_dex_stats_collector,
-                        apks_path=apk_path,
-                        split_name=split_name,
                     )
-                    report_func(
-                        'DFM_' + split_name, 'Size with hindi', size, 'bytes'
-                    )
-
-                # Measure base outside of the loop since we've already extracted it.
-                do_measure('base', on_demand=False)
-
-                for subpath, split_name in _IterSplits(z.namelist()):
-                    if split_name != 'base':
-                        _ExtractToTempFile(z, subpath, f)
-                        _, on_demand = _ParseManifestAttributes(f.name)
-                        do_measure(split_name, on_demand=on_demand)
+                    for subpath, split_name in splits
+                ]
+                results = [f.result() for f in futures]
+
+        orig_report_func = report_func
+        report_func = _AccumulatingReporter()
+        # Report in split order so that results do not depend on scheduling.
+        for (subpath, split_name), result in zip(splits, results):
+            on_demand, size, reports = result
+            logging.info('Measured %s on_demand=%s', split_name, on_demand)
+            # Use only the normalized size for DFMs.
+            if not on_demand:
+                for args in reports:
+                    report_func(*args)
+                dex_stats_collector.CollectFromZip(
+                    split_name, apk_path, split_subpath=subpath
+                )
+            report_func('DFM_' + split_name, 'Size with hindi', size, 'bytes')
 
-                report_func.DumpReports(orig_report_func)
-                report_func = orig_report_func
+        report_func.DumpReports(orig_report_func)
+        report_func = orig_report_func
     else:
         raise Exception('Unknown file type: ' + apk_path)
 
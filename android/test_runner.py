@@ -122,6 +122,14 @@ def AddTestLauncherOptions(parser):
         default=os.environ.get('GTEST_TOTAL_SHARDS', 1),
         help='Total number of external shards.',
     )
+    parser.add_argument(
+        '--test-launcher-timing-db',
+        type=os.path.realpath,
+        help='Path to a database of test durations, created with '
+        'pylib/utils/test_timings.py from previous --json-results-file '
+        'outputs. If set, external shards and device shards are balanced '
+        'by duration.',
+    )
 
     test_filter.AddFilterOptions(parser)
 
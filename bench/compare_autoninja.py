@@ -4,12 +4,18 @@
 # found in the LICENSE file.
 
 import argparse
+import bisect
+import collections
 import getpass
 import io
+import itertools
 import pathlib
 import subprocess
 import json
 import sys
+import typing
+
+import utils
 
 _DURATION_FIELDS = [
     'duration',
@@ -21,6 +27,37 @@ _DURATION_FIELDS = [
 ]
 _MERGED_FIELDS = ['output', 'rule', 'action', 'gn_target']
 _PROTO = 'chrome.ops.chrome_browser_build.CombinedMetrics'
+# Number of siso steps to write to a result sink at a time.
+_WRITE_BATCH_SIZE = 10000
+
+# Columns of the tables written to .sqlite / .db / .parquet outputs.
+_OUTPUTS_COLUMNS = {'id': int, **{field: str for field in _MERGED_FIELDS}}
+_METRICS_COLUMNS = {
+    'output_id': int,
+    'out_dir': str,
+    **{f'{field}_millis': int for field in _DURATION_FIELDS},
+}
+_RULES_COLUMNS = {
+    'out_dir': str,
+    'rule': str,
+    'count': int,
+    'cpu_millis': int,
+    'duration_millis': int,
+    'critical_path_millis': int,
+}
+_CRITICAL_PATH_COLUMNS = {
+    'out_dir': str,
+    'position': int,
+    'output': str,
+    'rule': str,
+    'start_millis': int,
+    'duration_millis': int,
+}
+# Actions that start within this many seconds of another finishing are
+# assumed to have been waiting for it.
+_CRITICAL_PATH_SLACK = 0.05
+# Number of rules and critical path actions to print.
+_REPORT_TOP_N = 15
 
 
 def error(*args, **kwargs):
@@ -28,11 +65,290 @@ def error(*args, **kwargs):
     exit(1)
 
 
+def _iter_steps(out_dirs):
+    """Yields (out_dir, step) for each step in each siso_metrics.jsonl."""
+    for out_dir in out_dirs:
+        metric_file = out_dir / '.siso_metrics.jsonl'
+        print(f'Processing {metric_file}')
+        with open(metric_file, 'r') as f:
+            for line in f:
+                step = json.loads(line)
+                if 'output' in step:
+                    yield out_dir, step
+
+
+def _step_metrics(step):
+    return {
+        # These are measured in seconds, to 2 decimal places.
+        f'{field}_millis': round(step[field] * 1000)
+        for field in _DURATION_FIELDS
+        if field in step
+    }
+
+
+class _Action(typing.NamedTuple):
+    output: str
+    rule: str
+    # Seconds since the start of the build.
+    start: float
+    end: float
+    # CPU seconds, or None if unknown.
+    cpu: float | None
+
+
+def _load_actions(out_dir):
+    """Returns the actions run by the last build in |out_dir|.
+
+    Timings come from .siso_metrics.jsonl, or from .ninja_log for builds that
+    did not write metrics.
+    """
+    metric_file = out_dir / '.siso_metrics.jsonl'
+    if metric_file.exists():
+        actions = []
+        for _, step in _iter_steps([out_dir]):
+            if 'action_start' not in step or 'duration' not in step:
+                continue
+            cpu = None
+            if 'utime' in step or 'stime' in step:
+                cpu = step.get('utime', 0) + step.get('stime', 0)
+            start = step['action_start']
+            actions.append(
+                _Action(
+                    step['output'],
+                    step.get('rule', ''),
+                    start,
+                    start + step['duration'],
+                    cpu,
+                )
+            )
+        return actions
+    return _load_ninja_log(out_dir / '.ninja_log')
+
+
+def _load_ninja_log(path):
+    """Returns the actions of the last build recorded in a .ninja_log."""
+    if not path.exists():
+        error(f'Neither .siso_metrics.jsonl nor {path} exist')
+    print(f'Processing {path}')
+    actions = {}
+    with open(path) as f:
+        header = f.readline()
+        if not header.startswith('# ninja log v'):
+            error(f'{path} is not a ninja log')
+        prev_end = 0
+        for line in f:
+            start_ms, end_ms, _, output, _ = line.rstrip('\n').split('\t')
+            end_ms = int(end_ms)
+            # Each build appends to the log, and restarts times from zero.
+            if end_ms < prev_end:
+                actions = {}
+            prev_end = end_ms
+            actions[output] = _Action(
+                output,
+                # The log does not record rules, so use the type of output.
+                pathlib.PurePosixPath(output).suffix or output,
+                int(start_ms) / 1000,
+                end_ms / 1000,
+                None,
+            )
+    return list(actions.values())
+
+
+def _critical_path(actions):
+    """Returns the chain of actions that determined the build's wall time.
+
+    Metrics do not record dependencies, so the dependency that an action was
+    waiting for is inferred from timing: it is the action that finished last
+    before it started. Gaps along the path (e.g. for scheduling or I/O) are
+    attributed to the build rather than to an action.
+    """
+    if not actions:
+        return []
+    by_end = sorted(actions, key=lambda a: a.end)
+    ends = [a.end for a in by_end]
+    path = [by_end[-1]]
+    # Only consider actions that finished before the current one, so that the
+    # path always makes progress backwards.
+    limit = len(by_end) - 1
+    while True:
+        current = path[-1]
+        i = bisect.bisect_right(
+            ends, current.start + _CRITICAL_PATH_SLACK, 0, limit
+        )
+        if i == 0:
+            break
+        limit = i - 1
+        path.append(by_end[limit])
+    path.reverse()
+    return path
+
+
+def _parallelism(actions, n_buckets):
+    """Returns the average number of concurrent actions in each time bucket."""
+    if not actions:
+        return []
+    begin = min(a.start for a in actions)
+    end = max(a.end for a in actions)
+    width = (end - begin) / n_buckets or 1
+    busy = [0.0] * n_buckets
+    for a in actions:
+        first = min(int((a.start - begin) / width), n_buckets - 1)
+        last = min(int((a.end - begin) / width), n_buckets - 1)
+        for b in range(first, last + 1):
+            bucket_start = begin + b * width
+            overlap = min(a.end, bucket_start + width) - max(
+                a.start, bucket_start
+            )
+            busy[b] += max(overlap, 0)
+    return [b / width for b in busy]
+
+
+class _Analysis(typing.NamedTuple):
+    out_dir: pathlib.Path
+    wall: float
+    # Sum of the durations of all actions.
+    busy: float
+    critical_path: list[_Action]
+    # rule -> [count, cpu seconds, duration, duration on the critical path].
+    rules: dict[str, list]
+    parallelism: list[float]
+
+
+def _analyze(out_dir, n_buckets):
+    actions = _load_actions(out_dir)
+    critical_path = _critical_path(actions)
+    rules = collections.defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+    for a in actions:
+        stats = rules[a.rule]
+        stats[0] += 1
+        stats[1] += a.end - a.start if a.cpu is None else a.cpu
+        stats[2] += a.end - a.start
+    for a in critical_path:
+        rules[a.rule][3] += a.end - a.start
+    wall = 0
+    if actions:
+        wall = max(a.end for a in actions) - min(a.start for a in actions)
+    return _Analysis(
+        out_dir,
+        wall,
+        sum(a.end - a.start for a in actions),
+        critical_path,
+        dict(rules),
+        _parallelism(actions, n_buckets),
+    )
+
+
+def _write_analysis_tables(sink, analyses):
+    sink.add_table('rules', _RULES_COLUMNS)
+    sink.add_table('critical_path', _CRITICAL_PATH_COLUMNS)
+    for analysis in analyses:
+        out_dir = str(analysis.out_dir)
+        sink.write(
+            'rules',
+            (
+                (out_dir, rule, count, *(round(x * 1000) for x in times))
+                for rule, (count, *times) in analysis.rules.items()
+            ),
+        )
+        sink.write(
+            'critical_path',
+            (
+                (
+                    out_dir,
+                    i,
+                    a.output,
+                    a.rule,
+                    round(a.start * 1000),
+                    round((a.end - a.start) * 1000),
+                )
+                for i, a in enumerate(analysis.critical_path)
+            ),
+        )
+
+
+def _print_analysis(analyses):
+    base = analyses[0]
+    for analysis in analyses:
+        path_time = sum(a.end - a.start for a in analysis.critical_path)
+        print(f'\n{analysis.out_dir}:')
+        print(
+            f'  Wall time: {analysis.wall:.1f}s, '
+            f'average parallelism: {analysis.busy / (analysis.wall or 1):.1f}'
+        )
+        print(
+            f'  Critical path: {len(analysis.critical_path)} actions, '
+            f'{path_time:.1f}s running, '
+            f'{analysis.wall - path_time:.1f}s waiting'
+        )
+        print(
+            '  Parallelism over time: '
+            + ' '.join(f'{p:.0f}' for p in analysis.parallelism)
+        )
+        print('  Slowest actions on the critical path:')
+        for a in sorted(analysis.critical_path, key=lambda a: a.start - a.end)[
+            :_REPORT_TOP_N
+        ]:
+            print(f'    {a.end - a.start:8.1f}s  {a.rule:20} {a.output}')
+
+    rules = sorted(
+        set().union(*(a.rules for a in analyses)),
+        key=lambda r: -max(a.rules.get(r, [0, 0])[1] for a in analyses),
+    )
+    header = ''.join(f' {str(a.out_dir)[-16:]:>16}' for a in analyses)
+    print(
+        f'\nCPU seconds by rule (critical path seconds):\n{"rule":24}{header}'
+    )
+    for rule in rules[:_REPORT_TOP_N]:
+        cells = []
+        for analysis in analyses:
+            _, cpu, _, path_time = analysis.rules.get(rule, [0, 0, 0, 0])
+            cell = f'{cpu:.0f} ({path_time:.0f})'
+            if analysis is not base:
+                base_cpu = base.rules.get(rule, [0, 0])[1]
+                cell = f'{cpu - base_cpu:+.0f} ({path_time:.0f})'
+            cells.append(f' {cell:>16}')
+        print(f'{rule[:24]:24}{"".join(cells)}')
+
+
+def _write_tables(sink, out_dirs):
+    """Streams steps to |sink| without merging them in memory."""
+    sink.add_table('outputs', _OUTPUTS_COLUMNS)
+    sink.add_table('metrics', _METRICS_COLUMNS)
+    output_ids = {}
+    steps = _iter_steps(out_dirs)
+    while batch := list(itertools.islice(steps, _WRITE_BATCH_SIZE)):
+        output_rows = []
+        metric_rows = []
+        for out_dir, step in batch:
+            output_id = output_ids.get(step['output'])
+            if output_id is None:
+                output_id = output_ids[step['output']] = len(output_ids)
+                output_rows.append(
+                    (output_id, *(step.get(f) for f in _MERGED_FIELDS))
+                )
+            metrics = _step_metrics(step)
+            metric_rows.append(
+                (
+                    output_id,
+                    str(out_dir),
+                    *(metrics.get(f'{f}_millis') for f in _DURATION_FIELDS),
+                )
+            )
+        sink.write('outputs', output_rows)
+        sink.write('metrics', metric_rows)
+
+
 def main(args):
     # Check errors early because you don't want to wait an hour for the compile
     # to complete only to have an error occur.
-    if args.output_file.suffix not in ['.recordio', '.json']:
-        error('--output-file must be either .recordio or .json')
+    sink = None
+    if args.output_file.suffix in ['.sqlite', '.db', '.parquet']:
+        sink = utils.open_sink(args.output_file)
+    elif args.output_file.suffix not in ['.recordio', '.json']:
+        error(
+            '--output-file must be either .recordio, .json, .sqlite, .db or '
+            '.parquet'
+        )
     for out_dir in args.out_dirs:
         if not out_dir.is_dir():
             error(f'Output directory {out_dir} does not exist')
@@ -66,29 +382,29 @@ def main(args):
             print(f'Running for {out_dir}: {" ".join(map(str, command))}')
             subprocess.run(command, check=True)
 
+    analyses = []
+    if args.analyze:
+        analyses = [_analyze(d, args.buckets) for d in args.out_dirs]
+        _print_analysis(analyses)
+
+    if sink:
+        with sink:
+            _write_tables(sink, args.out_dirs)
+            if analyses:
+                _write_analysis_tables(sink, analyses)
+        print(f'Combined metrics written to {args.output_file}')
+        return
+
     merged_metrics = {}
-    for out_dir in args.out_dirs:
-        metric_file = out_dir / '.siso_metrics.jsonl'
-        print(f'Processing {metric_file}')
-        with open(metric_file, 'r') as f:
-            for line in f:
-                step = json.loads(line)
-                if 'output' not in step:
-                    continue
-                output = merged_metrics.get(step['output'], None)
-                if output is None:
-                    output = merged_metrics[step['output']] = {}
-                    output['metrics'] = []
-                    for field in _MERGED_FIELDS:
-                        if field in step:
-                            output[field] = step[field]
-                metrics = {
-                    # These are measured in seconds, to 2 decimal places.
-                    f'{field}_millis': round(step[field] * 1000)
-                    for field in _DURATION_FIELDS
-                    if field in step
-                }
-                output['metrics'].append(metrics)
+    for _, step in _iter_steps(args.out_dirs):
+        output = merged_metrics.get(step['output'], None)
+        if output is None:
+            output = merged_metrics[step['output']] = {}
+            output['metrics'] = []
+            for field in _MERGED_FIELDS:
+                if field in step:
+                    output[field] = step[field]
+        output['metrics'].append(_step_metrics(step))
 
     if args.output_file.suffix == '.recordio':
         stdin = io.StringIO()
@@ -178,6 +494,20 @@ if __name__ == '__main__':
         action='store_true',
         help='Run the build without remote execution',
     )
+    parser.add_argument(
+        '--analyze',
+        action='store_true',
+        help='Print the critical path, CPU time per rule and parallelism of '
+        'each build, compared to the first one. Uses .ninja_log for builds '
+        'without siso metrics. With a .sqlite / .db / .parquet output, also '
+        'writes them to the "rules" and "critical_path" tables.',
+    )
+    parser.add_argument(
+        '--buckets',
+        type=int,
+        default=20,
+        help='Number of time buckets to report parallelism for.',
+    )
     parser.add_argument(
         'remainder',
         nargs=argparse.REMAINDER,
@@ -187,7 +517,9 @@ if __name__ == '__main__':
         '--output-file',
         '-o',
         type=pathlib.Path,
-        help='Path to write the combined metrics recordio file.',
+        help='Path to write the combined metrics to. Either .recordio '
+        '(requires gqui), .json, .sqlite / .db, or .parquet (a directory with '
+        'a file per table).',
         required=True,
     )
 
@@ -19,104 +19,121 @@ use_clang_modules = false
 from __future__ import annotations
 
 import argparse
-import dataclasses
+import array
+import itertools
 import json
 import multiprocessing
+import os
 import pathlib
+import re
 
 import utils
 
-ftime_pb2 = utils.import_protobufs('ftime.proto')
-
-
-# This is an optimization technique. path_to_id is expensive to copy, so we
-# do it here to ensure it copies once per worker instead of once per job
-def _initialize_worker(path_to_id):
-    global PATH_TO_ID
-    PATH_TO_ID = path_to_id
-
-
-# Parsing has a lot of both i/o and computation, so we use smaller chunks.
-_PARSE_CHUNKSIZE = 20
-# Aggregation is very cheap and involves no I/O, so we want very large chunks.
-_AGG_CHUNKSIZE = 100
+# Each job parses this many traces per CPU, so that jobs are small enough to
+# balance well across workers, but each returns a single aggregate.
+_JOBS_PER_CPU = 4
+# Number of aggregated sources to write to the output at a time.
+_WRITE_BATCH_SIZE = 1000
+
+# Columns of each output table. These mirror the messages in ftime.proto.
+_ANALYSIS_COLUMNS = {
+    'out_dir': str,
+    'n_compiles': int,
+    'total_source_us': int,
+    'total_us': int,
+}
+_SOURCES_COLUMNS = {
+    'id': int,
+    'name': str,
+    'count': int,
+    'direct_us': int,
+    'transitive_us': int,
+}
+_INCLUDES_COLUMNS = {'source_id': int, 'include_id': int}
+
+_TOTAL_SOURCE = 'Total Source'
+_TOTAL_COMPILE = 'Total ExecuteCompiler'
+# Matches the names of the only events that we need to decode.
+_EVENT_NAME_RE = re.compile(
+    r'"name":\s*"(Source|Total Source|Total ExecuteCompiler)"'
+)
+_DECODER = json.JSONDecoder()
+# Include edges are stored as a single int: (source_id << 32) | include_id.
+_EDGE_SHIFT = 32
+_EDGE_MASK = (1 << _EDGE_SHIFT) - 1
 
 
 def main(args):
-    out = utils.CapacitorFile(args.out_file)
+    if args.out_file.suffix == '.capacitor':
+        out = utils.CapacitorFile(args.out_file)
+    else:
+        out = utils.open_sink(args.out_file)
 
     traces = _collect_traces(args.out_dir, args.limit)
+    jobs = _split_jobs(traces, (os.cpu_count() or 1) * _JOBS_PER_CPU)
 
-    # Mapping from filename to (ID, each time the source was seen)
-    sources: dict[str, tuple[int, list[Source]]] = {}
-    next_id = 0
-    total = 0
-    total_source = 0
-    n_compiles = 0
+    aggregate = _Aggregate()
     with multiprocessing.Pool() as p:
         print('Note: Parsing and aggregating can take several minutes')
         print('Parsing traces')
-        parsed = p.imap_unordered(
-            _parse_trace, traces, chunksize=_PARSE_CHUNKSIZE
-        )
-        for compile_total, compile_total_source, compile_sources in parsed:
-            if compile_total_source is not None:
-                total += compile_total
-                total_source += compile_total_source
-                n_compiles += 1
-            for source in compile_sources:
-                if source.name not in sources:
-                    sources[source.name] = (next_id, [])
-                    next_id += 1
-                sources[source.name][1].append(source)
+        for partial in p.imap_unordered(_parse_traces, jobs):
+            aggregate.merge(partial)
 
     print('Aggregating traces')
-    path_to_id = {k: v[0] for k, v in sources.items()}
-    with multiprocessing.Pool(
-        initializer=_initialize_worker, initargs=(path_to_id,)
-    ) as p:
-        details = sorted(
-            p.imap_unordered(
-                _aggregate,
-                (v[1] for v in sources.values()),
-                chunksize=_AGG_CHUNKSIZE,
+    analysis = (
+        str(args.out_dir),
+        aggregate.n_compiles,
+        aggregate.total_source,
+        aggregate.total,
+    )
+    details = aggregate.details()
+    if isinstance(out, utils.CapacitorFile):
+        _write_capacitor(out, analysis, details)
+    else:
+        with out:
+            _write_tables(out, analysis, details)
+
+
+def _write_tables(sink: utils.ResultSink, analysis, details):
+    """Streams the analysis to |sink| as it is aggregated."""
+    print(f'Writing to {sink}')
+    sink.add_table('analysis', _ANALYSIS_COLUMNS)
+    sink.add_table('sources', _SOURCES_COLUMNS)
+    sink.add_table('includes', _INCLUDES_COLUMNS)
+    sink.write('analysis', [analysis])
+    while batch := list(itertools.islice(details, _WRITE_BATCH_SIZE)):
+        sink.write('sources', (row for row, _ in batch))
+        sink.write(
+            'includes',
+            (
+                (row[0], include_id)
+                for row, includes in batch
+                for include_id in includes
             ),
-            key=lambda x: x.id,
         )
 
+
+def _write_capacitor(out: utils.CapacitorFile, analysis, details):
+    ftime_pb2 = utils.import_protobufs('ftime.proto')
+    out_dir, n_compiles, total_source, total = analysis
+    sources = [
+        ftime_pb2.SourceFile(
+            **dict(zip(_SOURCES_COLUMNS, row)), includes=includes
+        )
+        for row, includes in sorted(details)
+    ]
     print(f'Dumping to {out}')
     out.write(
         ftime_pb2.Analysis(
-            out_dir=str(args.out_dir),
+            out_dir=out_dir,
             total_us=total,
             total_source_us=total_source,
             n_compiles=n_compiles,
-            sources=details,
+            sources=sources,
         )
     )
 
 
-@dataclasses.dataclass
-class Source:
-    """Represents a single compile of a single source file"""
-
-    name: str
-    transitive_us: int = 0
-    duration_us: int = 0
-    includes: list[Source] = dataclasses.field(default_factory=list)
-
-    # Come up with a representation that isn't recursive on includes.
-    def __repr__(self):
-        return repr(
-            {
-                'name': self.name,
-                'transitive': self.transitive_us,
-                'direct': self.direct_us,
-                'includes': [i.name for i in self.includes],
-            }
-        )
-
-
 def _collect_traces(out_dir: pathlib.Path, limit: int | None = None):
     traces = []
     print('Finding json files')
@@ -134,67 +151,233 @@ def _collect_traces(out_dir: pathlib.Path, limit: int | None = None):
     return traces
 
 
-def _aggregate(sources: list[Source]) -> ftime_pb2.SourceFile:
-    """Aggregates many source files into one."""
-    name = sources[0].name
-    direct_us = 0
-    transitive_us = 0
-    includes = set()
-    for source in sources:
-        direct_us += source.direct_us
-        transitive_us += source.transitive_us
-        includes.update([PATH_TO_ID[s.name] for s in source.includes])
-    return ftime_pb2.SourceFile(
-        name=name,
-        id=PATH_TO_ID[name],
-        direct_us=direct_us,
-        transitive_us=transitive_us,
-        count=len(sources),
-        includes=sorted(includes),
-    )
-
+def _split_jobs(traces: list[pathlib.Path], n_jobs: int):
+    """Splits traces into jobs of roughly equal total size, largest first."""
+    jobs = [[] for _ in range(min(n_jobs, len(traces)))]
+    sizes = [0] * len(jobs)
+    for path, size in sorted(
+        ((p, p.stat().st_size) for p in traces), key=lambda x: -x[1]
+    ):
+        i = sizes.index(min(sizes))
+        jobs[i].append(path)
+        sizes[i] += size
+    return jobs
+
+
+class _Aggregate:
+    """Sums the sources of many compiles, indexed by a global source ID."""
+
+    def __init__(self):
+        self.n_compiles = 0
+        self.total = 0
+        self.total_source = 0
+        self._ids: dict[str, int] = {}
+        self._names: list[str] = []
+        self._counts = array.array('q')
+        self._direct_us = array.array('q')
+        self._transitive_us = array.array('q')
+        self._edges: set[int] = set()
+
+    def _intern(self, name: str) -> int:
+        source_id = self._ids.get(name)
+        if source_id is None:
+            source_id = len(self._names)
+            self._ids[name] = source_id
+            self._names.append(name)
+            self._counts.append(0)
+            self._direct_us.append(0)
+            self._transitive_us.append(0)
+        return source_id
+
+    def merge(self, partial):
+        """Adds the result of _parse_traces()."""
+        (
+            n_compiles,
+            total,
+            total_source,
+            names,
+            counts,
+            direct_us,
+            transitive_us,
+            edges,
+        ) = partial
+        self.n_compiles += n_compiles
+        self.total += total
+        self.total_source += total_source
+        # Maps the job's source IDs to global ones.
+        global_ids = [self._intern(name) for name in names]
+        for local_id, global_id in enumerate(global_ids):
+            self._counts[global_id] += counts[local_id]
+            self._direct_us[global_id] += direct_us[local_id]
+            self._transitive_us[global_id] += transitive_us[local_id]
+        self._edges.update(
+            (global_ids[e >> _EDGE_SHIFT] << _EDGE_SHIFT)
+            | global_ids[e & _EDGE_MASK]
+            for e in edges
+        )
 
-def _parse_trace(path: pathlib.Path) -> tuple[int, int | None, list[Source]]:
+    def details(self):
+        """Yields (row in the sources table, sorted IDs of included sources)."""
+        edges = iter(sorted(self._edges))
+        edge = next(edges, None)
+        for source_id, name in enumerate(self._names):
+            includes = []
+            while edge is not None and edge >> _EDGE_SHIFT == source_id:
+                includes.append(edge & _EDGE_MASK)
+                edge = next(edges, None)
+            row = (
+                source_id,
+                name,
+                self._counts[source_id],
+                self._direct_us[source_id],
+                self._transitive_us[source_id],
+            )
+            yield row, includes
+
+
+def _iter_events(path: pathlib.Path):
+    """Yields the 'Source' and 'Total' events of a trace.
+
+    Only these events are decoded, which is most of the cost of parsing a
+    trace. Clang writes each event's name before its only nested object
+    ("args"), so an event starts at the last '{' before its name.
+    """
+    text = path.read_text()
+    events = []
+    for m in _EVENT_NAME_RE.finditer(text):
+        start = text.rfind('{', 0, m.start())
+        try:
+            event, _ = _DECODER.raw_decode(text, start)
+        except json.JSONDecodeError:
+            event = None
+        if not isinstance(event, dict) or event.get('name') != m.group(1):
+            # Unexpected layout, so fall back to decoding everything.
+            names = ('Source', _TOTAL_SOURCE, _TOTAL_COMPILE)
+            return [
+                e for e in json.loads(text)['traceEvents'] if e['name'] in names
+            ]
+        events.append(event)
+    return events
+
+
+def _parse_trace(path: pathlib.Path, ids: dict[str, int]):
+    """Parses a single trace.
+
+    Args:
+      path: Path to the trace.
+      ids: Mapping from source name to ID, which is added to.
+
+    Returns:
+      A tuple of (total_us, total_source_us, source_ids, direct_us,
+      transitive_us, parent_ids), where the arrays have an element per
+      #include, and the parent ID is -1 for the main source file.
+    """
     # Not every trace has a "Total Source".
+    total = None
     total_source = None
-    events = []
-    # Filter to only the events we care about.
-    with path.open('r') as f:
-        for event in json.load(f)['traceEvents']:
-            match event['name']:
-                case 'Source':
-                    events.append(event)
-                case 'Total Source':
-                    total_source = event['dur']
-                case 'Total ExecuteCompiler':
-                    total = event['dur']
+    source_events = []
+    for event in _iter_events(path):
+        match event['name']:
+            case 'Source':
+                source_events.append(event)
+            case 'Total Source':
+                total_source = event['dur']
+            case 'Total ExecuteCompiler':
+                total = event['dur']
 
     # Sort event by timestamp. Currently start and end events are paired next
     # to one another.
     # The sort is guaranteed to be stable.
-    events.sort(key=lambda e: e['ts'])
-
-    sources = []
-    # The include stack. Contains sources, and their beginning timestamp.
-    stack: list[tuple[Source, int]] = []
-    for event in events:
+    source_events.sort(key=lambda e: e['ts'])
+
+    n = sum(1 for e in source_events if e['ph'] == 'b')
+    source_ids = array.array('l', [0]) * n
+    direct_us = array.array('q', [0]) * n
+    transitive_us = array.array('q', [0]) * n
+    parent_ids = array.array('l', [0]) * n
+    # The include stack. Contains the index of each source, its beginning
+    # timestamp, and the sum of the transitive times of its includes.
+    stack: list[list[int]] = []
+    i = 0
+    for event in source_events:
         if event['ph'] == 'b':  # begin
             fname = event['args']['detail']
-            source = Source(name=fname)
-            sources.append(source)
-            if stack:
-                stack[-1][0].includes.append(source)
-            stack.append((source, event['ts']))
+            source_id = ids.setdefault(fname, len(ids))
+            source_ids[i] = source_id
+            parent_ids[i] = source_ids[stack[-1][0]] if stack else -1
+            stack.append([i, event['ts'], 0])
+            i += 1
         else:
-            source, begin = stack.pop()
+            index, begin, includes_us = stack.pop()
             # All timestamps in traces are measured in microseconds.
             duration = event['ts'] - begin
-            source.transitive_us = duration
-            for include in source.includes:
-                duration -= include.transitive_us
-            source.direct_us = duration
+            transitive_us[index] = duration
+            direct_us[index] = duration - includes_us
+            if stack:
+                stack[-1][2] += duration
+
+    return total, total_source, source_ids, direct_us, transitive_us, parent_ids
+
 
-    return total, total_source, sources
+def _parse_traces(paths: list[pathlib.Path]):
+    """Parses and aggregates many traces.
+
+    Source names are interned to IDs that are local to this job.
+
+    Returns:
+      A tuple of (n_compiles, total_us, total_source_us, names, counts,
+      direct_us, transitive_us, edges), where the arrays are indexed by ID, and
+      each include edge is encoded as (source_id << 32) | include_id.
+    """
+    ids: dict[str, int] = {}
+    counts = array.array('q')
+    direct_us = array.array('q')
+    transitive_us = array.array('q')
+    edges: set[int] = set()
+    n_compiles = 0
+    total = 0
+    total_source = 0
+    for path in paths:
+        (
+            compile_total,
+            compile_total_source,
+            source_ids,
+            compile_direct_us,
+            compile_transitive_us,
+            parent_ids,
+        ) = _parse_trace(path, ids)
+        if compile_total_source is not None:
+            total += compile_total
+            total_source += compile_total_source
+            n_compiles += 1
+        grow = len(ids) - len(counts)
+        if grow:
+            zeros = array.array('q', [0]) * grow
+            counts.extend(zeros)
+            direct_us.extend(zeros)
+            transitive_us.extend(zeros)
+        # Group by source ID.
+        for source_id, d, t in zip(
+            source_ids, compile_direct_us, compile_transitive_us
+        ):
+            counts[source_id] += 1
+            direct_us[source_id] += d
+            transitive_us[source_id] += t
+        edges.update(
+            (parent_id << _EDGE_SHIFT) | source_id
+            for source_id, parent_id in zip(source_ids, parent_ids)
+            if parent_id >= 0
+        )
+    return (
+        n_compiles,
+        total,
+        total_source,
+        list(ids),
+        counts,
+        direct_us,
+        transitive_us,
+        array.array('Q', edges),
+    )
 
 
 if __name__ == '__main__':
@@ -210,7 +393,8 @@ if __name__ == '__main__':
         '-o',
         required=True,
         dest='out_file',
-        help='capacitor file to output',
+        help='File to output. Either .sqlite / .db, .parquet (a directory '
+        'with a file per table), or .capacitor (requires gqui and protoc)',
         type=pathlib.Path,
     )
     parser.add_argument(
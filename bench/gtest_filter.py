@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks gtest filter matching on a synthetic list of test names."""
+
+import argparse
+import pathlib
+import random
+import sys
+import time
+
+sys.path.insert(
+    0, str(pathlib.Path(__file__).resolve().parents[1] / 'util' / 'lib')
+)
+from common import unittest_util
+
+_PREFIXES = ('', '', '', '', 'DISABLED_', 'PRE_', 'FLAKY_', 'MANUAL_')
+
+
+def _create_tests(num_tests):
+    rng = random.Random(0)
+    tests = []
+    for i in range(num_tests):
+        suite = f'Suite{i % 997}/Param{i % 7}'
+        tests.append(f'{suite}.{rng.choice(_PREFIXES)}Test{i}/{i % 13}')
+    return tests
+
+
+def _create_filter(tests, num_patterns):
+    rng = random.Random(1)
+    positive = [f'Suite{i}*' for i in range(0, 997, 50)]
+    positive += rng.sample(tests, num_patterns // 2)
+    negative = [f'*.Test{i}/*' for i in range(0, len(tests), 997)]
+    negative += rng.sample(tests, num_patterns // 2)
+    return ':'.join(positive) + '-' + ':'.join(negative)
+
+
+def _strip_prefixes(test):
+    suite, _, name = test.partition('.')
+    for prefix in _PREFIXES[4:]:
+        name = name.replace(prefix, '')
+    return f'{suite}.{name}'
+
+
+def _per_pattern(tests, gtest_filter):
+    # What gtest_test_instance.FilterTests() used to do: one fnmatch pass per
+    # pattern, then a re-check of each excluded DISABLED_ test.
+    filtered = unittest_util.FilterTestNames(
+        tests, gtest_filter, _strip_prefixes
+    )
+    filtered_set = set(filtered)
+    disabled = [
+        t
+        for t in tests
+        if t not in filtered_set
+        and 'DISABLED_' in t
+        and unittest_util.FilterTestNames(
+            [t.replace('DISABLED_', '')], gtest_filter, _strip_prefixes
+        )
+    ]
+    return filtered, disabled
+
+
+def _single_pass(tests, gtest_filter):
+    compiled = unittest_util.GtestFilter(gtest_filter)
+    filtered = []
+    disabled = []
+    for test in tests:
+        if compiled.Match(test, _strip_prefixes(test)) is not None:
+            filtered.append(test)
+        elif 'DISABLED_' in test:
+            without_disabled = test.replace('DISABLED_', '')
+            if (
+                compiled.Match(
+                    without_disabled, _strip_prefixes(without_disabled)
+                )
+                is not None
+            ):
+                disabled.append(test)
+    return filtered, disabled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-tests', type=int, default=50000)
+    parser.add_argument('--num-patterns', type=int, default=200)
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Runs per mode (best is kept).'
+    )
+    args = parser.parse_args()
+
+    tests = _create_tests(args.num_tests)
+    gtest_filter = _create_filter(tests, args.num_patterns)
+    print(f'{len(tests)} tests, {gtest_filter.count(":") + 1} filter patterns')
+    results = {}
+    outputs = {}
+    for name, func in (
+        ('per-pattern', _per_pattern),
+        ('single-pass', _single_pass),
+    ):
+        times = []
+        for _ in range(args.repeat):
+            start = time.monotonic()
+            outputs[name] = func(tests, gtest_filter)
+            times.append(time.monotonic() - start)
+        results[name] = min(times)
+        filtered, disabled = outputs[name]
+        print(
+            f'{name:12}: {results[name]:.3f}s '
+            f'({len(filtered)} matched, {len(disabled)} disabled)'
+        )
+    if sorted(outputs['per-pattern'][0]) != sorted(outputs['single-pass'][0]):
+        sys.exit('Matched tests differ!')
+    print(f'Speedup: {results["per-pattern"] / results["single-pass"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
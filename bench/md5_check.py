@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks md5_check.CallAndRecordIfStale on a synthetic set of jars."""
+
+import argparse
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(
+    0, str(pathlib.Path(__file__).resolve().parents[1] / 'android' / 'gyp')
+)
+from util import md5_check
+
+
+def _create_jars(tmp_dir, num_jars, entries_per_jar, entry_size):
+    rng = random.Random(0)
+    paths = []
+    for jar_idx in range(num_jars):
+        path = os.path.join(tmp_dir, f'lib{jar_idx}.jar')
+        with zipfile.ZipFile(path, 'w') as z:
+            for entry_idx in range(entries_per_jar):
+                z.writestr(
+                    f'org/chromium/p{jar_idx}/C{entry_idx}.class',
+                    rng.randbytes(entry_size),
+                )
+        paths.append(path)
+    return paths
+
+
+def _time_no_op(input_paths, record_path, track_entries):
+    def on_stale(*_):
+        pass
+
+    start = time.monotonic()
+    md5_check.CallAndRecordIfStale(
+        on_stale,
+        record_path=record_path,
+        input_paths=input_paths,
+        input_strings=['bench'],
+        pass_changes=track_entries,
+        track_subpaths_allowlist=input_paths if track_entries else None,
+    )
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-jars', type=int, default=5000)
+    parser.add_argument('--entries-per-jar', type=int, default=20)
+    parser.add_argument('--entry-size', type=int, default=2048)
+    parser.add_argument(
+        '--repeat', type=int, default=5, help='Runs per mode (best is kept).'
+    )
+    args = parser.parse_args()
+
+    # Measure hashing itself rather than tag cache lookups.
+    md5_check._TAG_CACHE_ENV = '0'
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f'Creating {args.num_jars} jars...')
+        input_paths = _create_jars(
+            tmp_dir, args.num_jars, args.entries_per_jar, args.entry_size
+        )
+        for track_entries in (False, True):
+            results = {}
+            for threads in (1, md5_check._MAX_HASH_THREADS):
+                md5_check._MAX_HASH_THREADS = threads
+                record_path = os.path.join(tmp_dir, f'{threads}.md5.stamp')
+                # Write the initial stamp.
+                _time_no_op(input_paths, record_path, track_entries)
+                results[threads] = min(
+                    _time_no_op(input_paths, record_path, track_entries)
+                    for _ in range(args.repeat)
+                )
+            desc = 'with' if track_entries else 'without'
+            print(f'No-op check {desc} zip entries:')
+            for threads, secs in results.items():
+                print(f'  {threads:>3} threads: {secs * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks zip_helpers.merge_zips with and without raw entry copying."""
+
+import argparse
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+import zip_helpers
+
+
+def _create_inputs(tmp_dir, total_bytes, num_zips, entry_size):
+    """Creates |num_zips| jars totalling roughly |total_bytes| of content."""
+    rng = random.Random(0)
+    # Mix compressible (repetitive) and incompressible (random) content so that
+    # deflate does a realistic amount of work.
+    compressible = b'public final class Foo { int bar; }\n' * (
+        entry_size // 36 + 1
+    )
+    per_zip = max(total_bytes // num_zips, entry_size)
+    paths = []
+    for zip_idx in range(num_zips):
+        path = os.path.join(tmp_dir, f'input{zip_idx}.jar')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+            for entry_idx in range(per_zip // entry_size):
+                if entry_idx % 2:
+                    data = rng.randbytes(entry_size)
+                else:
+                    data = compressible[:entry_size]
+                z.writestr(
+                    f'org/chromium/p{zip_idx}/C{entry_idx}.class',
+                    data,
+                    compresslevel=1,
+                )
+        paths.append(path)
+    return paths
+
+
+def _time_merge(input_zips, output, **kwargs):
+    start = time.monotonic()
+    zip_helpers.merge_zips(output, input_zips, **kwargs)
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--total-mb',
+        type=int,
+        default=2048,
+        help='Total uncompressed size of the generated inputs.',
+    )
+    parser.add_argument(
+        '--num-zips', type=int, default=200, help='Number of inputs to merge.'
+    )
+    parser.add_argument(
+        '--entry-kb', type=int, default=64, help='Size of each zip entry.'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Runs per mode (best is kept).'
+    )
+    parser.add_argument(
+        '--tmp-dir', help='Where to create inputs (must have enough space).'
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        print(f'Creating {args.num_zips} inputs totalling {args.total_mb}MB...')
+        input_zips = _create_inputs(
+            tmp_dir,
+            args.total_mb * 1024 * 1024,
+            args.num_zips,
+            args.entry_kb * 1024,
+        )
+        input_bytes = sum(os.path.getsize(p) for p in input_zips)
+        output = os.path.join(tmp_dir, 'merged.jar')
+
+        results = {}
+        for name, kwargs in (
+            ('recompress', {'raw_copy': False}),
+            ('raw_copy', {'raw_copy': True}),
+        ):
+            times = []
+            for _ in range(args.repeat):
+                times.append(_time_merge(input_zips, output, **kwargs))
+                os.unlink(output)
+            results[name] = min(times)
+            mb_per_sec = input_bytes / results[name] / 1024 / 1024
+            print(f'{name:>10}: {results[name]:.2f}s ({mb_per_sec:.0f} MB/s)')
+
+        speedup = results['recompress'] / results['raw_copy']
+        print(f'raw_copy speedup: {speedup:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
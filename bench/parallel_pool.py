@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Copyright 2025 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks back-to-back parallel.BulkForkAndCall calls.
+
+Compares creating a process pool per call (as parallel.py used to) against the
+pool that is shared by all calls within a process.
+"""
+
+import argparse
+import hashlib
+import pathlib
+import sys
+import time
+
+sys.path.insert(
+    0, str(pathlib.Path(__file__).resolve().parents[1] / 'android' / 'gyp')
+)
+from util import parallel
+
+
+def _job(seed, rounds):
+    data = str(seed).encode()
+    for _ in range(rounds):
+        data = hashlib.sha256(data).digest()
+    return data[0]
+
+
+def _per_call(arg_tuples, rounds):
+    return list(
+        parallel._BulkForkAndCallInNewPool(_job, arg_tuples, {'rounds': rounds})
+    )
+
+
+def _shared(arg_tuples, rounds):
+    return list(parallel.BulkForkAndCall(_job, arg_tuples, rounds=rounds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--calls', type=int, default=20, help='Back-to-back calls per run.'
+    )
+    parser.add_argument('--jobs', type=int, default=200, help='Jobs per call.')
+    parser.add_argument(
+        '--rounds',
+        type=int,
+        default=1000,
+        help='Hashing rounds per job (the size of each job).',
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Runs per mode (best is kept).'
+    )
+    args = parser.parse_args()
+
+    arg_tuples = [(i,) for i in range(args.jobs)]
+    print(
+        f'{args.calls} calls of {args.jobs} jobs, '
+        f'{parallel._MaxWorkers()} workers at most'
+    )
+    results = {}
+    outputs = {}
+    for name, func in (('per-call', _per_call), ('shared', _shared)):
+        times = []
+        for _ in range(args.repeat):
+            start = time.monotonic()
+            for _ in range(args.calls):
+                outputs[name] = func(arg_tuples, args.rounds)
+            times.append(time.monotonic() - start)
+        results[name] = min(times)
+        per_call_ms = results[name] / args.calls * 1000
+        print(f'{name:9}: {results[name]:.3f}s ({per_call_ms:.1f}ms per call)')
+    if outputs['per-call'] != outputs['shared']:
+        sys.exit('Results differ!')
+    print(f'Speedup: {results["per-call"] / results["shared"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,17 @@
 """Benchmarks the time required to build a single file."""
 
 import argparse
+import dataclasses
 import json
+import math
 import os
-import shutil
+import pathlib
+import random
+import sqlite3
+import statistics
 import subprocess
 import sys
+import time
 
 _SCHEMA_DOC = '''{
   "env": {"ENVIRONMENT_VARIABLE_KEY": "ENVIRONMENT VARIABLE VALUE"},
@@ -23,6 +29,59 @@ _SCHEMA_DOC = '''{
   },
 }'''
 
+# Number of resamples used for bootstrap confidence intervals.
+_BOOTSTRAP_RESAMPLES = 2000
+
+_SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+  id INTEGER PRIMARY KEY,
+  start_time REAL,
+  file TEXT,
+  warmup INTEGER,
+  runs INTEGER
+);
+CREATE TABLE IF NOT EXISTS benchmarks (
+  id INTEGER PRIMARY KEY,
+  session_id INTEGER REFERENCES sessions(id),
+  name TEXT,
+  rev TEXT,
+  command TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+  benchmark_id INTEGER REFERENCES benchmarks(id),
+  iteration INTEGER,
+  wall_s REAL,
+  user_s REAL,
+  sys_s REAL,
+  max_rss_kb INTEGER
+);
+'''
+
+
+@dataclasses.dataclass
+class Run:
+    """Resource usage of a single run of a benchmark."""
+
+    wall_s: float
+    user_s: float
+    sys_s: float
+    max_rss_kb: int
+
+
+@dataclasses.dataclass
+class Benchmark:
+    """A command to benchmark, optionally at a particular git revision."""
+
+    name: str
+    command: str
+    rev: str = None
+    # Name of the command in the config (|name| without the revision).
+    config: str = None
+    runs: list = dataclasses.field(default_factory=list)
+
+    def values(self, field):
+        return [getattr(r, field) for r in self.runs]
+
 
 def error(*args, **kwargs):
     print(*args, **kwargs, file=sys.stderr)
@@ -39,7 +98,291 @@ def run_siso_query(output_dir, file_path):
     return f'cd {output_dir} && {command}'
 
 
-def main(args, extra_args):
+def run_once(command):
+    """Runs |command| in bash and returns its resource usage."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        ['bash', '-c', command],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    # Read stderr before waiting to avoid filling the pipe. wait4() (rather than
+    # proc.wait()) provides the rusage of just this child.
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall_s = time.perf_counter() - start
+    # Let Popen know the process is gone.
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        error(
+            f'Command failed with exit code {proc.returncode}: {command}\n'
+            + stderr.decode('utf-8', errors='replace')
+        )
+    return Run(
+        wall_s=wall_s,
+        user_s=rusage.ru_utime,
+        sys_s=rusage.ru_stime,
+        # ru_maxrss is in KB on Linux.
+        max_rss_kb=rusage.ru_maxrss,
+    )
+
+
+def percentile(values, p):
+    """Returns the |p|th percentile of |values|, interpolating linearly."""
+    values = sorted(values)
+    pos = (len(values) - 1) * p / 100
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def bootstrap_ci(values, func, confidence=0.95):
+    """Returns a bootstrap confidence interval for func(values)."""
+    # Use a fixed seed so that reports are reproducible.
+    rng = random.Random(0)
+    estimates = sorted(
+        func(rng.choices(values, k=len(values)))
+        for _ in range(_BOOTSTRAP_RESAMPLES)
+    )
+    tail = (1 - confidence) / 2 * 100
+    return percentile(estimates, tail), percentile(estimates, 100 - tail)
+
+
+def mann_whitney_u(a, b):
+    """Two-sided Mann-Whitney U test, using the normal approximation.
+
+    Makes no assumption about how timings are distributed (they are rarely
+    normal).
+
+    Returns:
+      A tuple of (U statistic for |a|, p-value).
+    """
+    combined = sorted((v, i < len(a)) for i, v in enumerate(a + b))
+    # Assign average ranks to ties.
+    ranks = [0.0] * len(combined)
+    tie_correction = 0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        num_tied = j - i + 1
+        tie_correction += num_tied**3 - num_tied
+        i = j + 1
+
+    n1 = len(a)
+    n2 = len(b)
+    rank_sum = sum(r for r, (_, in_a) in zip(ranks, combined) if in_a)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_correction / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2) / math.sqrt(variance)
+    return u, 2 * (1 - statistics.NormalDist().cdf(abs(z)))
+
+
+def summarize(benchmark):
+    """Returns summary statistics for a benchmark."""
+    wall = benchmark.values('wall_s')
+    ret = {
+        'wall_median_s': statistics.median(wall),
+        'wall_median_ci_s': bootstrap_ci(wall, statistics.median),
+        'wall_p90_s': percentile(wall, 90),
+        'wall_p90_ci_s': bootstrap_ci(wall, lambda v: percentile(v, 90)),
+        'wall_stdev_s': statistics.stdev(wall) if len(wall) > 1 else 0.0,
+        'user_median_s': statistics.median(benchmark.values('user_s')),
+        'sys_median_s': statistics.median(benchmark.values('sys_s')),
+        'max_rss_median_kb': statistics.median(benchmark.values('max_rss_kb')),
+    }
+    return ret
+
+
+def compare(base, other, alpha):
+    """Returns a comparison of |other|'s wall times against |base|'s."""
+    base_wall = base.values('wall_s')
+    other_wall = other.values('wall_s')
+    _, p_value = mann_whitney_u(other_wall, base_wall)
+    return {
+        'base': base.name,
+        'name': other.name,
+        'median_ratio': (
+            statistics.median(other_wall) / statistics.median(base_wall)
+        ),
+        'p_value': p_value,
+        'significant': p_value < alpha,
+    }
+
+
+def pick_comparisons(benchmarks):
+    """Returns a list of (base, other) benchmarks to compare.
+
+    When several revisions are benchmarked, each config is compared against
+    itself at the first revision. Otherwise, all configs are compared against
+    the first one.
+    """
+    by_config = len({b.rev for b in benchmarks}) > 1
+    bases = {}
+    ret = []
+    for b in benchmarks:
+        key = b.config if by_config else None
+        if key in bases:
+            ret.append((bases[key], b))
+        else:
+            bases[key] = b
+    return ret
+
+
+class _GitCheckout:
+    """Switches a git checkout between revisions, restoring it on exit."""
+
+    def __init__(self, repo, revs):
+        self._repo = repo
+        self._revs = revs
+        # Maps |revs| to commits, resolved before anything is checked out so
+        # that relative revisions (e.g. HEAD~1) are not affected by checkouts.
+        self._commits = {}
+        self._current = None
+        self._original = None
+
+    def _git(self, *args):
+        return subprocess.run(
+            ['git', '-C', self._repo, *args],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    def __enter__(self):
+        if self._git('status', '--porcelain', '--untracked-files=no'):
+            error(f'{self._repo} has local changes. Commit or stash them.')
+        # Restore the branch (if any) rather than leaving a detached HEAD.
+        self._original = self._git('rev-parse', '--abbrev-ref', 'HEAD')
+        if self._original == 'HEAD':
+            self._original = self._git('rev-parse', 'HEAD')
+        for rev in self._revs:
+            self._commits[rev] = self._git('rev-parse', '--verify', rev)
+        return self
+
+    def __exit__(self, *_):
+        self._git('checkout', '--quiet', self._original)
+
+    def checkout(self, rev):
+        commit = self._commits[rev]
+        if commit != self._current:
+            self._git('checkout', '--quiet', commit)
+            self._current = commit
+
+
+def build_file(output_dirs, file_path):
+    """Builds |file_path| and the generated inputs of its command."""
+    for output_dir in output_dirs:
+        subprocess.run(['autoninja', '-C', output_dir, file_path], check=True)
+
+
+def run_benchmarks(benchmarks, warmup, runs):
+    """Runs each benchmark |runs| times after |warmup| runs.
+
+    Iterations are interleaved across benchmarks so that drift in machine load
+    or thermal throttling affects all of them equally.
+    """
+    for iteration in range(-warmup, runs):
+        for benchmark in benchmarks:
+            run = run_once(benchmark.command)
+            if iteration >= 0:
+                benchmark.runs.append(run)
+            kind = 'warmup' if iteration < 0 else f'run {iteration + 1}/{runs}'
+            print(
+                f'{benchmark.name} ({kind}): {run.wall_s:.3f}s',
+                file=sys.stderr,
+            )
+
+
+def print_report(benchmarks, summaries, comparisons):
+    name_width = max(len(b.name) for b in benchmarks)
+    print(
+        f'{"name":<{name_width}}  {"median (95% CI)":>26}  '
+        f'{"p90 (95% CI)":>26}  {"user":>8}  {"sys":>8}  {"max RSS":>10}'
+    )
+    for benchmark in benchmarks:
+        s = summaries[benchmark.name]
+        median = '{:.3f}s ({:.3f}-{:.3f})'.format(
+            s['wall_median_s'], *s['wall_median_ci_s']
+        )
+        p90 = '{:.3f}s ({:.3f}-{:.3f})'.format(
+            s['wall_p90_s'], *s['wall_p90_ci_s']
+        )
+        rss_mb = s['max_rss_median_kb'] / 1024
+        print(
+            f'{benchmark.name:<{name_width}}  {median:>26}  {p90:>26}  '
+            f'{s["user_median_s"]:>7.3f}s  {s["sys_median_s"]:>7.3f}s  '
+            f'{rss_mb:>8.1f}MB'
+        )
+    for c in comparisons:
+        verdict = 'significant' if c['significant'] else 'not significant'
+        print(
+            f'{c["name"]} vs {c["base"]}: {c["median_ratio"]:.3f}x median '
+            f'(p={c["p_value"]:.4f}, {verdict})'
+        )
+
+
+def write_json(path, session, benchmarks, summaries, comparisons):
+    with open(path, 'w') as f:
+        json.dump(
+            {
+                **session,
+                'benchmarks': [
+                    {
+                        'name': b.name,
+                        'rev': b.rev,
+                        'command': b.command,
+                        'runs': [dataclasses.asdict(r) for r in b.runs],
+                        'summary': summaries[b.name],
+                    }
+                    for b in benchmarks
+                ],
+                'comparisons': comparisons,
+            },
+            f,
+            indent=2,
+        )
+
+
+def write_sqlite(path, session, benchmarks):
+    """Appends runs to a SQLite database so that sessions can be compared."""
+    with sqlite3.connect(path) as conn:
+        conn.executescript(_SQLITE_SCHEMA)
+        session_id = conn.execute(
+            'INSERT INTO sessions (start_time, file, warmup, runs) '
+            'VALUES (?, ?, ?, ?)',
+            (
+                session['start_time'],
+                session['file'],
+                session['warmup'],
+                session['runs'],
+            ),
+        ).lastrowid
+        for b in benchmarks:
+            benchmark_id = conn.execute(
+                'INSERT INTO benchmarks (session_id, name, rev, command) '
+                'VALUES (?, ?, ?, ?)',
+                (session_id, b.name, b.rev, b.command),
+            ).lastrowid
+            conn.executemany(
+                'INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (benchmark_id, i, r.wall_s, r.user_s, r.sys_s, r.max_rss_kb)
+                    for i, r in enumerate(b.runs)
+                ),
+            )
+    conn.close()
+
+
+def resolve_commands(args):
+    """Returns the commands to benchmark, keyed by config name."""
     file_path = args.file
     config = args.config
     includes = set(args.include.split(','))
@@ -47,22 +390,11 @@ def main(args, extra_args):
     excludes = set(args.exclude.split(','))
     excludes.discard('')
     seen = set()
-
-    print(f'Benchmarking build of {file_path}')
-    hyperfine = shutil.which('hyperfine')
-    if hyperfine is None:
-        error(
-            'This tool depends on hyperfine. See '
-            + 'https://github.com/sharkdp/hyperfine?tab=readme-ov-file#installation'
-        )
-
-    cmd = [hyperfine, *extra_args, '--shell=bash']
+    commands = {}
 
     def add_command(name, command_str):
-        if name not in args.exclude and (
-            name in args.include or not args.include
-        ):
-            cmd.extend(['-n', name, command_str])
+        if name not in excludes and (name in includes or not includes):
+            commands[name] = command_str
         seen.add(name)
 
     if not config:
@@ -88,8 +420,65 @@ def main(args, extra_args):
     unused = (includes | excludes) - seen
     if unused:
         error(f'Referring to nonexistent benchmark names: {sorted(unused)}')
+    if not commands:
+        error('No benchmarks to run')
+    return commands
 
-    os.execv(cmd[0], cmd)
+
+def main(args):
+    file_path = args.file
+    if args.output and args.output.suffix not in ('.json', '.sqlite', '.db'):
+        error('--output must be a .json, .sqlite or .db file')
+    if args.runs < 2:
+        error('--runs must be at least 2')
+
+    print(f'Benchmarking build of {file_path}')
+
+    session = {
+        'start_time': time.time(),
+        'file': file_path,
+        'warmup': args.warmup,
+        'runs': args.runs,
+    }
+    if args.revs:
+        benchmarks = []
+        with _GitCheckout(args.git_repo, args.revs) as checkout:
+            # Each revision is checked out and built once, so that neither the
+            # checkout nor stale generated inputs affect its timings. Its
+            # command is resolved again since it may differ between revisions.
+            for rev in args.revs:
+                checkout.checkout(rev)
+                build_file(args.output_dirs, file_path)
+                rev_benchmarks = [
+                    Benchmark(
+                        name=f'{name}@{rev}',
+                        command=command,
+                        rev=rev,
+                        config=name,
+                    )
+                    for name, command in resolve_commands(args).items()
+                ]
+                run_benchmarks(rev_benchmarks, args.warmup, args.runs)
+                benchmarks += rev_benchmarks
+    else:
+        benchmarks = [
+            Benchmark(name=name, command=command, config=name)
+            for name, command in resolve_commands(args).items()
+        ]
+        run_benchmarks(benchmarks, args.warmup, args.runs)
+
+    summaries = {b.name: summarize(b) for b in benchmarks}
+    comparisons = [
+        compare(base, b, args.alpha) for base, b in pick_comparisons(benchmarks)
+    ]
+    print_report(benchmarks, summaries, comparisons)
+
+    if args.output:
+        if args.output.suffix == '.json':
+            write_json(args.output, session, benchmarks, summaries, comparisons)
+        else:
+            write_sqlite(args.output, session, benchmarks)
+        print(f'Wrote results to {args.output}')
 
 
 if __name__ == '__main__':
@@ -126,5 +515,45 @@ if __name__ == '__main__':
         default='',
         help='Skip running the config with the specified names (comma-seperated)',
     )
+    parser.add_argument(
+        '-w',
+        '--warmup',
+        type=int,
+        default=1,
+        help='Number of untimed runs of each benchmark before timing',
+    )
+    parser.add_argument(
+        '-r',
+        '--runs',
+        type=int,
+        default=10,
+        help='Number of timed runs of each benchmark',
+    )
+    parser.add_argument(
+        '--rev',
+        action='append',
+        dest='revs',
+        help='Git revision to benchmark each config at. Can be repeated to '
+        'compare revisions. Each revision is checked out and its file built '
+        'before its runs. The checkout is restored afterwards.',
+    )
+    parser.add_argument(
+        '--git-repo',
+        default='.',
+        help='The git checkout that --rev applies to',
+    )
+    parser.add_argument(
+        '--alpha',
+        type=float,
+        default=0.05,
+        help='Significance level when comparing against the first benchmark',
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        type=pathlib.Path,
+        help='Write results to a .json file, or append them to a .sqlite / '
+        '.db file',
+    )
 
-    main(*parser.parse_known_args())
+    main(parser.parse_args())
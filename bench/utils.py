@@ -2,8 +2,11 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import abc
 import importlib
+import itertools
 import pathlib
+import sqlite3
 import subprocess
 import sys
 import tempfile
@@ -11,6 +14,10 @@ import tempfile
 _SRC = pathlib.Path(__file__).parent.parent.parent
 _PROTO_DIR = _SRC / 'build/bench/protos'
 
+# Rows are written to result sinks in batches of this size, so that results
+# never need to be held in memory all at once.
+_SINK_BATCH_SIZE = 10000
+
 # This ensures that we can import google.protobuf.
 sys.path.append(str(_SRC / 'third_party/protobuf/python'))
 
@@ -77,3 +84,122 @@ class CapacitorFile:
 
     def __repr__(self):
         return repr(self.out)
+
+
+class ResultSink(abc.ABC):
+    """Somewhere to write tables of results to.
+
+    Tables are declared with add_table() and then rows (tuples in column order)
+    are streamed to them with write(), which can be called multiple times per
+    table.
+    """
+
+    def __init__(self, out: pathlib.Path):
+        self.out = out
+        self._columns = {}
+
+    def add_table(self, name: str, columns: dict[str, type]):
+        """Declares a table whose columns map to int, float or str."""
+        self._columns[name] = columns
+
+    @abc.abstractmethod
+    def write(self, table: str, rows): ...
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __str__(self):
+        return str(self.out)
+
+
+class SqliteSink(ResultSink):
+    """Writes results to a new SQLite database."""
+
+    _TYPES = {int: 'INTEGER', float: 'REAL', str: 'TEXT'}
+
+    def __init__(self, out: pathlib.Path):
+        super().__init__(out)
+        out.unlink(missing_ok=True)
+        self._conn = sqlite3.connect(out)
+        # The database is written in one go, so there is no need for
+        # durability until it has been fully written.
+        self._conn.execute('PRAGMA journal_mode=OFF')
+        self._conn.execute('PRAGMA synchronous=OFF')
+
+    def add_table(self, name, columns):
+        super().add_table(name, columns)
+        column_defs = ', '.join(
+            f'{col} {self._TYPES[t]}' for col, t in columns.items()
+        )
+        self._conn.execute(f'CREATE TABLE {name} ({column_defs})')
+
+    def write(self, table, rows):
+        placeholders = ', '.join('?' * len(self._columns[table]))
+        # executemany() consumes |rows| lazily.
+        self._conn.executemany(
+            f'INSERT INTO {table} VALUES ({placeholders})', rows
+        )
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+class ParquetSink(ResultSink):
+    """Writes results to a directory containing a .parquet file per table."""
+
+    def __init__(self, out: pathlib.Path):
+        super().__init__(out)
+        try:
+            # pylint: disable=import-outside-toplevel
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            error('Writing .parquet requires pyarrow (pip install pyarrow)')
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._types = {
+            int: pyarrow.int64(),
+            float: pyarrow.float64(),
+            str: pyarrow.string(),
+        }
+        self._writers = {}
+        out.mkdir(parents=True, exist_ok=True)
+
+    def add_table(self, name, columns):
+        super().add_table(name, columns)
+        schema = self._pa.schema(
+            [(col, self._types[t]) for col, t in columns.items()]
+        )
+        self._writers[name] = self._pq.ParquetWriter(
+            self.out / f'{name}.parquet', schema
+        )
+
+    def write(self, table, rows):
+        writer = self._writers[table]
+        rows = iter(rows)
+        while batch := list(itertools.islice(rows, _SINK_BATCH_SIZE)):
+            writer.write_batch(
+                self._pa.record_batch(list(zip(*batch)), schema=writer.schema)
+            )
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+
+def open_sink(out: pathlib.Path) -> ResultSink:
+    """Returns a sink for the given output path, based on its extension."""
+    if not out.parent.resolve().is_dir():
+        error(f'{out.parent} is not a directory')
+    if out.suffix in ('.sqlite', '.db'):
+        return SqliteSink(out)
+    if out.suffix == '.parquet':
+        return ParquetSink(out)
+    error(f'Output must be a .sqlite, .db or .parquet path. Got {out}')
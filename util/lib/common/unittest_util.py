@@ -5,6 +5,7 @@
 """Utilities for dealing with the python unittest module."""
 
 import fnmatch
+import os
 import re
 import sys
 import unittest
@@ -126,6 +127,120 @@ def FilterTests(all_tests, gtest_filter):
     return [test for test in all_tests if GetTestName(test) in filtered_names]
 
 
+def _ParseGtestFilter(gtest_filter):
+    """Returns the (positive, negative) patterns of a gtest filter."""
+    pattern_groups = gtest_filter.split('-')
+    positive_patterns = ['*']
+    if pattern_groups[0]:
+        positive_patterns = pattern_groups[0].split(':')
+    negative_patterns = []
+    if len(pattern_groups) > 1:
+        negative_patterns = pattern_groups[1].split(':')
+    return positive_patterns, negative_patterns
+
+
+def _IsLiteralPattern(pattern):
+    return not any(c in pattern for c in '*?[')
+
+
+class GtestFilter:
+    """A gtest filter compiled for matching many test names.
+
+    Matches the same tests as FilterTestNames(), but all patterns are compiled
+    up front: patterns without wildcards are looked up in a dict, and the rest
+    are combined into a single regular expression per polarity. Thread-safe.
+    """
+
+    def __init__(self, gtest_filter):
+        self.gtest_filter = gtest_filter
+        positive_patterns, negative_patterns = _ParseGtestFilter(gtest_filter)
+
+        # Positive patterns are matched as by fnmatch.fnmatch().
+        positive_patterns = [os.path.normcase(p) for p in positive_patterns]
+        # Map of literal pattern -> index of its first occurrence.
+        self._positive_literals = {}
+        positive_regexes = []
+        self._positive_group_indices = {}
+        for i, pattern in enumerate(positive_patterns):
+            if _IsLiteralPattern(pattern):
+                self._positive_literals.setdefault(pattern, i)
+            else:
+                group_name = 'p%d' % i
+                self._positive_group_indices[group_name] = i
+                positive_regexes.append(
+                    '(?P<%s>%s)' % (group_name, fnmatch.translate(pattern))
+                )
+        # Alternatives are tried in order, so a match is for the first pattern.
+        self._positive_re = None
+        if positive_regexes:
+            self._positive_re = re.compile('|'.join(positive_regexes))
+
+        self._negative_literals = frozenset(
+            p for p in negative_patterns if _IsLiteralPattern(p)
+        )
+        negative_regexes = [
+            fnmatch.translate(p)
+            for p in negative_patterns
+            if not _IsLiteralPattern(p)
+        ]
+        self._negative_re = None
+        if negative_regexes:
+            self._negative_re = re.compile('|'.join(negative_regexes))
+
+    def _PositiveIndex(self, test):
+        """Returns the index of the first positive pattern matching |test|."""
+        test = os.path.normcase(test)
+        ret = self._positive_literals.get(test)
+        if self._positive_re:
+            m = self._positive_re.match(test)
+            if m:
+                index = self._positive_group_indices[m.lastgroup]
+                if ret is None or index < ret:
+                    ret = index
+        return ret
+
+    def _IsExcluded(self, test):
+        return test in self._negative_literals or bool(
+            self._negative_re and self._negative_re.match(test)
+        )
+
+    def Match(self, test, test_stripped=None):
+        """Matches a test name against the filter.
+
+        Args:
+          test: Test name.
+          test_stripped: Optional test name with prefixes stripped, which is
+            matched in addition to |test|.
+
+        Returns:
+          None if the test is filtered out. Otherwise, the index of the first
+          positive pattern that the test matches.
+        """
+        names = [test]
+        if test_stripped not in (None, test):
+            names.append(test_stripped)
+        if any(self._IsExcluded(n) for n in names):
+            return None
+        indices = [i for i in map(self._PositiveIndex, names) if i is not None]
+        return min(indices) if indices else None
+
+    def Filter(self, all_tests, test_name_stripped_func=None):
+        """Returns the same list as FilterTestNames() would."""
+        matches = []
+        for order, test in enumerate(all_tests):
+            test_stripped = (
+                test_name_stripped_func(test)
+                if test_name_stripped_func
+                else None
+            )
+            index = self.Match(test, test_stripped)
+            if index is not None:
+                matches.append((index, order, test))
+        # Tests are grouped by the first positive pattern that they match.
+        matches.sort()
+        return [test for _, _, test in matches]
+
+
 def FilterTestNames(all_tests, gtest_filter, test_name_stripped_func=None):
     """Filter a list of test names based on the given gtest filter.
 
@@ -141,13 +256,7 @@ def FilterTestNames(all_tests, gtest_filter, test_name_stripped_func=None):
     Returns:
       Filtered subset of the given list of test names.
     """
-    pattern_groups = gtest_filter.split('-')
-    positive_patterns = ['*']
-    if pattern_groups[0]:
-        positive_patterns = pattern_groups[0].split(':')
-    negative_patterns = []
-    if len(pattern_groups) > 1:
-        negative_patterns = pattern_groups[1].split(':')
+    positive_patterns, negative_patterns = _ParseGtestFilter(gtest_filter)
 
     neg_pats = None
     if negative_patterns:
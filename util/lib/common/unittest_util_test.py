@@ -95,6 +95,53 @@ class FilterTestNamesTest(unittest.TestCase):
         self.assertEquals(x, ["Suite.PRE_Test"])
 
 
+class GtestFilterTest(unittest.TestCase):
+    possible_list = FilterTestNamesTest.possible_list + [
+        "Foo.PRE_One",
+        "Bar.DISABLED_Two",
+    ]
+
+    def _CheckSameAsFilterTestNames(self, gtest_filter):
+        def strip_pre(test):
+            return test.replace("PRE_", "")
+
+        for func in (None, strip_pre):
+            self.assertEqual(
+                unittest_util.GtestFilter(gtest_filter).Filter(
+                    self.possible_list, test_name_stripped_func=func
+                ),
+                unittest_util.FilterTestNames(
+                    self.possible_list,
+                    gtest_filter,
+                    test_name_stripped_func=func,
+                ),
+                gtest_filter,
+            )
+
+    def testSameAsFilterTestNames(self):
+        for gtest_filter in (
+            "",
+            "*",
+            "Foo.One",
+            "Foo.One:Bar.*",
+            "*.Two:Foo.One:Foo.*",
+            "Foo.*:*.One-Foo.One",
+            "-*.Three:Bar.DISABLED_Two",
+            "Q*.T[wh]*:Foo.One-Foo.PRE_One",
+            "*.One:*.One:Foo.One",
+        ):
+            self._CheckSameAsFilterTestNames(gtest_filter)
+
+    def testMatch(self):
+        gtest_filter = unittest_util.GtestFilter("Foo.One:Bar.*-*.Three")
+        self.assertEqual(gtest_filter.Match("Foo.One"), 0)
+        self.assertEqual(gtest_filter.Match("Bar.One"), 1)
+        self.assertIsNone(gtest_filter.Match("Bar.Three"))
+        self.assertIsNone(gtest_filter.Match("Quux.One"))
+        self.assertEqual(gtest_filter.Match("Foo.PRE_One", "Foo.One"), 0)
+        self.assertIsNone(gtest_filter.Match("Bar.PRE_Three", "Bar.Three"))
+
+
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.DEBUG)
     unittest.main(verbosity=2)
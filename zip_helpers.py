@@ -3,14 +3,32 @@
 # found in the LICENSE file.
 """Helper functions for dealing with .zip files."""
 
+import io
 import os
 import pathlib
 import posixpath
+import shutil
 import stat
+import struct
+import tempfile
 import time
 import zipfile
 
 _FIXED_ZIP_HEADER_LEN = 30
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+# Offsets of the filename / extra field lengths within a local file header.
+_LOCAL_HEADER_NAME_LEN_OFFSET = 26
+_COPY_CHUNK_SIZE = 1024 * 1024
+# Bit 0 of the general purpose flags marks an encrypted entry.
+_FLAG_ENCRYPTED = 0x1
+# Private ZipFile attributes that _copy_raw_entry() uses.
+_RAW_COPY_ZIPFILE_ATTRS = (
+    'fp',
+    '_seekable',
+    'start_dir',
+    '_writecheck',
+    '_didModify',
+)
 
 
 def _set_alignment(zip_obj, zip_info, alignment):
@@ -45,6 +63,19 @@ def _hermetic_date_time(timestamp=None):
     )
 
 
+def _check_zip_path(zip_path):
+    # Filenames can contain backslashes, but it is more likely that we've
+    # forgotten to use forward slashes as a directory separator.
+    assert '\\' not in zip_path, 'zip_path should not contain \\: ' + zip_path
+    assert not posixpath.isabs(zip_path), 'Absolute zip path: ' + zip_path
+    assert not zip_path.startswith('..'), (
+        'Should not start with ..: ' + zip_path
+    )
+    assert posixpath.normpath(zip_path) == zip_path, (
+        f'Non-canonical zip_path: {zip_path} vs: {posixpath.normpath(zip_path)}'
+    )
+
+
 def add_to_zip_hermetic(
     zip_file,
     zip_path,
@@ -84,17 +115,8 @@ def add_to_zip_hermetic(
     if alignment:
         _set_alignment(zip_file, zipinfo, alignment)
 
-    # Filenames can contain backslashes, but it is more likely that we've
-    # forgotten to use forward slashes as a directory separator.
-    assert '\\' not in zip_path, 'zip_path should not contain \\: ' + zip_path
-    assert not posixpath.isabs(zip_path), 'Absolute zip path: ' + zip_path
-    assert not zip_path.startswith('..'), (
-        'Should not start with ..: ' + zip_path
-    )
-    assert posixpath.normpath(zip_path) == zip_path, (
-        f'Non-canonical zip_path: {zip_path} vs: {posixpath.normpath(zip_path)}'
-    )
-    assert zip_path not in zip_file.namelist(), (
+    _check_zip_path(zip_path)
+    assert zip_path not in zip_file.NameToInfo, (
         'Tried to add a duplicate zip entry: ' + zip_path
     )
 
@@ -204,8 +226,144 @@ def zip_directory(output, base_dir, **kwargs):
     add_files_to_zip(inputs, output, base_dir=base_dir, **kwargs)
 
 
+def _seek_to_entry_data(fp, info, zip_name):
+    """Seeks |fp| to the data of |info|, which follows its local file header."""
+    fp.seek(info.header_offset)
+    header = fp.read(_FIXED_ZIP_HEADER_LEN)
+    if header[:4] != _LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(
+            f'Bad local file header for {info.filename} in {zip_name}'
+        )
+    name_len, extra_len = struct.unpack_from(
+        '<HH', header, _LOCAL_HEADER_NAME_LEN_OFFSET
+    )
+    return fp.seek(name_len + extra_len, os.SEEK_CUR)
+
+
+class _FileRange(io.RawIOBase):
+    """Read-only, seekable view of a range of bytes within a file."""
+
+    def __init__(self, path, start, size):
+        super().__init__()
+        self._file = open(path, 'rb')
+        self._start = start
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError(f'Negative seek position {offset}')
+        self._pos = offset
+        return offset
+
+    def readinto(self, b):
+        size = max(0, min(len(b), self._size - self._pos))
+        self._file.seek(self._start + self._pos)
+        size = self._file.readinto(memoryview(b)[:size])
+        self._pos += size
+        return size
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_entry_file(zip_path, info):
+    """Returns a seekable, read-only file object for an entry's contents.
+
+    Useful for zips within zips (e.g. splits within an .apks), which can then be
+    opened with zipfile without reading them into memory. Uncompressed entries
+    are read directly from |zip_path|. Others are extracted to a temp file.
+
+    Args:
+      zip_path: Path to the zip file.
+      info: ZipInfo of the entry, from a ZipFile for |zip_path|.
+    """
+    if info.compress_type != zipfile.ZIP_STORED:
+        ret = tempfile.TemporaryFile()
+        with zipfile.ZipFile(zip_path) as z, z.open(info) as f:
+            shutil.copyfileobj(f, ret, _COPY_CHUNK_SIZE)
+        ret.seek(0)
+        return ret
+    with open(zip_path, 'rb') as f:
+        start = _seek_to_entry_data(f, info, zip_path)
+    return _FileRange(zip_path, start, info.file_size)
+
+
+def _supports_raw_copy(out_zip):
+    """Whether _copy_raw_entry() can write to |out_zip|.
+
+    zipfile has no public API for writing already-compressed data, so
+    _copy_raw_entry() relies on ZipFile internals. Callers fall back to
+    decompressing and recompressing if a Python version lacks them.
+    """
+    return all(hasattr(out_zip, a) for a in _RAW_COPY_ZIPFILE_ATTRS)
+
+
+def _copy_raw_entry(out_zip, in_zip, info, dst_name):
+    """Copies the still-compressed data of |info| from |in_zip| to |out_zip|.
+
+    Only the local file header is rewritten (with a hermetic timestamp and a new
+    offset). Entry data is streamed in chunks and never decompressed.
+    Requires _supports_raw_copy(out_zip).
+    """
+    _check_zip_path(dst_name)
+    assert dst_name not in out_zip.NameToInfo, (
+        'Tried to add a duplicate zip entry: ' + dst_name
+    )
+    in_fp = in_zip.fp
+    _seek_to_entry_data(in_fp, info, in_zip.filename)
+
+    zipinfo = zipfile.ZipInfo(filename=dst_name)
+    zipinfo.external_attr = 0o644 << 16
+    zipinfo.date_time = _hermetic_date_time()
+    zipinfo.compress_type = info.compress_type
+    zipinfo.CRC = info.CRC
+    zipinfo.compress_size = info.compress_size
+    zipinfo.file_size = info.file_size
+
+    if out_zip._seekable:
+        out_zip.fp.seek(out_zip.start_dir)
+    zipinfo.header_offset = out_zip.fp.tell()
+    out_zip._writecheck(zipinfo)
+    out_zip._didModify = True
+    out_zip.fp.write(zipinfo.FileHeader())
+
+    remaining = info.compress_size
+    while remaining:
+        chunk = in_fp.read(min(remaining, _COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(
+                f'Truncated entry {info.filename} in {in_zip.filename}'
+            )
+        out_zip.fp.write(chunk)
+        remaining -= len(chunk)
+
+    out_zip.start_dir = out_zip.fp.tell()
+    out_zip.filelist.append(zipinfo)
+    out_zip.NameToInfo[zipinfo.filename] = zipinfo
+
+
 def merge_zips(
-    output, input_zips, path_transform=None, compress=None, compress_level=1
+    output,
+    input_zips,
+    path_transform=None,
+    compress=None,
+    compress_level=1,
+    raw_copy=True,
 ):
     """Combines all files from |input_zips| into |output|.
 
@@ -215,7 +373,13 @@ def merge_zips(
       path_transform: Called for each entry path. Returns a new zip path, or None
           to skip the file.
       compress: Overrides compression setting from origin zip entries.
-      compress_level: When compress=True, level of compression.
+      compress_level: Level of compression of entries that are (re)compressed.
+      raw_copy: When |compress| is None, copy entries as-is (without
+          decompressing or recompressing them), so compressed entries keep
+          their original level rather than using |compress_level|. When
+          |compress| is False, uncompressed entries are copied as-is. Duplicates
+          of copied entries are detected using the CRCs from the input's central
+          directory.
     """
     assert not isinstance(input_zips, str)  # Easy mistake to make.
     if isinstance(output, zipfile.ZipFile):
@@ -230,6 +394,7 @@ def merge_zips(
     crc_by_name = {
         i.filename: (out_filename, i.CRC) for i in out_zip.infolist()
     }
+    raw_copy = raw_copy and _supports_raw_copy(out_zip)
 
     try:
         for in_file in input_zips:
@@ -245,13 +410,27 @@ def merge_zips(
                     else:
                         dst_name = info.filename
 
-                    data = in_zip.read(info)
+                    is_compressed = info.compress_type != zipfile.ZIP_STORED
+                    copy_entry = (
+                        raw_copy
+                        and (
+                            compress is None or not (compress or is_compressed)
+                        )
+                        and info.compress_type
+                        in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+                        and not info.flag_bits & _FLAG_ENCRYPTED
+                    )
+                    data = None
+                    if copy_entry:
+                        new_crc = info.CRC
+                    else:
+                        data = in_zip.read(info)
+                        new_crc = zipfile.crc32(data)
 
                     # If there's a duplicate file, ensure contents is the same and skip
                     # adding it multiple times.
                     if dst_name in crc_by_name:
                         orig_filename, orig_crc = crc_by_name[dst_name]
-                        new_crc = zipfile.crc32(data)
                         if new_crc == orig_crc:
                             continue
                         msg = f"""File appeared in multiple inputs with differing contents.
@@ -260,19 +439,20 @@ Input1: {orig_filename}
 Input2: {in_file}"""
                         raise Exception(msg)
 
-                    if compress is not None:
-                        compress_entry = compress
+                    if copy_entry:
+                        _copy_raw_entry(out_zip, in_zip, info, dst_name)
                     else:
-                        compress_entry = (
-                            info.compress_type != zipfile.ZIP_STORED
+                        if compress is not None:
+                            compress_entry = compress
+                        else:
+                            compress_entry = is_compressed
+                        add_to_zip_hermetic(
+                            out_zip,
+                            dst_name,
+                            data=data,
+                            compress=compress_entry,
+                            compress_level=compress_level,
                         )
-                    add_to_zip_hermetic(
-                        out_zip,
-                        dst_name,
-                        data=data,
-                        compress=compress_entry,
-                        compress_level=compress_level,
-                    )
                     crc_by_name[dst_name] = (
                         in_file,
                         out_zip.getinfo(dst_name).CRC,
@@ -9,6 +9,7 @@ import shutil
 import sys
 import tempfile
 import unittest
+from unittest import mock
 import zipfile
 
 import zip_helpers
@@ -53,6 +54,128 @@ class ZipHelpersTest(unittest.TestCase):
                 with zipfile.ZipFile(zip1, 'a') as dst_zip:
                     zip_helpers.merge_zips(dst_zip, [zip2])
 
+    def test_merge_zips__raw_copy(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src_zip = os.path.join(tmp_dir, 'src.zip')
+            with zipfile.ZipFile(src_zip, 'w') as z:
+                z.writestr('stored', 'S' * 100, zipfile.ZIP_STORED)
+                z.writestr(
+                    'deflated', 'D' * 100, zipfile.ZIP_DEFLATED, compresslevel=9
+                )
+            with zipfile.ZipFile(src_zip) as z:
+                src_infos = {i.filename: i for i in z.infolist()}
+
+            merged_zip = os.path.join(tmp_dir, 'merged.zip')
+            zip_helpers.merge_zips(merged_zip, [src_zip, src_zip])
+
+            with zipfile.ZipFile(merged_zip) as z:
+                self.assertEqual(z.namelist(), ['stored', 'deflated'])
+                self.assertEqual(z.testzip(), None)
+                self.assertEqual(z.read('deflated'), b'D' * 100)
+                for info in z.infolist():
+                    src_info = src_infos[info.filename]
+                    self.assertEqual(info.date_time, (2001, 1, 1, 0, 0, 0))
+                    self.assertEqual(info.compress_type, src_info.compress_type)
+                    self.assertEqual(info.compress_size, src_info.compress_size)
+                    self.assertEqual(info.CRC, src_info.CRC)
+
+    def test_merge_zips__raw_copy_matches_recompress(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip1, zip2 = _make_test_zips(tmp_dir)
+
+            raw_zip = os.path.join(tmp_dir, 'raw.zip')
+            zip_helpers.merge_zips(raw_zip, [zip1, zip2])
+            recompressed_zip = os.path.join(tmp_dir, 'recompressed.zip')
+            zip_helpers.merge_zips(
+                recompressed_zip, [zip1, zip2], raw_copy=False
+            )
+
+            self.assertEqual(
+                pathlib.Path(raw_zip).read_bytes(),
+                pathlib.Path(recompressed_zip).read_bytes(),
+            )
+
+    def test_merge_zips__compress_override(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src_zip = os.path.join(tmp_dir, 'src.zip')
+            with zipfile.ZipFile(src_zip, 'w') as z:
+                z.writestr('stored', 'S' * 100, zipfile.ZIP_STORED)
+
+            merged_zip = os.path.join(tmp_dir, 'merged.zip')
+            zip_helpers.merge_zips(merged_zip, [src_zip], compress=True)
+
+            with zipfile.ZipFile(merged_zip) as z:
+                info = z.getinfo('stored')
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(z.read(info), b'S' * 100)
+
+    def test_merge_zips__raw_copy_with_append(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip1, zip2 = _make_test_zips(tmp_dir)
+
+            with zipfile.ZipFile(zip1, 'a') as dst_zip:
+                zip_helpers.merge_zips(dst_zip, [zip2])
+
+            with zipfile.ZipFile(zip1) as z:
+                self.assertEqual(z.namelist(), ['file1', 'file2', 'file3'])
+                self.assertEqual(z.read('file3'), b'CCCCC')
+                self.assertEqual(z.testzip(), None)
+
+    def test_merge_zips__compress_uses_compress_level(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src_zip = os.path.join(tmp_dir, 'src.zip')
+            data = bytes(range(256)) * 64
+            with zipfile.ZipFile(src_zip, 'w') as z:
+                z.writestr('deflated', data, zipfile.ZIP_DEFLATED, 1)
+
+            merged_zip = os.path.join(tmp_dir, 'merged.zip')
+            zip_helpers.merge_zips(
+                merged_zip, [src_zip], compress=True, compress_level=9
+            )
+
+            with zipfile.ZipFile(src_zip) as z:
+                src_size = z.getinfo('deflated').compress_size
+            with zipfile.ZipFile(merged_zip) as z:
+                info = z.getinfo('deflated')
+                self.assertLess(info.compress_size, src_size)
+                self.assertEqual(z.read(info), data)
+
+    def test_merge_zips__without_raw_copy_support(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip1, zip2 = _make_test_zips(tmp_dir)
+
+            raw_zip = os.path.join(tmp_dir, 'raw.zip')
+            zip_helpers.merge_zips(raw_zip, [zip1, zip2])
+            fallback_zip = os.path.join(tmp_dir, 'fallback.zip')
+            with mock.patch.object(
+                zip_helpers, '_RAW_COPY_ZIPFILE_ATTRS', ('_no_such_attr',)
+            ):
+                zip_helpers.merge_zips(fallback_zip, [zip1, zip2])
+
+            self.assertEqual(
+                pathlib.Path(raw_zip).read_bytes(),
+                pathlib.Path(fallback_zip).read_bytes(),
+            )
+
+    def test_open_entry_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inner_zip, _ = _make_test_zips(tmp_dir)
+            outer_zip = os.path.join(tmp_dir, 'outer.zip')
+            with zipfile.ZipFile(outer_zip, 'w') as z:
+                z.writestr('prefix', 'P' * 100)
+                z.write(inner_zip, 'stored.zip')
+                z.write(inner_zip, 'deflated.zip', zipfile.ZIP_DEFLATED)
+
+            with zipfile.ZipFile(outer_zip) as z:
+                infos = [z.getinfo('stored.zip'), z.getinfo('deflated.zip')]
+            for info in infos:
+                with zip_helpers.open_entry_file(outer_zip, info) as f:
+                    self.assertEqual(
+                        f.read(), pathlib.Path(inner_zip).read_bytes()
+                    )
+                    with zipfile.ZipFile(f) as z:
+                        self.assertEqual(z.read('file2'), b'BBBBB')
+
 
 if __name__ == '__main__':
     unittest.main()